@@ -0,0 +1,180 @@
+"""
+User Activity Heartbeats (write-behind)
+Every authenticated request marks its user as active in memory; the latest
+timestamp per user is written to users.last_activity in one bulk_write every
+few seconds, instead of one update per request (or only at login).
+Recent activity is also kept in a PresenceIndex, which answers online stats
+"""
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from presence import PresenceIndex
+
+
+class ActivityBuffer:
+    """
+    user id -> last activity (epoch seconds)
+    - touch() is a dict assignment on the event loop: no I/O, no lock
+    - Pending timestamps are coalesced per user and flushed with $max, so a
+      late or repeated flush never moves last_activity backwards
+    - Failed flushes keep their timestamps for the next attempt
+    - The users seen during the last `window` seconds are kept in a
+      PresenceIndex for online stats. start() seeds it from users.last_activity;
+      if that fails it is complete once the buffer has been running for a full
+      window (covers()). Each worker only sees its own requests: with several
+      workers set ACTIVITY_LOCAL_STATS=0 so online stats read MongoDB
+    - forget() drops deleted/deactivated accounts, so the online count agrees
+      with the online list (which filters deleted users in MongoDB)
+    """
+
+    def __init__(self, flush_interval: float = 5.0, window: float = 300.0,
+                 bucket_seconds: float = 10.0, local_stats: bool = True):
+        self.flush_interval = flush_interval
+        self.window = window
+        self.local_stats = local_stats
+        self.collection = None
+        self._pending: Dict[str, float] = {}
+        # email -> user id, admin routes may identify users by email
+        self._ids_by_email: Dict[str, str] = {}
+        self.presence = PresenceIndex(window, bucket_seconds)
+        self._started_at: Optional[float] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.touches = 0
+        self.written = 0
+        self.failed_flushes = 0
+
+    def touch(self, user_id: str, email: Optional[str] = None):
+        """Record activity of a user (called on every authenticated request)"""
+        now = time.time()
+        if email:
+            self._ids_by_email[email] = user_id
+        self._pending[user_id] = now
+        self.presence.touch(user_id, now)
+        self.touches += 1
+
+    def forget(self, identifier: Any) -> bool:
+        """
+        Remove a deleted/deactivated user (by id or email) from online stats
+        Call wherever session_cache.invalidate_user runs for such accounts
+        """
+        identifier = str(identifier)
+        user_id = self._ids_by_email.pop(identifier, identifier)
+        return self.presence.remove(user_id)
+
+    async def flush(self) -> int:
+        """Write pending timestamps with one bulk_write, returns how many users were updated"""
+        pending, self._pending = self._pending, {}
+        if not pending or self.collection is None:
+            return 0
+
+        operations = []
+        for user_id, seen in pending.items():
+            try:
+                user_key = ObjectId(user_id)
+            except (InvalidId, TypeError):
+                continue
+            operations.append(UpdateOne(
+                {"_id": user_key},
+                {"$max": {"last_activity": datetime.fromtimestamp(seen, timezone.utc)}}
+            ))
+        if not operations:
+            return 0
+
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            self.failed_flushes += 1
+            print(f"⚠️ Error writing activity heartbeats ({len(operations)} users): {e}")
+            # Keep them for the next flush unless a newer touch already replaced them
+            for user_id, seen in pending.items():
+                if seen > self._pending.get(user_id, 0):
+                    self._pending[user_id] = seen
+            return 0
+        self.written += len(operations)
+        return len(operations)
+
+    def covers(self, seconds: float) -> bool:
+        """True when in-memory activity is complete for the last `seconds`"""
+        return (
+            self.local_stats
+            and self._started_at is not None
+            and seconds <= self.window
+            and time.time() - self._started_at >= seconds
+        )
+
+    def online_count(self, seconds: float) -> int:
+        """Users active during the last `seconds`"""
+        return self.presence.count(seconds)
+
+    def active_since(self, seconds: float) -> Dict[str, datetime]:
+        """Users active during the last `seconds` -> last activity (UTC)"""
+        return self.presence.active_since(seconds)
+
+    async def _seed(self):
+        """Load the users active during the last window from MongoDB (cold start)"""
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.window)
+        cursor = self.collection.find(
+            {"last_activity": {"$gte": since}, "deleted": {"$ne": True}},
+            {"_id": 1, "last_activity": 1}
+        )
+        async for user in cursor:
+            seen = user["last_activity"]
+            if seen.tzinfo is None:
+                seen = seen.replace(tzinfo=timezone.utc)
+            self.presence.touch(str(user["_id"]), seen.timestamp())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self, collection):
+        """Seed presence from MongoDB and start the flush loop (call on app startup)"""
+        self.collection = collection
+        if self._started_at is None:
+            self._started_at = time.time()
+            if self.local_stats:
+                try:
+                    await self._seed()
+                    # Seeded: memory already covers the whole window
+                    self._started_at -= self.window
+                    print(f"✅ Presença: {len(self.presence)} usuários ativos carregados do MongoDB")
+                except Exception as e:
+                    print(f"⚠️ Presença: falha ao carregar atividade recente ({e}), usando MongoDB por {self.window:.0f}s")
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the flush loop and write everything still pending"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "tracked_users": len(self.presence),
+            "touches": self.touches,
+            "written": self.written,
+            "failed_flushes": self.failed_flushes,
+            "serving_online_stats": self.covers(self.window)
+        }
+
+
+# Global activity buffer (started/closed by the server)
+activity_buffer = ActivityBuffer(
+    flush_interval=float(os.environ.get("ACTIVITY_FLUSH_INTERVAL_SECONDS", "5")),
+    window=float(os.environ.get("ACTIVITY_WINDOW_SECONDS", "300")),
+    bucket_seconds=float(os.environ.get("ACTIVITY_BUCKET_SECONDS", "10")),
+    local_stats=os.environ.get("ACTIVITY_LOCAL_STATS", "1") == "1"
+)
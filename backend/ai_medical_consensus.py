@@ -5,10 +5,15 @@ Production-ready implementation with Emergent Universal Key
 """
 import os
 import asyncio
-from typing import Dict, List, Any, Optional
-from emergentintegrations.llm.chat import LlmChat, UserMessage
-import json
+from typing import Dict, List, Any, Optional, Union
 from dotenv import load_dotenv
+from llm_client import llm_client
+from llm_response_parser import extract_json, extract_json_checked
+from ai_engine import (
+    DiagnosisResult, InteractionResult, MedicationGuideResult, MedicationItem, ToxicologyResult
+)
+from response_cache import response_cache
+from drug_canonical import canonical_drug_set
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +26,10 @@ if not EMERGENT_KEY:
 # Gemini 2.5 Flash model (latest and fastest)
 GEMINI_MODEL = "gemini-2.5-flash"
 
+# Bump when any prompt changes so cached answers from old prompts are not reused
+PROMPT_VERSION = "2"
+CACHE_VERSION = f"{GEMINI_MODEL}:{PROMPT_VERSION}"
+
 MEDICAL_SYSTEM_PROMPT = """Você é um assistente clínico especializado para MÉDICOS PROFISSIONAIS. Este sistema é usado por médicos durante consultas. Forneça análise técnica detalhada:
 
 1. **Diagnósticos Diferenciais** (3-5 hipóteses mais prováveis)
@@ -75,13 +84,6 @@ async def analyze_diagnosis(queixa: str, idade: str = "N/I", sexo: str = "N/I")
         Dict com diagnoses, conduct e medications
     """
     try:
-        # Create chat instance with Gemini 2.0 Flash
-        chat = LlmChat(
-            api_key=EMERGENT_KEY,
-            session_id=f"diagnosis_{os.urandom(8).hex()}",
-            system_message=MEDICAL_SYSTEM_PROMPT
-        ).with_model("gemini", GEMINI_MODEL)
-        
         # Prepare prompt
         user_prompt = f"""
 Paciente: {idade} anos, sexo {sexo}
@@ -90,38 +92,14 @@ Queixa Principal: {queixa}
 Forneça análise clínica completa no formato JSON especificado.
 """
         
-        # Send message
-        user_message = UserMessage(text=user_prompt)
-        response = await chat.send_message(user_message)
-        
-        # Parse JSON response
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
+        # Send message through the shared client
+        response = await llm_client.send(
+            user_prompt, MEDICAL_SYSTEM_PROMPT, model=GEMINI_MODEL, session_prefix="diagnosis"
+        )
         
-        return result
+        # Parse JSON response (truncated answers are repaired when possible)
+        return extract_json(response, DiagnosisResult)
         
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-        print(f"Response was: {response}")
-        # Fallback response
-        return {
-            "diagnoses": [
-                {
-                    "name": "Análise Incompleta",
-                    "justification": "Não foi possível processar a resposta completa. Por favor, tente novamente."
-                }
-            ],
-            "conduct": {
-                "advice": "Consulte um médico para avaliação completa.",
-                "procedures": []
-            },
-            "medications": []
-        }
     except Exception as e:
         print(f"Error in analyze_diagnosis: {e}")
         raise
@@ -136,6 +114,15 @@ async def analyze_drug_interaction(medications: List[str], patient_info: Optiona
         if not medications or len(medications) < 2:
             raise ValueError("Mínimo de 2 medicamentos necessários")
         
+        # Any permutation / spelling of the same prescription shares one entry
+        cache_key = response_cache.make_key(
+            "drug_interaction", CACHE_VERSION,
+            medications=canonical_drug_set(medications), patient_info=patient_info
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         medications_list = "\n".join([f"{i+1}. {med}" for i, med in enumerate(medications)])
         
         system_prompt = """Você é um farmacêutico clínico especializado auxiliando MÉDICOS PROFISSIONAIS. Analise a interação medicamentosa de TODOS os medicamentos fornecidos com detalhes técnicos:
@@ -161,12 +148,6 @@ Responda APENAS com JSON:
 }
 ```"""
         
-        chat = LlmChat(
-            api_key=EMERGENT_KEY,
-            session_id=f"interaction_{os.urandom(8).hex()}",
-            system_message=system_prompt
-        ).with_model("gemini", GEMINI_MODEL)
-        
         prompt = f"""
 MEDICAMENTOS A ANALISAR ({len(medications)} no total):
 {medications_list}
@@ -176,19 +157,18 @@ MEDICAMENTOS A ANALISAR ({len(medications)} no total):
 Analise TODAS as interações medicamentosas possíveis entre estes {len(medications)} medicamentos. Não analise apenas pares isolados - considere o efeito cumulativo e todas as combinações relevantes.
 """
         
-        response = await chat.send_message(UserMessage(text=prompt))
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
+        response = await llm_client.send(
+            prompt, system_prompt, model=GEMINI_MODEL, session_prefix="interaction"
+        )
+        result, repaired = extract_json_checked(response, InteractionResult)
         
         # Validate that severity is not an error message
         if "erro" in result.get("severity", "").lower():
             raise ValueError("Invalid severity returned")
         
+        # Answers repaired from a truncated response are not cached
+        if not repaired:
+            await response_cache.set(cache_key, result)
         return result
         
     except Exception as e:
@@ -202,6 +182,14 @@ async def analyze_medication_guide(condition: str, patient_age: str = "N/I", con
     Gera guia terapêutico usando Gemini 2.0 Flash
     """
     try:
+        cache_key = response_cache.make_key(
+            "medication_guide", CACHE_VERSION,
+            condition=condition, patient_age=patient_age, contraindications=contraindications
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         system_prompt = """Você é um médico clínico especializado auxiliando MÉDICOS PROFISSIONAIS. Forneça guia terapêutico técnico:
 
 1. **Opções Terapêuticas** (primeira linha, alternativas, adjuvantes)
@@ -226,12 +214,6 @@ Responda APENAS com JSON contendo um objeto com a chave "medications":
 
 Forneça 3-5 medicamentos mais adequados para o tratamento."""
         
-        chat = LlmChat(
-            api_key=EMERGENT_KEY,
-            session_id=f"medguide_{os.urandom(8).hex()}",
-            system_message=system_prompt
-        ).with_model("gemini", GEMINI_MODEL)
-        
         prompt = f"""
 Condição: {condition}
 Idade do Paciente: {patient_age}
@@ -240,34 +222,23 @@ Idade do Paciente: {patient_age}
 Forneça guia terapêutico.
 """
         
-        response = await chat.send_message(UserMessage(text=prompt))
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        result = json.loads(response_text)
+        response = await llm_client.send(
+            prompt, system_prompt, model=GEMINI_MODEL, session_prefix="medguide"
+        )
+        result, repaired = extract_json_checked(response, Union[MedicationGuideResult, List[MedicationItem]])
         
         # Return the medications array directly, or wrap in expected format
-        if isinstance(result, dict) and "medications" in result:
-            return result
-        elif isinstance(result, list):
-            return {"medications": result}
-        else:
-            return {"medications": []}
+        if not (isinstance(result, dict) and "medications" in result):
+            result = {"medications": result}
+        # Answers repaired from a truncated response are not cached
+        if not repaired:
+            await response_cache.set(cache_key, result)
+        return result
         
     except Exception as e:
         print(f"Error in analyze_medication_guide: {e}")
-        return {
-            "medications": [{
-                "name": "Sistema temporariamente indisponível",
-                "dose": "N/A",
-                "frequency": "N/A",
-                "route": "Consultar protocolo",
-                "notes": f"Consultar protocolos clínicos e guidelines atualizados. Erro: {str(e)}"
-            }]
-        }
+        # Re-raise so the task is retried / answered by the rule engine
+        raise
 
 
 async def analyze_toxicology(agent: str, exposure_route: Optional[str] = None, symptoms: Optional[str] = None) -> Dict[str, Any]:
@@ -275,6 +246,14 @@ async def analyze_toxicology(agent: str, exposure_route: Optional[str] = None, s
     Analisa caso toxicológico usando Gemini 2.0 Flash
     """
     try:
+        cache_key = response_cache.make_key(
+            "toxicology", CACHE_VERSION,
+            agent=agent, exposure_route=exposure_route, symptoms=symptoms
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         system_prompt = """Você é um toxicologista clínico auxiliando MÉDICOS PROFISSIONAIS em emergências. Forneça protocolo técnico:
 
 1. **Identificação do Agente** tóxico e classificação
@@ -293,12 +272,6 @@ Responda APENAS com JSON:
 }
 ```"""
         
-        chat = LlmChat(
-            api_key=EMERGENT_KEY,
-            session_id=f"tox_{os.urandom(8).hex()}",
-            system_message=system_prompt
-        ).with_model("gemini", GEMINI_MODEL)
-        
         prompt = f"""
 Agente: {agent}
 {f"Via de Exposição: {exposure_route}" if exposure_route else ""}
@@ -307,31 +280,19 @@ Agente: {agent}
 Analise o caso toxicológico.
 """
         
-        response = await chat.send_message(UserMessage(text=prompt))
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text.split("```json")[1].split("```")[0].strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.split("```")[1].split("```")[0].strip()
-        
-        return json.loads(response_text)
+        response = await llm_client.send(
+            prompt, system_prompt, model=GEMINI_MODEL, session_prefix="tox"
+        )
+        result, repaired = extract_json_checked(response, ToxicologyResult)
+        # Answers repaired from a truncated response are not cached
+        if not repaired:
+            await response_cache.set(cache_key, result)
+        return result
         
     except Exception as e:
         print(f"Error in analyze_toxicology: {e}")
-        return {
-            "agent": agent,
-            "antidote": "Sistema indisponível - consultar CIATOX ou protocolos locais",
-            "mechanism": f"Erro: {str(e)}",
-            "protocol": "Consultar protocolos específicos do CIATOX e diretrizes institucionais. Contato: 0800 722 6001 (Nacional) ou 0800 014 8110 (SP).",
-            "conduct": [
-                "Estabilização ABC (via aérea, respiração, circulação)",
-                "Descontaminação conforme via de exposição e tempo",
-                "Contato com Centro de Informações Toxicológicas: 0800 722 6001",
-                "Monitoramento de sinais vitais e função orgânica",
-                "Suporte específico baseado em toxidrome",
-                "Considerar hemodiálise se indicado"
-            ]
-        }
+        # Re-raise so the task is retried / answered by the rule engine
+        raise
 
 
 # Consensus functions for background task system
@@ -359,59 +320,9 @@ async def get_ai_consensus_toxicology(substance):
     return await analyze_toxicology(substance)
 
 
-async def analyze_dose_calculator(patient_data: Dict[str, Any], medications: List[Dict[str, str]]) -> Dict[str, Any]:
-    """
-    Calcula doses farmacológicas, diluições e prescrições
-    
-    Args:
-        patient_data: Dados opcionais do paciente (peso, idade, altura, condições especiais)
-        medications: Lista de medicações com nome, via (opcional) e indicação (opcional)
-        
-    Returns:
-        Dict com prescrição detalhada formatada em HTML
-    """
-    try:
-        # Generate unique session ID for this calculation
-        import uuid
-        session_id = str(uuid.uuid4())
-        
-        # Create chat instance with Gemini 2.0 Flash
-        chat = LlmChat(
-            api_key=EMERGENT_KEY,
-            session_id=session_id,
-            system_message="Você é um farmacologista clínico especializado para médicos especialistas. Forneça análises farmacológicas técnicas, baseadas em evidências científicas, com terminologia médica apropriada e referências a guidelines internacionais."
-        ).with_model("gemini", GEMINI_MODEL)
-        
-        # Build patient context
-        patient_context = ""
-        if patient_data.get("weight"):
-            patient_context += f"\n- Peso: {patient_data['weight']} kg"
-        if patient_data.get("age"):
-            patient_context += f"\n- Idade: {patient_data['age']}"
-        if patient_data.get("height"):
-            patient_context += f"\n- Altura: {patient_data['height']} cm"
-        if patient_data.get("sex"):
-            patient_context += f"\n- Sexo: {patient_data['sex']}"
-        if patient_data.get("specialConditions"):
-            patient_context += f"\n- Condições especiais: {patient_data['specialConditions']}"
-        
-        # Build medications list
-        meds_text = ""
-        for idx, med in enumerate(medications, 1):
-            meds_text += f"\n{idx}. {med['name']}"
-            if med.get('route'):
-                meds_text += f" - Via: {med['route']}"
-            if med.get('indication'):
-                meds_text += f" - Indicação: {med['indication']}"
-        
-        no_data_msg = "\n- Dados não informados"
-        prompt = f"""**ANÁLISE FARMACOLÓGICA PARA MÉDICOS ESPECIALISTAS**
-
-**DADOS DO PACIENTE:**{patient_context if patient_context else no_data_msg}
-
-**MEDICAÇÕES SOLICITADAS:**{meds_text}
-
----
+# Static template and guidelines live in the system prompt: identical on every
+# call, so its token count is memoized by the usage tracker
+DOSE_CALCULATOR_SYSTEM_PROMPT = """Você é um farmacologista clínico especializado para médicos especialistas. Forneça análises farmacológicas técnicas, baseadas em evidências científicas, com terminologia médica apropriada e referências a guidelines internacionais.
 
 Forneça análise farmacológica COMPLETA E TÉCNICA para cada medicação, em formato HTML estruturado:
 
@@ -572,8 +483,63 @@ Para CADA medicação, crie uma seção detalhada seguindo este template:
 ✅ Mencione interações farmacocinéticas e farmacodinâmicas
 ✅ Formate em HTML limpo, profissional, com cores para organização visual
 """
+
+
+async def analyze_dose_calculator(patient_data: Dict[str, Any], medications: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Calcula doses farmacológicas, diluições e prescrições
+    
+    Args:
+        patient_data: Dados opcionais do paciente (peso, idade, altura, condições especiais)
+        medications: Lista de medicações com nome, via (opcional) e indicação (opcional)
+        
+    Returns:
+        Dict com prescrição detalhada formatada em HTML
+    """
+    try:
+        cache_key = response_cache.make_key(
+            "dose_calculator", CACHE_VERSION,
+            patient_data=patient_data, medications=medications
+        )
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        response = await chat.send_message(UserMessage(text=prompt))
+        # Build patient context
+        patient_context = ""
+        if patient_data.get("weight"):
+            patient_context += f"\n- Peso: {patient_data['weight']} kg"
+        if patient_data.get("age"):
+            patient_context += f"\n- Idade: {patient_data['age']}"
+        if patient_data.get("height"):
+            patient_context += f"\n- Altura: {patient_data['height']} cm"
+        if patient_data.get("sex"):
+            patient_context += f"\n- Sexo: {patient_data['sex']}"
+        if patient_data.get("specialConditions"):
+            patient_context += f"\n- Condições especiais: {patient_data['specialConditions']}"
+        
+        # Build medications list
+        meds_text = ""
+        for idx, med in enumerate(medications, 1):
+            meds_text += f"\n{idx}. {med['name']}"
+            if med.get('route'):
+                meds_text += f" - Via: {med['route']}"
+            if med.get('indication'):
+                meds_text += f" - Indicação: {med['indication']}"
+        
+        no_data_msg = "\n- Dados não informados"
+        prompt = f"""**ANÁLISE FARMACOLÓGICA PARA MÉDICOS ESPECIALISTAS**
+
+**DADOS DO PACIENTE:**{patient_context if patient_context else no_data_msg}
+
+**MEDICAÇÕES SOLICITADAS:**{meds_text}
+
+Forneça a análise farmacológica de cada medicação seguindo o template HTML e as diretrizes das instruções.
+"""
+        
+        response = await llm_client.send(
+            prompt, DOSE_CALCULATOR_SYSTEM_PROMPT, model=GEMINI_MODEL, session_prefix="dose"
+        )
         prescription_html = response.strip()
         
         # Remove markdown code blocks if present
@@ -582,11 +548,13 @@ Para CADA medicação, crie uma seção detalhada seguindo este template:
         elif prescription_html.startswith("```"):
             prescription_html = prescription_html.split("```")[1].split("```")[0].strip()
         
-        return {
+        result = {
             "prescription": prescription_html,
             "medications_count": len(medications),
             "model": "Meduf 2.5 Clinic"
         }
+        await response_cache.set(cache_key, result)
+        return result
         
     except Exception as e:
         print(f"Error in analyze_dose_calculator: {e}")
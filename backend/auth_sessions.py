@@ -0,0 +1,72 @@
+"""
+Login Session Rotation
+The password hash has to be read before bcrypt can check it, so a login costs
+one projected read plus one guarded find_one_and_update. The update only
+matches accounts that are still not deleted and not expired, so an account
+deleted or expired between the read and the write never gets a new session.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from pymongo import ReturnDocument
+
+# Only what login needs to decide and respond
+LOGIN_PROJECTION = {
+    "password_hash": 1,
+    "deleted": 1,
+    "expiration_date": 1,
+    "name": 1,
+    "email": 1,
+    "role": 1,
+    "avatar_url": 1
+}
+
+
+def active_account_filter(now: datetime) -> Dict[str, Any]:
+    """Accounts that may hold a session: not deleted, no expiration or expiration in the future"""
+    return {
+        "deleted": {"$ne": True},
+        "$or": [
+            {"expiration_date": None},
+            {"expiration_date": {"$gt": now}}
+        ]
+    }
+
+
+def is_expired(user: Dict[str, Any], now: datetime) -> bool:
+    expiration = user.get("expiration_date")
+    if not expiration:
+        return False
+    # Motor returns naive UTC datetimes unless the client is tz_aware
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return expiration <= now
+
+
+async def find_login_user(collection, email: str) -> Optional[Dict[str, Any]]:
+    """Read the account by email with only the login fields"""
+    return await collection.find_one({"email": email}, LOGIN_PROJECTION)
+
+
+async def expire_account(collection, user_id, now: datetime):
+    """Mark an expired account as deleted (no-op if already deleted)"""
+    await collection.update_one(
+        {"_id": user_id, "deleted": {"$ne": True}},
+        {"$set": {"deleted": True, "deleted_at": now}}
+    )
+
+
+async def rotate_session(collection, user_id, access_token: str, now: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Store the new session token (invalidating the previous one) and last_activity
+    in one atomic write, guarded by active_account_filter.
+    Returns the updated account, or None when it is no longer active
+    """
+    return await collection.find_one_and_update(
+        {"_id": user_id, **active_account_filter(now)},
+        {"$set": {
+            "last_activity": now,
+            "active_session_token": access_token
+        }},
+        projection={key: 1 for key in LOGIN_PROJECTION if key != "password_hash"},
+        return_document=ReturnDocument.AFTER
+    )
@@ -0,0 +1,42 @@
+"""
+Backfill usage_rollups / usage_rollups_hourly from usage_stats
+Rebuilds the pre-aggregated cost documents (daily: one per month, day,
+model, consultation_type, user_id; hourly: one per hour, model,
+consultation_type, user_id within the retention window) from the usage
+records already stored.
+Existing rollup documents for the same key are replaced, so the command is
+safe to run again. The server runs it on startup when the rollups are
+empty; run it by hand during low traffic to repair them: records flushed
+while it runs may be counted twice.
+
+Usage: python backfill_usage_rollups.py
+"""
+import os
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from cost_tracker import ensure_rollup_indexes, backfill_rollups
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "meduf_ai")
+
+
+async def backfill():
+    print(f"Connecting to {MONGO_URL} - DB: {DB_NAME}")
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+
+    records = await db.usage_stats.estimated_document_count()
+    print(f"📊 {records} usage records in usage_stats")
+
+    # $merge on the rollup key needs its unique index
+    await ensure_rollup_indexes(db.usage_rollups, db.usage_rollups_hourly)
+    await backfill_rollups(db.usage_stats, db.usage_rollups, db.usage_rollups_hourly)
+
+    for name in ("usage_rollups", "usage_rollups_hourly"):
+        rollups = await db[name].count_documents({})
+        print(f"✅ {name} rebuilt: {rollups} documents")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
@@ -0,0 +1,143 @@
+"""
+Login Latency Benchmark
+Compares the previous login flow (full find_one, then update_one for the
+session) with auth_sessions (projected read, then one guarded
+find_one_and_update), against a scratch collection on the configured MongoDB.
+bcrypt runs with BENCHMARK_BCRYPT_ROUNDS (default 4) so the numbers reflect
+the database round-trips rather than the hash cost.
+
+Usage: python benchmark_login.py [iterations] [concurrency]
+"""
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from passlib.context import CryptContext
+from password_hasher import PasswordHasher
+from auth_sessions import find_login_user, is_expired, expire_account, rotate_session
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "meduf_ai")
+COLLECTION = "benchmark_login_users"
+USERS = 200
+PASSWORD = "benchmark-password"
+
+hasher = PasswordHasher(
+    CryptContext(schemes=["bcrypt"], deprecated="auto",
+                 bcrypt__rounds=int(os.environ.get("BENCHMARK_BCRYPT_ROUNDS", "4"))),
+    max_workers=4,
+    max_queue=10000
+)
+
+
+async def legacy_login(collection, email: str):
+    """The login flow before auth_sessions"""
+    user = await collection.find_one({"email": email})
+    if not user or user.get("deleted"):
+        raise RuntimeError("login failed")
+    if user.get("expiration_date") and user["expiration_date"] < datetime.utcnow():
+        await collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"deleted": True, "deleted_at": datetime.utcnow()}}
+        )
+        raise RuntimeError("expired")
+    if not await hasher.verify(PASSWORD, user["password_hash"]):
+        raise RuntimeError("wrong password")
+    await collection.update_one(
+        {"_id": user["_id"]},
+        {"$set": {
+            "last_activity": datetime.now(timezone.utc),
+            "active_session_token": f"token-{time.perf_counter_ns()}"
+        }}
+    )
+    return user
+
+
+async def current_login(collection, email: str):
+    """The login flow in server.login"""
+    now = datetime.now(timezone.utc)
+    user = await find_login_user(collection, email)
+    if not user or user.get("deleted"):
+        raise RuntimeError("login failed")
+    if is_expired(user, now):
+        await expire_account(collection, user["_id"], now)
+        raise RuntimeError("expired")
+    if not await hasher.verify(PASSWORD, user["password_hash"]):
+        raise RuntimeError("wrong password")
+    user = await rotate_session(collection, user["_id"], f"token-{time.perf_counter_ns()}", now)
+    if not user:
+        raise RuntimeError("expired")
+    return user
+
+
+async def seed(collection):
+    await collection.drop()
+    await collection.create_index("email", unique=True)
+    password_hash = await hasher.hash(PASSWORD)
+    now = datetime.now(timezone.utc)
+    await collection.insert_many([
+        {
+            "username": f"bench{index}",
+            "name": f"Benchmark {index}",
+            "email": f"bench{index}@example.com",
+            "password_hash": password_hash,
+            "role": "USER",
+            "expiration_date": now + timedelta(days=30),
+            "created_at": now,
+            "deleted": False,
+            "avatar_url": "",
+            # Realistic document size: profile fields login does not need
+            "bio": "x" * 2000,
+            "specialties": [f"specialty-{n}" for n in range(20)]
+        }
+        for index in range(USERS)
+    ])
+
+
+async def run(flow, collection, iterations: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await flow(collection, f"bench{index % USERS}@example.com")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(iterations)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "throughput": iterations / elapsed
+    }
+
+
+async def main(iterations: int, concurrency: int):
+    print(f"Connecting to {MONGO_URL} - DB: {DB_NAME}")
+    client = AsyncIOMotorClient(MONGO_URL)
+    collection = client[DB_NAME][COLLECTION]
+    await seed(collection)
+    try:
+        # Warm up connections and caches
+        await run(current_login, collection, 50, concurrency)
+        for name, flow in (("legacy", legacy_login), ("current", current_login)):
+            result = await run(flow, collection, iterations, concurrency)
+            print(
+                f"📊 {name:8} p50={result['p50']:.2f}ms p99={result['p99']:.2f}ms "
+                f"throughput={result['throughput']:.0f} logins/s"
+            )
+    finally:
+        await collection.drop()
+        hasher.executor.shutdown(wait=False)
+        client.close()
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(iterations, concurrency))
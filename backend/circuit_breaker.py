@@ -0,0 +1,100 @@
+"""
+Circuit Breaker for LLM Calls
+Stops calling the LLM while it keeps failing, so requests are answered by the
+rule engine immediately instead of waiting for timeouts and retries
+"""
+import time
+import threading
+from typing import Dict, Any, Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker
+    - closed: calls go through; `failure_threshold` consecutive failures open it
+    - open: calls are rejected for `reset_timeout` seconds
+    - half_open: one probe call is let through; success closes the circuit,
+      failure opens it again (a probe that never reports back is replaced
+      after another reset_timeout)
+    Thread-safe: LLM calls may run in TaskManager pool threads.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if now - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def is_open(self) -> bool:
+        """True while calls are being rejected (no probe is due yet)"""
+        return self.state == self.OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (may start a half-open probe)"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(now)
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"✅ Circuit '{self.name}' closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        now = time.monotonic()
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.times_opened += 1
+                    print(f"⚡ Circuit '{self.name}' opened after {self._failures} consecutive failures")
+                self._opened_at = now
+                self._probe_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state(time.monotonic()),
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected
+            }
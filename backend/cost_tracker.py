@@ -4,9 +4,17 @@ Tracks token usage and calculates costs per consultation
 Uses tiktoken for ACCURATE token counting (same as used by LLMs)
 """
 import os
-from datetime import datetime, timezone
-from typing import Dict, Any
-from motor.motor_asyncio import AsyncIOMotorClient
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import tiktoken
 
 # Gemini pricing (per 1M tokens)
@@ -16,13 +24,6 @@ GEMINI_2_0_OUTPUT_COST = 0.30  # $0.30 per 1M output tokens (2.0 Flash)
 GEMINI_2_5_INPUT_COST = 0.15  # $0.15 per 1M input tokens (2.5 Flash - with vision)
 GEMINI_2_5_OUTPUT_COST = 0.60  # $0.60 per 1M output tokens (2.5 Flash - with vision)
 
-# MongoDB connection
-MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URL)
-db_name = os.environ.get("DB_NAME", "meduf_ai")
-db = client[db_name]
-usage_stats_collection = db.usage_stats
-
 # Initialize tiktoken encoder for accurate token counting
 # Using cl100k_base which is used by GPT-4 and similar models
 try:
@@ -50,6 +51,38 @@ def count_tokens(text: str) -> int:
     return len(text) // 4
 
 
+@lru_cache(maxsize=64)
+def count_prompt_tokens(text: str) -> int:
+    """count_tokens memoized for system prompts, which are identical on every call"""
+    return count_tokens(text)
+
+
+def prepare_usage_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill token counts and cost of a queued record (CPU-bound, run off the event loop)
+    Counts reported by the provider are kept; only missing ones are tokenized
+    """
+    system_text = record.pop("_system_text", None)
+    input_text = record.pop("_input_text", None)
+    output_text = record.pop("_output_text", None)
+    
+    if record.get("input_tokens") is None:
+        record["input_tokens"] = count_prompt_tokens(system_text or "") + count_tokens(input_text or "")
+    if record.get("output_tokens") is None:
+        record["output_tokens"] = count_tokens(output_text or "")
+    
+    record["total_tokens"] = record["input_tokens"] + record["output_tokens"]
+    record["cost_usd"] = calculate_cost(record["input_tokens"], record["output_tokens"], record["model"])
+    return record
+
+
+def prepare_usage_batch(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """prepare_usage_record for a whole batch (one worker-thread hop per flush)"""
+    for record in records:
+        prepare_usage_record(record)
+    return records
+
+
 def calculate_cost(input_tokens: int, output_tokens: int, model: str = "gemini-2.5-flash") -> float:
     """
     Calculate cost in USD based on token usage and model
@@ -65,44 +98,401 @@ def calculate_cost(input_tokens: int, output_tokens: int, model: str = "gemini-2
     return input_cost + output_cost
 
 
-async def track_usage(
+# Pre-aggregated usage
+# - daily rollups: one document per (month, day, model, consultation_type, user_id)
+# - hourly rollups: one document per (hour, model, consultation_type, user_id),
+#   expired after USAGE_HOURLY_RETENTION_DAYS through a TTL index on bucket_start
+ROLLUP_KEY_FIELDS = ("month", "day", "model", "consultation_type", "user_id")
+HOURLY_ROLLUP_KEY_FIELDS = ("hour", "model", "consultation_type", "user_id")
+ROLLUP_COUNTERS = ("consultations", "input_tokens", "output_tokens", "total_tokens", "cost_usd")
+HOURLY_RETENTION_DAYS = int(os.environ.get("USAGE_HOURLY_RETENTION_DAYS", "90"))
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+def _rollup_dimensions(record: Dict[str, Any]) -> Tuple[str, ...]:
+    return (
+        record.get("model") or "unknown",
+        record.get("consultation_type") or "unknown",
+        record.get("user_id") or "system"
+    )
+
+
+def rollup_key(record: Dict[str, Any]) -> Tuple[str, ...]:
+    """Daily rollup key of a usage record (UTC day of its timestamp)"""
+    timestamp = record["timestamp"]
+    return (timestamp.strftime("%Y-%m"), timestamp.strftime("%Y-%m-%d")) + _rollup_dimensions(record)
+
+
+def hourly_rollup_key(record: Dict[str, Any]) -> Tuple[str, ...]:
+    """Hourly rollup key of a usage record (UTC hour of its timestamp)"""
+    return (record["timestamp"].strftime(HOUR_FORMAT),) + _rollup_dimensions(record)
+
+
+def build_rollup_updates(records: List[Dict[str, Any]], key_fields: Tuple[str, ...] = ROLLUP_KEY_FIELDS,
+                         key_func=rollup_key) -> List[UpdateOne]:
+    """One $inc upsert per rollup key touched by a batch of prepared records"""
+    totals: Dict[Tuple[str, ...], Dict[str, float]] = {}
+    for record in records:
+        counters = totals.setdefault(key_func(record), dict.fromkeys(ROLLUP_COUNTERS, 0))
+        counters["consultations"] += 1
+        for field in ROLLUP_COUNTERS[1:]:
+            counters[field] += record.get(field) or 0
+    
+    now = datetime.now(timezone.utc)
+    updates = []
+    for key, counters in totals.items():
+        document_key = dict(zip(key_fields, key))
+        update = {"$inc": counters, "$set": {"updated_at": now}}
+        if "hour" in document_key:
+            # TTL anchor of hourly documents
+            bucket_start = datetime.strptime(document_key["hour"], HOUR_FORMAT).replace(tzinfo=timezone.utc)
+            update["$setOnInsert"] = {"bucket_start": bucket_start}
+        updates.append(UpdateOne(document_key, update, upsert=True))
+    return updates
+
+
+async def ensure_rollup_indexes(collection, hourly_collection):
+    """
+    Unique rollup keys (required by the upserts and the backfill $merge),
+    indexes for series queries filtered by user / feature over a time range,
+    and the TTL of hourly documents
+    """
+    await collection.create_index([(field, 1) for field in ROLLUP_KEY_FIELDS], unique=True, name="rollup_key")
+    await collection.create_index("day")
+    await collection.create_index([("user_id", 1), ("day", 1)])
+    await collection.create_index([("consultation_type", 1), ("day", 1)])
+    
+    await hourly_collection.create_index([(field, 1) for field in HOURLY_ROLLUP_KEY_FIELDS], unique=True, name="rollup_key")
+    await hourly_collection.create_index("hour")
+    await hourly_collection.create_index([("user_id", 1), ("hour", 1)])
+    await hourly_collection.create_index([("consultation_type", 1), ("hour", 1)])
+    await hourly_collection.create_index("bucket_start", expireAfterSeconds=HOURLY_RETENTION_DAYS * 86400)
+
+
+# Rebuild of the rollups from usage_stats (startup on empty rollups, backfill_usage_rollups.py)
+ROLLUP_DIMENSIONS = {
+    "model": {"$ifNull": ["$model", "unknown"]},
+    "consultation_type": {"$ifNull": ["$consultation_type", "unknown"]},
+    "user_id": {"$ifNull": ["$user_id", "system"]}
+}
+
+
+def rollup_pipeline(rollups_name: str, key_fields, key: dict, match: dict, extra_fields: dict = None):
+    """Group usage records by rollup key and $merge the totals into the rollups"""
+    return [
+        {"$match": {"timestamp": {"$type": "date"}, **match}},
+        {
+            "$group": {
+                "_id": key,
+                "consultations": {"$sum": 1},
+                "input_tokens": {"$sum": "$input_tokens"},
+                "output_tokens": {"$sum": "$output_tokens"},
+                "total_tokens": {"$sum": "$total_tokens"},
+                "cost_usd": {"$sum": "$cost_usd"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                **{field: f"$_id.{field}" for field in key_fields},
+                "consultations": 1,
+                "input_tokens": 1,
+                "output_tokens": 1,
+                "total_tokens": 1,
+                "cost_usd": 1,
+                "updated_at": {"$literal": datetime.now(timezone.utc)},
+                **(extra_fields or {})
+            }
+        },
+        {
+            "$merge": {
+                "into": rollups_name,
+                "on": list(key_fields),
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]
+
+
+def daily_rollup_pipeline(rollups_name: str = "usage_rollups"):
+    key = {
+        "month": {"$dateToString": {"format": "%Y-%m", "date": "$timestamp"}},
+        "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+        **ROLLUP_DIMENSIONS
+    }
+    return rollup_pipeline(rollups_name, ROLLUP_KEY_FIELDS, key, {})
+
+
+def hourly_rollup_pipeline(rollups_name: str = "usage_rollups_hourly"):
+    """Only records still inside the hourly retention window"""
+    since = datetime.now(timezone.utc) - timedelta(days=HOURLY_RETENTION_DAYS)
+    key = {"hour": {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$timestamp"}}, **ROLLUP_DIMENSIONS}
+    bucket_start = {"$dateFromString": {"dateString": {"$concat": ["$_id.hour", ":00:00Z"]}}}
+    return rollup_pipeline(
+        rollups_name, HOURLY_ROLLUP_KEY_FIELDS, key,
+        {"timestamp": {"$type": "date", "$gte": since}},
+        {"bucket_start": bucket_start}
+    )
+
+
+async def backfill_rollups(collection, rollup_collection, hourly_collection):
+    """
+    Rebuild both rollup collections from the usage records (needs the unique
+    rollup_key indexes). Existing documents of the same key are replaced, so
+    it is safe to run again; records written while it runs may be counted twice
+    """
+    await collection.aggregate(daily_rollup_pipeline(rollup_collection.name), allowDiskUse=True).to_list(None)
+    await collection.aggregate(hourly_rollup_pipeline(hourly_collection.name), allowDiskUse=True).to_list(None)
+    clear_stats_cache()
+
+
+class UsageBuffer:
+    """
+    In-process queue of usage records
+    - add() is thread-safe and does no I/O, so tasks (pool threads), chat and
+      alerts record usage without a database round-trip
+    - Pending records are written with one insert_many when batch_size of
+      them are queued or every flush_interval seconds, and on close()
+    - Tokens are counted at flush time in a worker thread, so large prompts
+      never block the event loop
+    - Failed writes are put back for the next flush; beyond max_pending the
+      oldest records are dropped
+    - Written records are added to the daily and hourly rollup collections
+      with $inc, so stats read a few pre-aggregated documents (rebuild with
+      backfill_usage_rollups.py if a rollup write is lost)
+    - On a deployment that has usage records but no rollups yet, the rollups
+      are rebuilt from usage_stats once on startup, before the first flush,
+      so stats are not empty until someone runs the backfill by hand
+    - Collections come from the server's database (start(db)), so usage
+      tracking shares the server's Motor client and connection pool
+    """
+
+    def __init__(self, collection=None, rollup_collection=None, hourly_rollup_collection=None,
+                 batch_size: int = 100, flush_interval: float = 5.0, max_pending: int = 10000):
+        self.collection = collection
+        self.rollup_collection = rollup_collection
+        self.hourly_rollup_collection = hourly_rollup_collection
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self._pending: deque = deque()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+
+    def add(self, record: Dict[str, Any]):
+        """Queue one usage record (safe to call from any thread)"""
+        with self._lock:
+            self._enqueue([record])
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._request_flush()
+
+    def _enqueue(self, records: List[Dict[str, Any]], front: bool = False):
+        """Add records under the lock, dropping the oldest beyond max_pending"""
+        if front:
+            self._pending.extendleft(reversed(records))
+        else:
+            self._pending.extend(records)
+        while len(self._pending) > self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+
+    def _request_flush(self):
+        """Wake the flush loop - safe to call from worker threads"""
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def flush(self) -> int:
+        """Write all pending records with insert_many, returns how many were written"""
+        with self._lock:
+            batch = list(self._pending)
+            self._pending.clear()
+        if not batch:
+            return 0
+        if self.collection is None:
+            # Not started yet: keep the records for the first flush
+            with self._lock:
+                self._enqueue(batch, front=True)
+            return 0
+
+        try:
+            await asyncio.to_thread(prepare_usage_batch, batch)
+            await self.collection.insert_many(batch, ordered=False)
+            retry = []
+        except BulkWriteError as e:
+            # Unordered insert: only the failed documents are retried (not duplicates)
+            failed = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000}
+            retry = [batch[index] for index in sorted(failed)]
+        except Exception as e:
+            print(f"⚠️ Error writing {len(batch)} usage records: {e}")
+            retry = batch
+
+        if retry:
+            with self._lock:
+                self._enqueue(retry, front=True)
+        retried = {id(record) for record in retry}
+        written = [record for record in batch if id(record) not in retried]
+        self.written += len(written)
+        if written:
+            await self._update_rollups(written)
+            tokens = sum(record.get("total_tokens") or 0 for record in written)
+            cost_usd = sum(record.get("cost_usd") or 0 for record in written)
+            print(f"💰 Usage tracked: {len(written)} records, {tokens} tokens, cost: ${cost_usd:.6f}")
+        return len(written)
+
+    async def _update_rollups(self, records: List[Dict[str, Any]]):
+        """$inc the rollup documents of freshly written records"""
+        rollups = (
+            (self.rollup_collection, ROLLUP_KEY_FIELDS, rollup_key),
+            (self.hourly_rollup_collection, HOURLY_ROLLUP_KEY_FIELDS, hourly_rollup_key),
+        )
+        for collection, key_fields, key_func in rollups:
+            if collection is None:
+                continue
+            try:
+                await collection.bulk_write(build_rollup_updates(records, key_fields, key_func), ordered=False)
+            except Exception as e:
+                print(f"⚠️ Error updating usage rollups ({len(records)} records): {e}")
+
+    async def _flush_loop(self):
+        """Flush pending records periodically or as soon as a batch is full"""
+        # Before the first flush, so the rebuild and the $inc of new records do not overlap
+        await self._backfill_if_empty()
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self, db=None):
+        """Bind to the server's database and start the flush loop (call on app startup)"""
+        if db is not None:
+            self.collection = db.usage_stats
+            self.rollup_collection = db.usage_rollups
+            self.hourly_rollup_collection = db.usage_rollups_hourly
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self.rollup_collection is not None and self.hourly_rollup_collection is not None:
+            try:
+                await ensure_rollup_indexes(self.rollup_collection, self.hourly_rollup_collection)
+            except Exception as e:
+                print(f"⚠️ Aviso ao criar índices de rollup de uso: {e}")
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _backfill_if_empty(self):
+        """Rebuild the rollups when usage_stats has records but the rollups have none"""
+        if self.collection is None or self.rollup_collection is None or self.hourly_rollup_collection is None:
+            return
+        try:
+            if await self.rollup_collection.find_one({}, {"_id": 1}) is not None:
+                return
+            if await self.collection.find_one({}, {"_id": 1}) is None:
+                return
+            print("📊 Rollups de uso vazios: reconstruindo a partir de usage_stats...")
+            await backfill_rollups(self.collection, self.rollup_collection, self.hourly_rollup_collection)
+            print("✅ Rollups de uso reconstruídos")
+        except Exception as e:
+            print(f"⚠️ Erro ao reconstruir rollups de uso (rode backfill_usage_rollups.py): {e}")
+
+    async def close(self):
+        """Stop the flush loop and write everything still pending"""
+        if self._flush_task:
+            # wait_for may swallow a cancel that lands while a wakeup completes:
+            # the flag ends the loop right after that iteration instead
+            self._closing = True
+            self._wakeup.set()
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "dropped": self.dropped}
+
+
+# Global usage buffer (bound to the server's db by start(db), closed on shutdown)
+usage_buffer = UsageBuffer(
+    batch_size=int(os.environ.get("USAGE_BATCH_SIZE", "100")),
+    flush_interval=float(os.environ.get("USAGE_FLUSH_INTERVAL_SECONDS", "5")),
+    max_pending=int(os.environ.get("USAGE_MAX_PENDING", "10000"))
+)
+
+# (user_id, consultation_type) that LLM calls made in this context are billed to
+_usage_scope: ContextVar[Optional[Tuple[str, str]]] = ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(user_id: Optional[str], consultation_type: str):
+    """Bill every LLM call made inside the block to this user and consultation type"""
+    token = _usage_scope.set((user_id or "system", consultation_type))
+    try:
+        yield
+    finally:
+        _usage_scope.reset(token)
+
+
+def current_usage_scope() -> Optional[Tuple[str, str]]:
+    """(user_id, consultation_type) set by usage_scope, or None"""
+    return _usage_scope.get()
+
+
+def record_usage(
     user_id: str,
     consultation_type: str,
     input_text: str,
     output_text: str,
-    model: str = "gemini-2.5-flash"
-):
+    model: str = "gemini-2.5-flash",
+    system_text: Optional[str] = None,
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
     """
     Track API usage and cost for a consultation
-    Uses tiktoken for ACCURATE token counting
+    The record is queued in usage_buffer without tokenizing anything here:
+    counts reported by the provider (input_tokens/output_tokens) are used
+    as-is, missing ones are counted with tiktoken when the batch is flushed.
+    system_text is counted separately so repeated system prompts hit a cache.
     """
     try:
-        # Count tokens accurately using tiktoken
-        input_tokens = count_tokens(input_text)
-        output_tokens = count_tokens(output_text)
-        
-        # Calculate cost with REAL token counts (pass model for correct pricing)
-        cost_usd = calculate_cost(input_tokens, output_tokens, model)
-        
-        # Create usage record
+        now = datetime.now(timezone.utc)
         usage_record = {
             "user_id": user_id,
             "consultation_type": consultation_type,
             "model": model,
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
-            "total_tokens": input_tokens + output_tokens,
-            "cost_usd": cost_usd,
-            "timestamp": datetime.now(timezone.utc),
-            "month": datetime.now(timezone.utc).strftime("%Y-%m"),
-            "year": datetime.now(timezone.utc).year
+            "token_source": "provider" if input_tokens is not None and output_tokens is not None else "tiktoken",
+            "timestamp": now,
+            "month": now.strftime("%Y-%m"),
+            "year": now.year,
+            "_system_text": system_text,
+            "_input_text": input_text,
+            "_output_text": output_text
         }
         
-        # Save to database
-        await usage_stats_collection.insert_one(usage_record)
-        
-        print(f"💰 Usage tracked (ACCURATE): {input_tokens + output_tokens} tokens (input: {input_tokens}, output: {output_tokens}), cost: ${cost_usd:.6f}")
-        
+        usage_buffer.add(usage_record)
         return usage_record
         
     except Exception as e:
@@ -110,46 +500,86 @@ async def track_usage(
         return None
 
 
-def get_monthly_stats_sync(year: int = None, month: int = None) -> Dict[str, Any]:
+async def track_usage(
+    user_id: str,
+    consultation_type: str,
+    input_text: str,
+    output_text: str,
+    model: str = "gemini-2.5-flash"
+):
+    """Async alias of record_usage (kept for existing callers)"""
+    return record_usage(user_id, consultation_type, input_text, output_text, model)
+
+
+# Short-lived LRU cache of dashboard stats: key -> (expires at, stats)
+# Keys include admin query parameters (series ranges, pages), hence the bound
+STATS_CACHE_TTL = float(os.environ.get("USAGE_STATS_CACHE_TTL_SECONDS", "60"))
+STATS_CACHE_MAX_ENTRIES = int(os.environ.get("USAGE_STATS_CACHE_MAX_ENTRIES", "256"))
+_stats_cache: "OrderedDict[Any, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+async def _cached_stats(key: Any, compute) -> Dict[str, Any]:
+    """Return cached stats for key, or compute and cache them for STATS_CACHE_TTL"""
+    now = time.monotonic()
+    cached = _stats_cache.get(key)
+    if cached and cached[0] > now:
+        _stats_cache.move_to_end(key)
+        return dict(cached[1])
+    stats = await compute()
+    if "error" not in stats:
+        _stats_cache[key] = (now + STATS_CACHE_TTL, stats)
+        _stats_cache.move_to_end(key)
+        while len(_stats_cache) > STATS_CACHE_MAX_ENTRIES:
+            _stats_cache.popitem(last=False)
+    elif key in _stats_cache:
+        del _stats_cache[key]
+    return dict(stats)
+
+
+def clear_stats_cache():
+    """Drop cached stats (e.g. after a backfill)"""
+    _stats_cache.clear()
+
+
+def _rollups(source: str = "daily"):
+    """Rollup collection of the started usage buffer"""
+    collection = usage_buffer.hourly_rollup_collection if source == "hourly" else usage_buffer.rollup_collection
+    if collection is None:
+        raise RuntimeError("Usage buffer not started (no database)")
+    return collection
+
+
+async def get_monthly_stats(year: int = None, month: int = None) -> Dict[str, Any]:
     """
-    Get usage statistics for a specific month (synchronous version)
+    Get usage statistics for a specific month
+    Summed from the daily rollups (usage_rollups) on the server's Motor client,
+    cached for STATS_CACHE_TTL seconds
     """
-    try:
-        from pymongo import MongoClient
-        
-        # Create sync MongoDB client
-        sync_client = MongoClient(MONGO_URL)
-        sync_db = sync_client[db_name]
-        sync_collection = sync_db.usage_stats
-        
-        # Default to current month
-        if not year or not month:
-            now = datetime.now(timezone.utc)
-            year = now.year
-            month = now.month
-        
-        month_str = f"{year}-{month:02d}"
-        
-        # Aggregate stats
-        pipeline = [
-            {"$match": {"month": month_str}},
-            {
-                "$group": {
-                    "_id": None,
-                    "total_consultations": {"$sum": 1},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_usd": {"$sum": "$cost_usd"},
-                    "input_tokens": {"$sum": "$input_tokens"},
-                    "output_tokens": {"$sum": "$output_tokens"}
+    # Default to current month
+    if not year or not month:
+        now = datetime.now(timezone.utc)
+        year = now.year
+        month = now.month
+    
+    month_str = f"{year}-{month:02d}"
+    
+    async def compute() -> Dict[str, Any]:
+        try:
+            pipeline = [
+                {"$match": {"month": month_str}},
+                {
+                    "$group": {
+                        "_id": None,
+                        "total_consultations": {"$sum": "$consultations"},
+                        "total_tokens": {"$sum": "$total_tokens"},
+                        "total_cost_usd": {"$sum": "$cost_usd"},
+                        "input_tokens": {"$sum": "$input_tokens"},
+                        "output_tokens": {"$sum": "$output_tokens"}
+                    }
                 }
-            }
-        ]
-        
-        result = list(sync_collection.aggregate(pipeline))
-        sync_client.close()
-        
-        if result:
-            stats = result[0]
+            ]
+            result = await _rollups().aggregate(pipeline).to_list(1)
+            stats = result[0] if result else {}
             return {
                 "month": month_str,
                 "total_consultations": stats.get("total_consultations", 0),
@@ -158,87 +588,146 @@ def get_monthly_stats_sync(year: int = None, month: int = None) -> Dict[str, Any
                 "input_tokens": stats.get("input_tokens", 0),
                 "output_tokens": stats.get("output_tokens", 0)
             }
-        else:
+        except Exception as e:
+            print(f"⚠️ Error getting monthly stats: {e}")
             return {
                 "month": month_str,
                 "total_consultations": 0,
                 "total_tokens": 0,
                 "total_cost_usd": 0.0,
-                "input_tokens": 0,
-                "output_tokens": 0
+                "error": str(e)
             }
-            
-    except Exception as e:
-        print(f"⚠️ Error getting monthly stats: {e}")
-        now = datetime.now(timezone.utc)
-        return {
-            "month": f"{now.year}-{now.month:02d}",
-            "total_consultations": 0,
-            "total_tokens": 0,
-            "total_cost_usd": 0.0,
-            "error": str(e)
-        }
-
-
-async def get_monthly_stats(year: int = None, month: int = None) -> Dict[str, Any]:
-    """
-    Get usage statistics for a specific month (async wrapper)
-    """
-    return get_monthly_stats_sync(year, month)
+    
+    return await _cached_stats(("monthly", month_str), compute)
 
 
-def get_all_time_stats_sync() -> Dict[str, Any]:
+async def get_all_time_stats() -> Dict[str, Any]:
     """
-    Get all-time usage statistics (synchronous version)
+    Get all-time usage statistics
+    Summed from the daily rollups (usage_rollups) on the server's Motor client,
+    cached for STATS_CACHE_TTL seconds
     """
-    try:
-        from pymongo import MongoClient
-        
-        # Create sync MongoDB client
-        sync_client = MongoClient(MONGO_URL)
-        sync_db = sync_client[db_name]
-        sync_collection = sync_db.usage_stats
-        
-        pipeline = [
-            {
-                "$group": {
-                    "_id": None,
-                    "total_consultations": {"$sum": 1},
-                    "total_tokens": {"$sum": "$total_tokens"},
-                    "total_cost_usd": {"$sum": "$cost_usd"}
+    async def compute() -> Dict[str, Any]:
+        try:
+            pipeline = [
+                {
+                    "$group": {
+                        "_id": None,
+                        "total_consultations": {"$sum": "$consultations"},
+                        "total_tokens": {"$sum": "$total_tokens"},
+                        "total_cost_usd": {"$sum": "$cost_usd"}
+                    }
                 }
-            }
-        ]
-        
-        result = list(sync_collection.aggregate(pipeline))
-        sync_client.close()
-        
-        if result:
-            stats = result[0]
+            ]
+            result = await _rollups().aggregate(pipeline).to_list(1)
+            stats = result[0] if result else {}
             return {
                 "total_consultations": stats.get("total_consultations", 0),
                 "total_tokens": stats.get("total_tokens", 0),
                 "total_cost_usd": round(stats.get("total_cost_usd", 0), 4)
             }
-        else:
+        except Exception as e:
+            print(f"⚠️ Error getting all-time stats: {e}")
             return {
                 "total_consultations": 0,
                 "total_tokens": 0,
-                "total_cost_usd": 0.0
+                "total_cost_usd": 0.0,
+                "error": str(e)
             }
-            
-    except Exception as e:
-        print(f"⚠️ Error getting all-time stats: {e}")
-        return {
-            "total_consultations": 0,
-            "total_tokens": 0,
-            "total_cost_usd": 0.0,
-            "error": str(e)
-        }
+    
+    return await _cached_stats(("all_time",), compute)
 
 
-async def get_all_time_stats() -> Dict[str, Any]:
+# bucket -> (rollup collection, field holding the bucket, strftime of the bucket, default range in days)
+SERIES_BUCKETS = {
+    "hour": ("hourly", "hour", HOUR_FORMAT, 2),
+    "day": ("daily", "day", "%Y-%m-%d", 30),
+    "month": ("daily", "month", "%Y-%m", 365),
+}
+SERIES_GROUPS = ("consultation_type", "user_id", "model")
+MAX_SERIES_PAGE_SIZE = 100
+
+
+async def get_usage_series(
+    bucket: str = "day",
+    group_by: str = "consultation_type",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    consultation_type: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20
+) -> Dict[str, Any]:
     """
-    Get all-time usage statistics (async wrapper)
+    Cost and token time series per user, feature (consultation_type) or model
+    Read from the rollups: hourly documents for bucket="hour", daily ones for
+    "day" and "month". Groups are ranked by total cost and paginated; each
+    group carries its series (only buckets with usage). Raises ValueError on
+    invalid arguments.
     """
-    return get_all_time_stats_sync()
+    if bucket not in SERIES_BUCKETS:
+        raise ValueError(f"bucket deve ser um de: {', '.join(SERIES_BUCKETS)}")
+    if group_by not in SERIES_GROUPS:
+        raise ValueError(f"group_by deve ser um de: {', '.join(SERIES_GROUPS)}")
+    page = max(1, page)
+    page_size = min(max(1, page_size), MAX_SERIES_PAGE_SIZE)
+    
+    source, bucket_field, bucket_format, default_days = SERIES_BUCKETS[bucket]
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=default_days)
+    if start > end:
+        raise ValueError("start deve ser anterior a end")
+    
+    # Range filter on the finest field of the source collection (string keys sort chronologically)
+    range_field, range_format = ("hour", HOUR_FORMAT) if source == "hourly" else ("day", "%Y-%m-%d")
+    match: Dict[str, Any] = {range_field: {"$gte": start.strftime(range_format), "$lte": end.strftime(range_format)}}
+    if user_id:
+        match["user_id"] = user_id
+    if consultation_type:
+        match["consultation_type"] = consultation_type
+    
+    sums = {field: {"$sum": f"${field}"} for field in ROLLUP_COUNTERS}
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"key": f"${group_by}", "bucket": f"${bucket_field}"}, **sums}},
+        {"$sort": {"_id.bucket": 1}},
+        {
+            "$group": {
+                "_id": "$_id.key",
+                **{f"total_{field}": {"$sum": f"${field}"} for field in ROLLUP_COUNTERS},
+                "series": {"$push": {"bucket": "$_id.bucket", **{field: f"${field}" for field in ROLLUP_COUNTERS}}}
+            }
+        },
+        {"$sort": {"total_cost_usd": -1, "_id": 1}},
+        {
+            "$facet": {
+                "items": [{"$skip": (page - 1) * page_size}, {"$limit": page_size}],
+                "count": [{"$count": "groups"}]
+            }
+        }
+    ]
+    
+    async def compute() -> Dict[str, Any]:
+        result = await _rollups(source).aggregate(pipeline).to_list(1)
+        facet = result[0] if result else {"items": [], "count": []}
+        return {
+            "bucket": bucket,
+            "group_by": group_by,
+            "start": start.strftime(bucket_format),
+            "end": end.strftime(bucket_format),
+            "page": page,
+            "page_size": page_size,
+            "total_groups": facet["count"][0]["groups"] if facet["count"] else 0,
+            "items": [
+                {
+                    "key": item["_id"],
+                    **{f"total_{field}": item[f"total_{field}"] for field in ROLLUP_COUNTERS},
+                    "series": item["series"]
+                }
+                for item in facet["items"]
+            ]
+        }
+    
+    cache_key = ("series", bucket, group_by, match[range_field]["$gte"], match[range_field]["$lte"],
+                 user_id, consultation_type, page, page_size)
+    return await _cached_stats(cache_key, compute)
@@ -0,0 +1,142 @@
+"""
+Drug Name Canonicalization
+Normalizes prescriptions so the same drugs in another order, casing,
+accentuation or brand name map to one canonical, order-insensitive key
+"""
+import re
+from functools import lru_cache
+from typing import Iterable, Tuple
+from text_normalization import normalize_text
+
+# Brand names, international names and common variants -> canonical (normalized) name
+DRUG_SYNONYMS = {
+    # Analgesics / NSAIDs
+    "acetaminofeno": "paracetamol",
+    "acetaminophen": "paracetamol",
+    "tylenol": "paracetamol",
+    "novalgina": "dipirona",
+    "metamizol": "dipirona",
+    "metamizole": "dipirona",
+    "aas": "acido acetilsalicilico",
+    "aspirina": "acido acetilsalicilico",
+    "aspirin": "acido acetilsalicilico",
+    "advil": "ibuprofeno",
+    "alivium": "ibuprofeno",
+    "ibuprofen": "ibuprofeno",
+    "voltaren": "diclofenaco",
+    "cataflam": "diclofenaco",
+    "diclofenac": "diclofenaco",
+    "nimesulide": "nimesulida",
+    "tramal": "tramadol",
+
+    # Anticoagulants
+    "warfarin": "varfarina",
+    "warfarina": "varfarina",
+    "marevan": "varfarina",
+    "coumadin": "varfarina",
+    "heparin": "heparina",
+
+    # Cardiovascular
+    "renitec": "enalapril",
+    "losartan": "losartana",
+    "cozaar": "losartana",
+    "aldactone": "espironolactona",
+    "spironolactone": "espironolactona",
+    "lasix": "furosemida",
+    "furosemide": "furosemida",
+    "hydrochlorothiazide": "hidroclorotiazida",
+    "hctz": "hidroclorotiazida",
+    "digoxin": "digoxina",
+    "lanoxin": "digoxina",
+    "amiodarone": "amiodarona",
+    "ancoron": "amiodarona",
+    "atorvastatin": "atorvastatina",
+    "lipitor": "atorvastatina",
+    "simvastatin": "sinvastatina",
+    "zocor": "sinvastatina",
+    "rosuvastatin": "rosuvastatina",
+    "crestor": "rosuvastatina",
+
+    # Antidiabetics
+    "metformin": "metformina",
+    "glifage": "metformina",
+    "glibenclamide": "glibenclamida",
+    "daonil": "glibenclamida",
+
+    # Antibiotics
+    "amoxicillin": "amoxicilina",
+    "amoxil": "amoxicilina",
+    "azithromycin": "azitromicina",
+    "zitromax": "azitromicina",
+    "ciprofloxacin": "ciprofloxacino",
+    "cipro": "ciprofloxacino",
+    "gentamicin": "gentamicina",
+    "vancomycin": "vancomicina",
+    "amikacin": "amicacina",
+
+    # Anticonvulsants / psychiatric
+    "hidantal": "fenitoina",
+    "phenytoin": "fenitoina",
+    "tegretol": "carbamazepina",
+    "carbamazepine": "carbamazepina",
+    "depakene": "valproato",
+    "depakote": "valproato",
+    "acido valproico": "valproato",
+    "valproic acid": "valproato",
+    "rivotril": "clonazepam",
+    "prozac": "fluoxetina",
+    "fluoxetine": "fluoxetina",
+    "zoloft": "sertralina",
+    "sertraline": "sertralina",
+
+    # Others
+    "omeprazole": "omeprazol",
+    "losec": "omeprazol",
+    "cyclosporine": "ciclosporina",
+    "tacrolimo": "tacrolimus",
+}
+
+# Salt / formulation words that do not change the active ingredient
+SALT_WORDS = {"sodica", "sodico", "potassica", "potassico", "cloridrato", "maleato", "calcica", "calcico", "mesilato", "besilato"}
+# Connector after a leading salt word ("cloridrato de sertralina")
+SALT_CONNECTORS = {"de", "do", "da"}
+
+_DOSE_SPACING = re.compile(r"(\d)\s+(mg|mcg|g|ml|ui|%)\b")
+_NON_WORD = re.compile(r"[^\w\s%.,/]")
+
+
+@lru_cache(maxsize=4096)
+def canonical_drug_name(name: str) -> str:
+    """
+    Canonical form of one prescription line
+    "Losartana Potássica 50 mg" -> "losartana 50mg", "Tylenol" -> "paracetamol",
+    "Cloridrato de Sertralina 50mg" -> "sertralina 50mg"
+    The dose (everything from the first number on) is kept, only normalized.
+    """
+    text = _NON_WORD.sub(" ", normalize_text(name or ""))
+    text = _DOSE_SPACING.sub(r"\1\2", " ".join(text.split()))
+
+    tokens = text.split()
+    split_at = next((i for i, token in enumerate(tokens) if token[0].isdigit()), len(tokens))
+    name_tokens = []
+    after_salt = False
+    for token in tokens[:split_at]:
+        if token in SALT_WORDS or (after_salt and token in SALT_CONNECTORS):
+            after_salt = token in SALT_WORDS
+            continue
+        after_salt = False
+        name_tokens.append(token)
+    dose_tokens = tokens[split_at:]
+
+    drug = " ".join(name_tokens)
+    drug = DRUG_SYNONYMS.get(drug, drug)
+    if name_tokens and drug == " ".join(name_tokens) and name_tokens[0] in DRUG_SYNONYMS:
+        # e.g. "tylenol gotas" -> "paracetamol gotas"
+        drug = " ".join([DRUG_SYNONYMS[name_tokens[0]]] + name_tokens[1:])
+
+    return " ".join([drug] + dose_tokens).strip()
+
+
+def canonical_drug_set(medications: Iterable[str]) -> Tuple[str, ...]:
+    """Sorted, de-duplicated canonical names - identical for any permutation"""
+    return tuple(sorted({canonical_drug_name(med) for med in medications if med and med.strip()}))
@@ -0,0 +1,323 @@
+"""
+Drug Table and Interaction Matrix
+Precomputed drug table (organ impact, renal/hepatic burden, drug classes)
+held in module-level numpy arrays. A prescription of N drugs is screened in
+one batched lookup: N x N interaction severities plus the cumulative renal
+and hepatic burden, deterministic and well under a millisecond.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Sequence
+import numpy as np
+from drug_canonical import canonical_drug_name, DRUG_SYNONYMS
+
+# Burden scale: 0 low/none, 1 adjust dose or caution, 2 significant, 3 high toxicity
+DRUG_TABLE = [
+    # name, classes, renal burden, hepatic burden, renal impact, hepatic impact
+    # Antibiotics
+    ("gentamicina", (), 3, 0, "ALTA nefrotoxicidade (tubular renal). Risco de IRA.", "Baixo impacto hepático."),
+    ("vancomicina", (), 2, 0, "Nefrotoxicidade moderada. Monitorar creatinina.", "Baixo impacto hepático."),
+    ("amicacina", (), 3, 0, "ALTA nefrotoxicidade. Ajustar dose pela TFG.", "Mínimo impacto hepático."),
+    ("ciprofloxacino", (), 1, 1, "Ajustar dose se TFG < 30.", "Hepatotoxicidade rara."),
+    ("azitromicina", (), 0, 1, "Segura em IRC.", "Hepatotoxicidade rara mas possível."),
+    ("amoxicilina", (), 1, 1, "Ajustar dose se TFG < 30.", "Hepatite colestática rara (especialmente com clavulanato)."),
+
+    # NSAIDs
+    ("ibuprofeno", ("aine",), 2, 1, "Pode causar IRA em doses altas. Reduz TFG. Evitar em IRC.", "Hepatotoxicidade rara, mas possível."),
+    ("diclofenaco", ("aine",), 2, 2, "Nefrotoxicidade dose-dependente. Risco de IRA.", "HEPATOTOXICIDADE significativa. Monitorar TGO/TGP."),
+    ("nimesulida", ("aine",), 2, 3, "Moderada nefrotoxicidade.", "ALTO risco de hepatite medicamentosa."),
+    ("aine", ("aine",), 2, 1, "Classe: redução da TFG, risco de IRA.", "Hepatotoxicidade variável por droga."),
+    ("acido acetilsalicilico", ("aine",), 0, 0, None, None),
+
+    # Analgesics
+    ("paracetamol", (), 1, 3, "Nefrotoxicidade em overdose crônica.", "HEPATOTOXICIDADE grave em overdose (>4g/dia). Necrose hepática."),
+    ("dipirona", (), 0, 0, "Baixo impacto renal.", "Baixo impacto hepático."),
+    ("tramadol", ("serotoninergico_opioide",), 0, 0, None, None),
+    ("opioide", ("serotoninergico_opioide",), 0, 0, None, None),
+
+    # Anticoagulants
+    ("varfarina", ("cumarinico",), 1, 1, "Ajustar dose em IRC moderada/grave.", "Metabolização hepática. Risco de sangramento se disfunção."),
+    ("heparina", (), 0, 0, "Segura em IRC.", "Não requer ajuste hepático."),
+
+    # Cardiovascular
+    ("enalapril", ("ieca",), 1, 0, "Pode piorar função renal em estenose bilateral. Monitorar creatinina.", "Baixo impacto hepático."),
+    ("captopril", ("ieca",), 0, 0, None, None),
+    ("iecas", ("ieca",), 0, 0, None, None),
+    ("losartana", (), 1, 1, "Reduz pressão glomerular. Monitorar K+ e creatinina.", "Metabolização hepática. Ajustar em cirrose."),
+    ("espironolactona", ("poupador_k",), 2, 1, "CONTRAINDICADO se TFG < 30. Risco de hipercalemia.", "Usar com cautela em cirrose."),
+    ("amilorida", ("poupador_k",), 0, 0, None, None),
+    ("furosemida", (), 1, 1, "Pode causar azotemia pré-renal se hipovolemia.", "Usar com cautela em cirrose (risco de encefalopatia)."),
+    ("hidroclorotiazida", (), 1, 1, "Ineficaz se TFG < 30. Ajustar dose.", "Pode precipitar encefalopatia hepática."),
+    ("digoxina", ("digitalico",), 0, 0, None, None),
+    ("amiodarona", ("reduz_clearance_digoxina",), 0, 0, None, None),
+    ("verapamil", ("reduz_clearance_digoxina",), 0, 0, None, None),
+
+    # Statins
+    ("atorvastatina", (), 0, 2, "Segura em IRC. Não requer ajuste.", "HEPATOTOXICIDADE. Monitorar TGO/TGP. Contraindicado em hepatopatia ativa."),
+    ("sinvastatina", (), 0, 2, "Segura em IRC leve/moderada.", "HEPATOTOXICIDADE. Monitorar transaminases."),
+    ("rosuvastatina", (), 1, 2, "Ajustar dose se TFG < 30.", "HEPATOTOXICIDADE. Contraindicado em cirrose."),
+
+    # Antidiabetics
+    ("metformina", ("biguanida",), 2, 2, "CONTRAINDICADO se TFG < 30. Risco de acidose láctica.", "Contraindicado em insuficiência hepática."),
+    ("glibenclamida", (), 2, 1, "Risco de hipoglicemia prolongada em IRC. Evitar.", "Metabolização hepática. Ajustar dose."),
+
+    # Anticonvulsants
+    ("fenitoina", (), 1, 2, "Ajustar em IRC avançada.", "HEPATOTOXICIDADE. Monitorar níveis e função hepática."),
+    ("carbamazepina", (), 1, 2, "Hiponatremia em IRC.", "HEPATOTOXICIDADE. Monitorar TGO/TGP."),
+    ("valproato", (), 0, 2, "Seguro em IRC.", "HEPATOTOXICIDADE grave (rara). Monitorar amônia."),
+
+    # Psychiatric
+    ("fluoxetina", ("isrs",), 0, 1, "Segura em IRC leve/moderada.", "Metabolização hepática. Ajustar em cirrose."),
+    ("sertralina", ("isrs",), 0, 1, "Segura em IRC.", "Ajustar dose em hepatopatia."),
+    ("isrs", ("isrs",), 0, 0, None, None),
+
+    # Immunosuppressants
+    ("ciclosporina", (), 3, 2, "ALTA nefrotoxicidade. Fibrose intersticial.", "Hepatotoxicidade. Monitorar níveis e função hepática."),
+    ("tacrolimus", (), 3, 2, "NEFROTOXICIDADE significativa.", "Hepatotoxicidade. Monitorar níveis."),
+
+    # Others
+    ("omeprazol", (), 0, 0, "Nefrite intersticial (rara). Seguro geralmente.", "Metabolização hepática. Geralmente seguro."),
+    ("ranitidina", (), 1, 1, "Ajustar dose se TFG < 50.", "Hepatotoxicidade rara."),
+    ("contraste iodado", ("contraste_iodado",), 0, 0, None, None),
+]
+
+UNCATALOGED_IMPACT = {
+    "renal": "Impacto renal não catalogado. Consultar bula/Micromedex.",
+    "hepatic": "Impacto hepático não catalogado. Consultar bula/Micromedex."
+}
+
+# Class-level interactions, level: 1 leve, 2 moderada, 3 grave
+INTERACTION_RULES = [
+    {
+        "classes": ("cumarinico", "aine"),
+        "level": 3,
+        "severity": "GRAVE",
+        "summary": "Interação significativa entre anticoagulante e AINE.",
+        "details": "Varfarina + AINEs aumentam MUITO o risco de sangramento. Os AINEs inibem agregação plaquetária e podem causar lesão gástrica, potencializando o efeito anticoagulante.",
+        "recommendations": "EVITAR combinação. Se necessário analgesia, preferir Paracetamol. Monitorar INR rigorosamente se uso inevitável.",
+        "monitoring": {"outros": ["INR (RNI) semanal ou conforme ajuste", "Hemograma (avaliar sangramento)"]}
+    },
+    {
+        "classes": ("digitalico", "reduz_clearance_digoxina"),
+        "level": 3,
+        "severity": "GRAVE",
+        "summary": "Risco de intoxicação digitálica.",
+        "details": "Amiodarona e Verapamil reduzem clearance da Digoxina, elevando níveis séricos. Risco de bradicardia, bloqueio AV e arritmias.",
+        "recommendations": "Reduzir dose de Digoxina em 50% ao iniciar Amiodarona. Monitorar níveis séricos e ECG.",
+        "monitoring": {"outros": ["Digoxinemia (níveis séricos)", "ECG (avaliar ritmo e condução)"]}
+    },
+    {
+        "classes": ("isrs", "serotoninergico_opioide"),
+        "level": 3,
+        "severity": "MODERADA a GRAVE",
+        "summary": "Risco de Síndrome Serotoninérgica.",
+        "details": "ISRS + Tramadol/Opioides aumentam serotonina no SNC. Sintomas: agitação, hipertermia, rigidez, tremor, hiperreflexia.",
+        "recommendations": "Monitorar sinais de síndrome serotoninérgica. Preferir analgésicos não-opioides. Suspender drogas e suporte se sintomas.",
+        "monitoring": {"outros": ["Monitorar sinais de síndrome serotoninérgica"]}
+    },
+    {
+        "classes": ("biguanida", "contraste_iodado"),
+        "level": 2,
+        "severity": "MODERADA",
+        "summary": "Risco de acidose láctica.",
+        "details": "Contraste iodado pode causar nefropatia, reduzindo eliminação de Metformina e precipitando acidose láctica.",
+        "recommendations": "Suspender Metformina 48h ANTES do exame. Reavaliar função renal. Retornar após 48-72h se função renal normal.",
+        "monitoring": {
+            "renal": ["Monitorar Creatinina sérica", "Calcular TFG ANTES e APÓS contraste"],
+            "outros": ["Gasometria arterial (se acidose)"]
+        },
+        "renal_note": "⚠️ ATENÇÃO: Contraste pode causar nefropatia aguda!"
+    },
+    {
+        "classes": ("ieca", "poupador_k"),
+        "level": 2,
+        "severity": "MODERADA",
+        "summary": "Risco de hipercalemia.",
+        "details": "IECAs + Diuréticos poupadores de potássio aumentam retenção de K+. Risco de arritmias cardíacas.",
+        "recommendations": "Monitorar K+ sérico regularmente. Evitar suplementação de potássio. Considerar diurético tiazídico como alternativa.",
+        "monitoring": {
+            "renal": ["Monitorar Creatinina sérica"],
+            "outros": ["Potássio (K+) sérico semanal", "ECG se hipercalemia"]
+        },
+        "renal_note": "⚠️ Ambos afetam homeostase de K+ renal!"
+    },
+]
+
+# Labels used by the LLM prompt / frontend, indexed by level
+LEVEL_LABELS = ("Leve", "Leve", "Moderada", "Grave")
+
+RENAL_MONITORING = ["Monitorar Creatinina sérica", "Calcular TFG (Taxa de Filtração Glomerular)"]
+HEPATIC_MONITORING = ["Monitorar TGO/TGP (Transaminases)", "Dosagem de Bilirrubinas"]
+
+# ----- Module-level arrays (row len(DRUG_TABLE) is the "unknown drug" sentinel) -----
+
+NAMES = tuple(entry[0] for entry in DRUG_TABLE)
+NAME_INDEX = {name: i for i, name in enumerate(NAMES)}
+UNKNOWN = len(NAMES)
+
+CLASS_NAMES = tuple(sorted({cls for entry in DRUG_TABLE for cls in entry[1]}))
+_CLASS_INDEX = {cls: i for i, cls in enumerate(CLASS_NAMES)}
+
+CLASS_MEMBERS = np.zeros((UNKNOWN + 1, len(CLASS_NAMES)), dtype=bool)
+for _i, _entry in enumerate(DRUG_TABLE):
+    for _cls in _entry[1]:
+        CLASS_MEMBERS[_i, _CLASS_INDEX[_cls]] = True
+
+RENAL_BURDEN = np.array([entry[2] for entry in DRUG_TABLE] + [0], dtype=np.int8)
+HEPATIC_BURDEN = np.array([entry[3] for entry in DRUG_TABLE] + [0], dtype=np.int8)
+
+# Drug x drug: index of the most severe matching rule (-1 none) and its level
+PAIR_RULE = np.full((UNKNOWN + 1, UNKNOWN + 1), -1, dtype=np.int16)
+PAIR_LEVEL = np.zeros((UNKNOWN + 1, UNKNOWN + 1), dtype=np.int8)
+for _r, _rule in enumerate(INTERACTION_RULES):
+    _a = CLASS_MEMBERS[:, _CLASS_INDEX[_rule["classes"][0]]]
+    _b = CLASS_MEMBERS[:, _CLASS_INDEX[_rule["classes"][1]]]
+    _mask = (np.outer(_a, _b) | np.outer(_b, _a)) & (PAIR_LEVEL < _rule["level"])
+    PAIR_RULE[_mask] = _r
+    PAIR_LEVEL[_mask] = _rule["level"]
+
+_DOSE_START = re.compile(r"\s\d.*$")
+
+# Spelling correction only fixes typos: one insertion, deletion, substitution
+# or swap of adjacent letters. Wider matches would map a different drug of the
+# same class onto its neighbor (eritromicina -> azitromicina)
+MAX_TYPO_EDITS = 1
+MIN_TYPO_LENGTH = 5
+TYPO_TARGETS = tuple(
+    [(known, row) for row, known in enumerate(NAMES)]
+    + [(synonym, NAME_INDEX[drug]) for synonym, drug in DRUG_SYNONYMS.items() if drug in NAME_INDEX]
+)
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, or limit + 1 once it is exceeded"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _typo_match(word: str) -> Optional[int]:
+    """Row of the only known name/synonym within MAX_TYPO_EDITS of word, else None"""
+    if len(word) < MIN_TYPO_LENGTH:
+        return None
+    rows = {row for known, row in TYPO_TARGETS if _edit_distance(word, known, MAX_TYPO_EDITS) <= MAX_TYPO_EDITS}
+    return rows.pop() if len(rows) == 1 else None
+
+
+@lru_cache(maxsize=4096)
+def resolve_drug(name: str) -> Optional[int]:
+    """
+    Row of a drug in the table, or None
+    Resolution order: canonical name (synonyms, salts, dose removed), any
+    word of it, prefix ("amoxi" -> amoxicilina), then a typo-level spelling
+    correction; anything else stays unresolved
+    """
+    base = _DOSE_START.sub("", canonical_drug_name(name or "")).strip()
+    if not base:
+        return None
+    if base in NAME_INDEX:
+        return NAME_INDEX[base]
+
+    tokens = base.split()
+    for token in tokens:
+        if token in NAME_INDEX:
+            return NAME_INDEX[token]
+
+    if len(base) >= 4:
+        prefixed = [i for i, known in enumerate(NAMES) if known.startswith(base) or base.startswith(known)]
+        if len(prefixed) == 1:
+            return prefixed[0]
+
+    return _typo_match(tokens[0])
+
+
+def organ_impact(name: str) -> Dict[str, str]:
+    """Renal and hepatic impact text of one drug"""
+    row = resolve_drug(name)
+    if row is None or DRUG_TABLE[row][4] is None:
+        return dict(UNCATALOGED_IMPACT)
+    return {"renal": DRUG_TABLE[row][4], "hepatic": DRUG_TABLE[row][5]}
+
+
+def _merge_monitoring(target: Dict[str, List[str]], items: Dict[str, List[str]]):
+    for area, entries in items.items():
+        bucket = target.setdefault(area, [])
+        bucket.extend(entry for entry in entries if entry not in bucket)
+
+
+def screen(medications: Sequence[str]) -> Dict[str, Any]:
+    """
+    Deterministic pre-screen of a whole prescription in one batched lookup
+    Returns per-drug resolution and burden, the N x N severity matrix, the
+    pairwise and cumulative renal/hepatic burden, and every interacting pair
+    (most severe first)
+    """
+    rows = np.array(
+        [row if row is not None else UNKNOWN for row in map(resolve_drug, medications)],
+        dtype=np.intp
+    )
+
+    grid = np.ix_(rows, rows)
+    levels = PAIR_LEVEL[grid].copy()
+    np.fill_diagonal(levels, 0)
+    rules = PAIR_RULE[grid]
+    renal = RENAL_BURDEN[rows].astype(np.int16)
+    hepatic = HEPATIC_BURDEN[rows].astype(np.int16)
+
+    pairs = np.argwhere(np.triu(levels, 1) > 0)
+    pairs = pairs[np.argsort(-levels[pairs[:, 0], pairs[:, 1]], kind="stable")] if len(pairs) else pairs
+
+    monitoring: Dict[str, List[str]] = {}
+    if renal.any():
+        _merge_monitoring(monitoring, {"renal": RENAL_MONITORING})
+    if hepatic.any():
+        _merge_monitoring(monitoring, {"hepatic": HEPATIC_MONITORING})
+
+    interactions = []
+    for i, j in pairs:
+        rule = INTERACTION_RULES[rules[i, j]]
+        _merge_monitoring(monitoring, rule["monitoring"])
+        interactions.append({
+            "drugs": [medications[i], medications[j]],
+            "level": int(levels[i, j]),
+            "severity": LEVEL_LABELS[levels[i, j]],
+            "rule_severity": rule["severity"],
+            "summary": rule["summary"],
+            "details": rule["details"],
+            "recommendations": rule["recommendations"],
+            "renal_note": rule.get("renal_note")
+        })
+
+    max_level = int(levels.max()) if len(rows) else 0
+    return {
+        "drugs": [
+            {
+                "input": med,
+                "resolved": NAMES[row] if row != UNKNOWN else None,
+                "renal_burden": int(renal[k]),
+                "hepatic_burden": int(hepatic[k])
+            }
+            for k, (med, row) in enumerate(zip(medications, rows))
+        ],
+        "severity": LEVEL_LABELS[max_level],
+        "max_level": max_level,
+        "severity_matrix": levels.tolist(),
+        "renal_burden": int(renal.sum()),
+        "hepatic_burden": int(hepatic.sum()),
+        "renal_burden_matrix": (renal[:, None] + renal[None, :]).tolist(),
+        "hepatic_burden_matrix": (hepatic[:, None] + hepatic[None, :]).tolist(),
+        "interactions": interactions,
+        "monitoring": {area: items for area, items in monitoring.items() if items}
+    }
@@ -5,7 +5,8 @@ Atualiza alertas a cada hora usando Gemini 2.0 Flash
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Any
 import asyncio
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from llm_client import llm_client
+from llm_response_parser import extract_json, LlmResponseError
 
 # Cache global
 alerts_cache = {
@@ -57,20 +58,21 @@ Forneça a resposta em formato JSON estritamente seguindo este modelo:
 Responda APENAS com o JSON, sem texto adicional."""
 
     try:
-        # Usar Gemini 2.0 Flash via Emergent Integrations
-        chat = LlmChat(provider="google", model="gemini-2.5-flash")
-        messages = [UserMessage(content=prompt)]
-        response = await chat.ainvoke(messages)
+        # Usar Gemini 2.5 Flash via cliente LLM compartilhado
+        response = await llm_client.send(
+            prompt,
+            "Você é um especialista em epidemiologia. Responda apenas com JSON válido.",
+            model="gemini-2.5-flash",
+            session_prefix="alerts"
+        )
         
         # Extrair JSON da resposta
-        import json
-        import re
+        try:
+            data = extract_json(response, Dict[str, Any])
+        except LlmResponseError:
+            data = None
         
-        # Tentar extrair JSON da resposta
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            data = json.loads(json_match.group())
-            
+        if data is not None:
             # Adicionar data aos itens
             current_date = datetime.now(timezone.utc).strftime("%d/%m/%Y")
             for item in data.get("brazil", []):
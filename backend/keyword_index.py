@@ -0,0 +1,83 @@
+"""
+Compiled Keyword Index for the Rule-Based Engine
+All keywords of a rule table are compiled into one alternation regex, so a
+text is matched against every rule in a single pass, and matching rules are
+scored and ranked instead of "first elif wins"
+"""
+import re
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from text_normalization import normalize_many
+
+
+def _trie_pattern(words: Sequence[str]) -> str:
+    """
+    Regex for a set of literals with common prefixes factored out
+    ("dor|dor no peito|dores" -> "dor(?:es| no peito)?"), which Python's
+    backtracking engine matches much faster than a flat alternation.
+    Longer alternatives are tried first, so the longest keyword wins.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordIndex:
+    """
+    Keyword -> rules index over a table of rules
+    Each rule is a dict with "keywords" (normalized on load) and
+    an optional "weight" (default 1.0) for specific rules that must beat
+    generic ones. Keywords match at the start of a word and may be stems
+    ("respir" matches "respirar"), so they never hit inside a word ("ar" in
+    "barriga") but do prefix longer ones ("ar" in "arritmia"): rule tables use
+    phrases for short terms ("falta de ar").
+    """
+
+    def __init__(self, rules: Sequence[Dict[str, Any]]):
+        self.rules = rules
+        self._rules_by_keyword: Dict[str, List[int]] = {}
+        for index, rule in enumerate(rules):
+            for keyword in normalize_many(rule["keywords"]):
+                self._rules_by_keyword.setdefault(keyword, []).append(index)
+
+        keywords = list(self._rules_by_keyword)
+        # Zero-width lookahead finds a match at every word start (overlapping),
+        # the trie returns the longest keyword there
+        self._pattern = re.compile(r"\b(?=(" + _trie_pattern(keywords) + "))")
+
+    def matches(self, text: str) -> Set[str]:
+        """
+        Distinct keywords found in the (normalized) text
+        Only the longest keyword at each position counts: "dor" inside
+        "dor no peito" is not a match of its own, so a generic rule does not
+        gain score from the words of a more specific one
+        """
+        return set(self._pattern.findall(text))
+
+    def rank(self, text: str) -> List[Tuple[float, int]]:
+        """
+        (score, rule index) of every matching rule, best first
+        score = weight x number of distinct keywords matched;
+        ties keep table order (earlier rules were checked first before)
+        """
+        scores: Dict[int, float] = {}
+        for keyword in self.matches(text):
+            for index in self._rules_by_keyword[keyword]:
+                scores[index] = scores.get(index, 0.0) + self.rules[index].get("weight", 1.0)
+        return sorted(((score, index) for index, score in scores.items()), key=lambda item: (-item[0], item[1]))
+
+    def best(self, text: str) -> Optional[Dict[str, Any]]:
+        """Best matching rule, or None"""
+        ranked = self.rank(text)
+        return self.rules[ranked[0][1]] if ranked else None
@@ -0,0 +1,346 @@
+"""
+Shared LLM Client
+Single entry point for every LLM call (consensus functions, medical chat,
+epidemiological alerts): API key, per-model configuration, timeouts and
+concurrency limits live here instead of in each caller
+"""
+import os
+import asyncio
+import threading
+from collections import deque
+from typing import Deque, Dict, Any, Optional, AsyncIterator, Tuple
+from dotenv import load_dotenv
+from emergentintegrations.llm.chat import LlmChat, UserMessage
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from cost_tracker import record_usage, current_usage_scope
+
+load_dotenv()
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+# OpenAI-compatible proxy that serves universal (sk-emergent-) keys
+EMERGENT_PROXY_URL = os.environ.get("INTEGRATION_PROXY_URL", "https://integrations.emergentagent.com") + "/llm"
+
+
+class ModelConfig:
+    """Provider, concurrency limit and timeout of one model"""
+
+    def __init__(self, provider: str, max_concurrency: int = 16, timeout: float = 120.0):
+        self.provider = provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout
+        }
+
+
+class ModelSlots:
+    """
+    Async semaphore shared by every event loop of the process
+    TaskManager thread mode runs each task in its own loop, and an
+    asyncio.Semaphore only counts the callers of one loop. Here the counter
+    is guarded by a thread lock and a released slot is handed to the next
+    waiter on that waiter's own loop (call_soon_threadsafe), so no thread is
+    blocked while waiting.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_use < self.limit and not self._waiters:
+                self.in_use += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:
+                    granted = True
+            # Slot handed over just before the cancellation: pass it on
+            if granted and waiter[1].done() and not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def _grant(self, future: asyncio.Future):
+        if future.done():
+            # Waiter cancelled after the slot was handed over
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                if loop.is_closed():
+                    continue
+                # The slot moves to the waiter, in_use stays the same
+                loop.call_soon_threadsafe(self._grant, future)
+                return
+            self.in_use -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class LlmClient:
+    """
+    Shared LLM client
+    - One place holds the key and the model table (provider, limit, timeout)
+    - Calls are bounded per model by a semaphore, so bursts queue here
+      instead of opening dozens of simultaneous upstream requests
+    - Every successful call is recorded in the usage buffer, billed to the
+      current usage_scope (or to "system" under the session prefix)
+    - A circuit breaker per model rejects calls immediately (CircuitOpenError)
+      after repeated failures, until a probe call succeeds again
+    - LlmChat keeps conversation state per session, so a chat object is
+      built per call; the HTTP connections underneath are shared by the
+      provider library and kept alive between calls
+    - stream() calls litellm directly, the only path with incremental output
+
+    The per-model limit is a ModelSlots shared by all event loops, so it also
+    holds in TaskManager thread mode (one loop per task).
+    """
+
+    def __init__(self, api_key: Optional[str], default_model: str = DEFAULT_MODEL,
+                 max_concurrency: int = 16, timeout: float = 120.0,
+                 breaker_failures: int = 5, breaker_reset_seconds: float = 30.0,
+                 stream_api_base: Optional[str] = None):
+        self.api_key = api_key
+        self.stream_api_base = stream_api_base
+        self.default_model = default_model
+        self.default_concurrency = max_concurrency
+        self.default_timeout = timeout
+        self.models: Dict[str, ModelConfig] = {}
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._slots: Dict[str, ModelSlots] = {}
+        self._slots_lock = threading.Lock()
+        self.in_flight: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def register_model(self, model: str, provider: str = "gemini",
+                       max_concurrency: Optional[int] = None, timeout: Optional[float] = None):
+        """Add or override the configuration of a model"""
+        self.models[model] = ModelConfig(
+            provider,
+            max_concurrency if max_concurrency is not None else self.default_concurrency,
+            timeout if timeout is not None else self.default_timeout
+        )
+
+    def get_config(self, model: Optional[str] = None) -> ModelConfig:
+        """Configuration of a model (registered on first use with defaults)"""
+        model = model or self.default_model
+        if model not in self.models:
+            self.register_model(model)
+        return self.models[model]
+
+    def breaker(self, model: Optional[str] = None) -> CircuitBreaker:
+        """Circuit breaker of a model"""
+        model = model or self.default_model
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(model, self.breaker_failures, self.breaker_reset_seconds)
+        return self._breakers[model]
+
+    def _semaphore(self, model: str) -> ModelSlots:
+        with self._slots_lock:
+            if model not in self._slots:
+                self._slots[model] = ModelSlots(self.get_config(model).max_concurrency)
+            return self._slots[model]
+
+    def create_chat(self, system_message: str, session_id: Optional[str] = None,
+                    model: Optional[str] = None, session_prefix: str = "llm") -> LlmChat:
+        """Build a configured chat (for callers that need the raw object)"""
+        if not self.api_key:
+            raise ValueError("EMERGENT_LLM_KEY environment variable is required but not set")
+        model = model or self.default_model
+        return LlmChat(
+            api_key=self.api_key,
+            session_id=session_id or f"{session_prefix}_{os.urandom(8).hex()}",
+            system_message=system_message
+        ).with_model(self.get_config(model).provider, model)
+
+    def _check_breaker(self, model: str):
+        if not self.breaker(model).allow():
+            raise CircuitOpenError(f"LLM '{model}' indisponível (circuito aberto)")
+
+    def _started(self, model: str):
+        self.in_flight[model] = self.in_flight.get(model, 0) + 1
+        self.calls[model] = self.calls.get(model, 0) + 1
+
+    def _finished(self, model: str, failed: Optional[bool]):
+        """failed=None: cancelled or abandoned by the caller - not the model's fault"""
+        self.in_flight[model] = self.in_flight.get(model, 1) - 1
+        if failed:
+            self.errors[model] = self.errors.get(model, 0) + 1
+            self.breaker(model).record_failure()
+        elif failed is False:
+            self.breaker(model).record_success()
+
+    def _record_usage(self, model: str, session_prefix: str, system_message: str, prompt: str, response: str):
+        """
+        Queue a usage record; LlmChat.send_message returns only the answer text
+        (no provider token counts), so tokens are counted at flush time
+        """
+        user_id, consultation_type = current_usage_scope() or ("system", session_prefix)
+        record_usage(user_id, consultation_type, prompt, str(response), model, system_text=system_message)
+
+    async def send(self, prompt: str, system_message: str, session_id: Optional[str] = None,
+                   model: Optional[str] = None, session_prefix: str = "llm") -> str:
+        """Send one prompt and return the full answer text"""
+        model = model or self.default_model
+        config = self.get_config(model)
+        chat = self.create_chat(system_message, session_id, model, session_prefix)
+        self._check_breaker(model)
+
+        async with self._semaphore(model):
+            self._started(model)
+            failed = None
+            try:
+                response = await asyncio.wait_for(
+                    chat.send_message(UserMessage(text=prompt)),
+                    timeout=config.timeout
+                )
+                failed = False
+                self._record_usage(model, session_prefix, system_message, prompt, response)
+                return response
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self._finished(model, failed)
+
+    def _stream_params(self, model: str) -> Dict[str, Any]:
+        """
+        litellm arguments for a streamed call
+        LlmChat has no incremental output, so streaming calls go to litellm
+        (the library LlmChat uses underneath). Universal keys are served by
+        the integration proxy, an OpenAI-compatible endpoint
+        (LLM_STREAM_API_BASE overrides it); other keys go to the provider.
+        """
+        if not self.api_key:
+            raise ValueError("EMERGENT_LLM_KEY environment variable is required but not set")
+        provider = self.get_config(model).provider
+        params: Dict[str, Any] = {"model": f"{provider}/{model}", "api_key": self.api_key}
+        api_base = self.stream_api_base
+        if api_base is None and self.api_key.startswith("sk-emergent-"):
+            api_base = EMERGENT_PROXY_URL
+        if api_base:
+            params["api_base"] = api_base
+            params["custom_llm_provider"] = "openai"
+        return params
+
+    async def stream(self, prompt: str, system_message: str, session_id: Optional[str] = None,
+                     model: Optional[str] = None, session_prefix: str = "llm") -> AsyncIterator[str]:
+        """
+        Send one prompt and yield the answer text as the model produces it
+        Stateless: conversation history must be in the prompt (session_id is
+        accepted for symmetry with send()). The model slot is held until the
+        last chunk; a caller that stops iterating (client disconnect) is not
+        counted as a model failure.
+        """
+        import litellm
+
+        model = model or self.default_model
+        config = self.get_config(model)
+        params = self._stream_params(model)
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ]
+        self._check_breaker(model)
+
+        async with self._semaphore(model):
+            self._started(model)
+            failed = None
+            parts = []
+            try:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + config.timeout
+                response = await asyncio.wait_for(
+                    litellm.acompletion(messages=messages, stream=True, timeout=config.timeout, **params),
+                    timeout=config.timeout
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                    except StopAsyncIteration:
+                        break
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        parts.append(text)
+                        yield text
+                failed = False
+                self._record_usage(model, session_prefix, system_message, prompt, "".join(parts))
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self._finished(model, failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-model configuration and call counters"""
+        return {
+            model: {
+                **config.as_dict(),
+                "in_flight": self.in_flight.get(model, 0),
+                "waiting": self._slots[model].waiting if model in self._slots else 0,
+                "calls": self.calls.get(model, 0),
+                "errors": self.errors.get(model, 0),
+                "circuit": self.breaker(model).stats()
+            }
+            for model, config in self.models.items()
+        }
+
+
+def parse_model_limits(value: str) -> Dict[str, int]:
+    """Parse LLM_MODEL_LIMITS like "gemini-2.5-flash=16,gemini-2.5-pro=4" """
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        model, limit = item.split("=", 1)
+        try:
+            limits[model.strip()] = int(limit)
+        except ValueError:
+            print(f"⚠️ Limite inválido em LLM_MODEL_LIMITS: {item}")
+    return limits
+
+
+# Global LLM client instance
+llm_client = LlmClient(
+    api_key=os.environ.get("EMERGENT_LLM_KEY"),
+    default_model=os.environ.get("LLM_DEFAULT_MODEL", DEFAULT_MODEL),
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "16")),
+    timeout=float(os.environ.get("LLM_TIMEOUT_SECONDS", "120")),
+    breaker_failures=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+    breaker_reset_seconds=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30")),
+    stream_api_base=os.environ.get("LLM_STREAM_API_BASE") or None
+)
+for _model, _limit in parse_model_limits(os.environ.get("LLM_MODEL_LIMITS", "")).items():
+    llm_client.register_model(_model, max_concurrency=_limit)
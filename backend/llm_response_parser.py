@@ -0,0 +1,135 @@
+"""
+LLM Response Parser
+Finds the JSON value in a model answer in a single scan (code fences, leading
+or trailing prose are ignored), repairs answers cut off mid-JSON and
+validates the result against the feature's pydantic model
+"""
+import json
+from functools import lru_cache
+from typing import Any, Iterator, List, Optional, Tuple
+from pydantic import TypeAdapter, ValidationError
+
+# How many cut points to try (latest first) when repairing a truncated answer
+MAX_REPAIR_ATTEMPTS = 50
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class LlmResponseError(ValueError):
+    """The answer holds no JSON value that decodes and matches the schema"""
+
+
+def _scan(text: str, start: int):
+    """
+    Walk the JSON value starting at text[start] once
+    Returns (end, cuts, stack, in_string): end is the index after the value
+    or None if the text ends first; cuts are (index, open brackets) pairs
+    after which the value can be closed without losing complete members.
+    A mismatched closer means this is not a JSON value: cuts is None and end
+    is the index after that closer
+    """
+    stack: List[str] = []
+    cuts = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            if not stack or _CLOSERS[stack[-1]] != char:
+                return i + 1, None, stack, in_string
+            stack.pop()
+            if not stack:
+                return i + 1, cuts, stack, in_string
+            cuts.append((i + 1, "".join(stack)))
+        elif char == ",":
+            cuts.append((i, "".join(stack)))
+    return None, cuts, stack, in_string
+
+
+def _close(prefix: str, stack: str) -> str:
+    """Close every open bracket of a truncated prefix"""
+    prefix = prefix.rstrip().rstrip(",")
+    if prefix.endswith(":"):
+        prefix += " null"
+    return prefix + "".join(_CLOSERS[bracket] for bracket in reversed(stack))
+
+
+def _candidates(text: str) -> Iterator[Tuple[str, bool]]:
+    """(JSON text, repaired) pairs to try, best first (complete values, then repairs)"""
+    position = 0
+    while True:
+        start = next((i for i in range(position, len(text)) if text[i] in _CLOSERS), None)
+        if start is None:
+            return
+        end, cuts, stack, in_string = _scan(text, start)
+        if cuts is None:
+            # Broken value (e.g. "[nota}" before the object) - not a truncation
+            position = end
+            continue
+        if end is None:
+            # Truncated: close in place, then drop trailing members one by one
+            prefix = text[start:] + ('"' if in_string else "")
+            yield _close(prefix, "".join(stack)), True
+            for cut, cut_stack in reversed(cuts[-MAX_REPAIR_ATTEMPTS:]):
+                yield _close(text[start:cut], cut_stack), True
+            return
+        yield text[start:end], False
+        # A value that did not decode/validate (e.g. "[nota]" before the
+        # object) - continue after it
+        position = end
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+def extract_json(text: str, schema: Any = None) -> Any:
+    """
+    Extract the JSON value of an LLM answer
+    With a schema (pydantic model or type such as List[MedicationItem]) the
+    first candidate that validates is returned - the decoded data itself,
+    so extra fields sent by the model are kept
+    """
+    return extract_json_checked(text, schema)[0]
+
+
+def extract_json_checked(text: str, schema: Any = None) -> Tuple[Any, bool]:
+    """
+    extract_json that also tells whether the value was repaired from a
+    truncated answer - repaired results are usable but incomplete, so callers
+    should not cache them
+    """
+    if not text:
+        raise LlmResponseError("Empty response")
+
+    last_error: Optional[Exception] = None
+    for candidate, repaired in _candidates(text):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError as e:
+            last_error = e
+            continue
+        if schema is not None:
+            try:
+                _adapter(schema).validate_python(data)
+            except ValidationError as e:
+                last_error = e
+                continue
+        return data, repaired
+
+    if last_error is None:
+        raise LlmResponseError("No JSON value in response")
+    raise LlmResponseError(f"No valid JSON in response: {last_error}")
@@ -0,0 +1,145 @@
+"""
+Password Hashing Off the Event Loop
+bcrypt costs ~200 ms of CPU per hash/verify. Running it inside async handlers
+froze every other request during login bursts; here it runs in a small
+dedicated thread pool (bcrypt releases the GIL) with a bounded queue
+"""
+import os
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from passlib.context import CryptContext
+
+
+class PasswordHasherBusy(Exception):
+    """Raised instead of queueing when max_queue operations are already waiting"""
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (milliseconds) with approximate percentiles"""
+
+    BOUNDS_MS = (10, 25, 50, 100, 200, 300, 500, 750, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: List[int] = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float):
+        with self._lock:
+            self.counts[bisect_left(self.BOUNDS_MS, ms)] += 1
+            self.total += 1
+            self.sum_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of samples"""
+        with self._lock:
+            if not self.total:
+                return 0.0
+            target = fraction * self.total
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return min(float(self.BOUNDS_MS[index]), round(self.max_ms, 2)) if index < len(self.BOUNDS_MS) else round(self.max_ms, 2)
+            return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = {
+                (f"<={bound}" if index < len(self.BOUNDS_MS) else f">{self.BOUNDS_MS[-1]}"): count
+                for index, (bound, count) in enumerate(zip(self.BOUNDS_MS + (self.BOUNDS_MS[-1],), self.counts))
+            }
+            total, sum_ms, max_ms = self.total, self.sum_ms, self.max_ms
+        return {
+            "count": total,
+            "avg_ms": round(sum_ms / total, 2) if total else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p90_ms": self.percentile(0.90),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(max_ms, 2),
+            "buckets": buckets
+        }
+
+
+class PasswordHasher:
+    """
+    Runs passlib hash/verify in a dedicated ThreadPoolExecutor
+    - At most max_workers bcrypt operations run at once; further ones wait
+      in the pool queue, up to max_queue waiting operations in total
+    - Beyond that, PasswordHasherBusy is raised (the server answers 503) so a
+      login burst degrades into fast retries instead of an ever-growing queue
+    - Queue wait and total latency are recorded per operation
+    """
+
+    def __init__(self, context, max_workers: int = 2, max_queue: int = 64):
+        self.context = context
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.queue_wait = LatencyHistogram()
+        self.latency: Dict[str, LatencyHistogram] = {"hash": LatencyHistogram(), "verify": LatencyHistogram()}
+
+    async def _run(self, operation: str, func, *args) -> Any:
+        with self._lock:
+            if self.in_flight - self.max_workers >= self.max_queue:
+                self.rejected += 1
+                raise PasswordHasherBusy(f"Password {operation} queue full ({self.max_queue})")
+            self.in_flight += 1
+
+        submitted = time.perf_counter()
+
+        def work():
+            self.queue_wait.record((time.perf_counter() - submitted) * 1000)
+            return func(*args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, work)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self.latency[operation].record((time.perf_counter() - submitted) * 1000)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password"""
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Check a password against its hash"""
+        return await self._run("verify", self.context.verify, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = self.in_flight
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.max_workers),
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "hash": self.latency["hash"].snapshot(),
+            "verify": self.latency["verify"].snapshot()
+        }
+
+
+def default_workers() -> int:
+    """Half the CPUs (at least 1, at most 4): leaves cores for the server loop"""
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+# Global password hasher (bcrypt)
+password_hasher = PasswordHasher(
+    CryptContext(schemes=["bcrypt"], deprecated="auto"),
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", str(default_workers()))),
+    max_queue=int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+)
@@ -0,0 +1,98 @@
+"""
+Presence Index
+"Who was active in the last N minutes" without scanning every known user:
+a ring of time buckets, each holding the users whose latest activity fell in
+that bucket. Queries add up a fixed number of bucket sizes; expiring a bucket
+drops its users in one step.
+"""
+import math
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+
+class PresenceIndex:
+    """
+    Time-bucketed ring of user sets
+    - touch(): moves the user to the current bucket, O(1)
+    - count(seconds): sum of the newest ceil(seconds / bucket_seconds) bucket
+      sizes, O(buckets) which is constant for a given window
+    - Resolution is bucket_seconds: a user stays "online" up to one bucket
+      longer than the requested window
+    - Memory is bounded by the users active during the last `window` seconds
+    """
+
+    def __init__(self, window: float = 300.0, bucket_seconds: float = 10.0):
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.size = math.ceil(window / bucket_seconds) + 1
+        self._buckets: List[Set[str]] = [set() for _ in range(self.size)]
+        self._user_bucket: Dict[str, int] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._current: Optional[int] = None
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds)
+
+    def _advance(self, bucket: int):
+        """Expire the buckets that fall out of the ring before moving to `bucket`"""
+        if self._current is None:
+            self._current = bucket
+            return
+        if bucket <= self._current:
+            return
+        # Each slot is cleared at most once per call, so the cost is amortized O(1) per touch
+        for number in range(max(self._current + 1, bucket - self.size + 1), bucket + 1):
+            expired = self._buckets[number % self.size]
+            for user_id in expired:
+                del self._user_bucket[user_id]
+                del self._last_seen[user_id]
+            self._buckets[number % self.size] = set()
+        self._current = bucket
+
+    def touch(self, user_id: str, timestamp: Optional[float] = None):
+        """Record activity of a user (now, or at an earlier timestamp inside the window)"""
+        now = time.time()
+        timestamp = now if timestamp is None else min(timestamp, now)
+        self._advance(self._bucket(now))
+        bucket = self._bucket(timestamp)
+        previous = self._user_bucket.get(user_id)
+        if bucket <= self._current - self.size or (previous is not None and previous > bucket):
+            return
+        if previous != bucket:
+            if previous is not None:
+                self._buckets[previous % self.size].discard(user_id)
+            self._buckets[bucket % self.size].add(user_id)
+            self._user_bucket[user_id] = bucket
+        self._last_seen[user_id] = max(timestamp, self._last_seen.get(user_id, 0))
+
+    def remove(self, user_id: str) -> bool:
+        """Drop a user (deleted/deactivated account) before their bucket expires"""
+        bucket = self._user_bucket.pop(user_id, None)
+        if bucket is None:
+            return False
+        self._buckets[bucket % self.size].discard(user_id)
+        del self._last_seen[user_id]
+        return True
+
+    def _recent_buckets(self, seconds: float) -> List[Set[str]]:
+        self._advance(self._bucket(time.time()))
+        if self._current is None:
+            return []
+        count = min(self.size, math.ceil(seconds / self.bucket_seconds) + 1)
+        return [self._buckets[(self._current - offset) % self.size] for offset in range(count)]
+
+    def count(self, seconds: float) -> int:
+        """Users active during the last `seconds` (seconds <= window)"""
+        return sum(len(bucket) for bucket in self._recent_buckets(seconds))
+
+    def active_since(self, seconds: float) -> Dict[str, datetime]:
+        """Users active during the last `seconds` -> last activity (UTC)"""
+        return {
+            user_id: datetime.fromtimestamp(self._last_seen[user_id], timezone.utc)
+            for bucket in self._recent_buckets(seconds)
+            for user_id in bucket
+        }
+
+    def __len__(self) -> int:
+        return len(self._user_bucket)
@@ -0,0 +1,178 @@
+"""
+Response Cache for AI Consensus Functions
+Content-addressed cache of LLM results: in-memory LRU with TTL plus an
+optional MongoDB tier shared between workers
+"""
+import os
+import copy
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Any, Optional
+from text_normalization import normalize_text
+
+
+def normalize_cache_value(value: Any) -> Any:
+    """Normalize arguments so equivalent inputs produce the same key"""
+    if isinstance(value, str):
+        return " ".join(normalize_text(value).split())
+    if isinstance(value, dict):
+        return {str(k): normalize_cache_value(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_cache_value(v) for v in value]
+    return value
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache for analyze_* results
+    Keys hash the function namespace, the normalized arguments and the
+    prompt/model version, so changing a prompt invalidates old entries.
+    Only successful LLM answers should be stored (never fallbacks).
+    The MongoDB tier is bound to the loop that called start() (the server
+    loop); calls from other loops (TaskManager thread mode) run their Motor
+    I/O on that loop through run_coroutine_threadsafe.
+    """
+
+    def __init__(self, ttl_seconds: int = 21600, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.collection = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # analyze_* may run in pool threads (TaskManager thread mode)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+
+    def enable_mongo_tier(self, collection):
+        """Also store entries in a MongoDB collection (shared between workers)"""
+        self.collection = collection
+
+    async def start(self):
+        """Bind the MongoDB tier to the running (server) loop and create its TTL index"""
+        if self.collection is None:
+            return
+        self._loop = asyncio.get_running_loop()
+        try:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            print(f"⚠️ Aviso ao criar índice do cache de IA: {e}")
+
+    def make_key(self, namespace: str, version: str, **kwargs) -> str:
+        """Build a cache key from function namespace, version and arguments"""
+        payload = json.dumps(
+            {"fn": namespace, "v": version, "args": normalize_cache_value(kwargs)},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return f"{namespace}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    async def _on_server_loop(self, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """Run a Motor operation on the loop the collection belongs to"""
+        if self._loop is None or self._loop.is_closed():
+            raise RuntimeError("AI cache MongoDB tier not started")
+        if asyncio.get_running_loop() is self._loop:
+            return await operation()
+
+        async def run():
+            # Motor binds its futures to the loop it is called from
+            return await operation()
+
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run(), self._loop))
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_memory(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        expires_at = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Get a cached result (a copy) or None"""
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return copy.deepcopy(value)
+
+        if self.collection is not None:
+            try:
+                doc = await self._on_server_loop(lambda: self.collection.find_one({"_id": key}))
+                if doc is not None:
+                    expires_at = doc["expires_at"]
+                    if expires_at.tzinfo is None:
+                        expires_at = expires_at.replace(tzinfo=timezone.utc)
+                    remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+                    if remaining > 0:
+                        self._set_memory(key, doc["value"], remaining)
+                        self.mongo_hits += 1
+                        return copy.deepcopy(doc["value"])
+            except Exception as e:
+                print(f"⚠️ Error reading AI cache: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        """Store a result in memory (and MongoDB when enabled)"""
+        value = copy.deepcopy(value)
+        self._set_memory(key, value)
+
+        if self.collection is not None:
+            try:
+                document = {
+                    "_id": key,
+                    "namespace": key.split(":", 1)[0],
+                    "value": value,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+                }
+                await self._on_server_loop(
+                    lambda: self.collection.replace_one({"_id": key}, document, upsert=True)
+                )
+            except Exception as e:
+                print(f"⚠️ Error writing AI cache: {e}")
+
+    def clear(self):
+        """Drop every in-memory entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self.hits + self.mongo_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "mongo_tier": self.collection is not None,
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.mongo_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    ttl_seconds=int(os.environ.get("AI_CACHE_TTL_SECONDS", "21600")),  # 6 hours
+    max_entries=int(os.environ.get("AI_CACHE_MAX_ENTRIES", "1024"))
+)
@@ -0,0 +1,55 @@
+"""
+Retry Policy for Background AI Tasks
+Exponential backoff with jitter and a retryable-exception classifier
+"""
+import random
+from typing import Callable, Optional
+from circuit_breaker import CircuitOpenError
+
+# Programming errors - retrying the same call will not fix them;
+# an open circuit rejects every call until its reset timeout
+NON_RETRYABLE_ERRORS = (TypeError, AttributeError, NotImplementedError, CircuitOpenError)
+
+
+def default_retryable(error: BaseException) -> bool:
+    """Retry everything except programming errors"""
+    return not isinstance(error, NON_RETRYABLE_ERRORS)
+
+
+class RetryPolicy:
+    """
+    Retry settings for one task type
+    delay(n) = min(max_delay, base_delay * multiplier ** (n - 1)), reduced by up
+    to `jitter` (fraction) so simultaneous failures do not retry in lockstep
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 2.0,
+        max_delay: float = 30.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.5,
+        retryable: Optional[Callable[[BaseException], bool]] = None
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.retryable = retryable or default_retryable
+
+    def should_retry(self, attempt: int, error: BaseException) -> bool:
+        """Whether to try again after `attempt` (1-based) failed with `error`"""
+        return attempt < self.max_attempts and self.retryable(error)
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the `attempt`-th (1-based) failure"""
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        return random.uniform(delay * (1 - self.jitter), delay)
+
+    def __repr__(self):
+        return (
+            f"RetryPolicy(max_attempts={self.max_attempts}, base_delay={self.base_delay}, "
+            f"max_delay={self.max_delay}, multiplier={self.multiplier}, jitter={self.jitter})"
+        )
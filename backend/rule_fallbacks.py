@@ -0,0 +1,85 @@
+"""
+Rule-Engine Fallbacks for AI Tasks
+Adapts the deterministic ai_engine answers to the result shape of the
+matching ai_medical_consensus function, so the frontend renders either one.
+Used by TaskManager as the provisional / degraded answer (see hedged mode).
+"""
+from typing import Dict, List, Any, Optional
+from ai_engine import (
+    analyze_detailed_diagnosis,
+    get_medication_guide,
+    analyze_toxicology,
+    get_drug_organ_impact
+)
+from drug_matrix import screen
+
+RULE_ENGINE_SOURCE = "rule_engine"
+
+
+def _mark(result: Dict[str, Any]) -> Dict[str, Any]:
+    result["source"] = RULE_ENGINE_SOURCE
+    return result
+
+
+def diagnosis_fallback(queixa: str, idade: str = "N/I", sexo: str = "N/I") -> Dict[str, Any]:
+    """Same arguments and shape as analyze_diagnosis"""
+    result = analyze_detailed_diagnosis({"queixa": queixa, "idade": idade, "sexo": sexo})
+    return _mark(result.model_dump())
+
+
+def medication_guide_fallback(condition: str, patient_age: str = "N/I", contraindications: Optional[str] = None) -> Dict[str, Any]:
+    """Same arguments and shape as analyze_medication_guide"""
+    medications = [item.model_dump() for item in get_medication_guide(condition)]
+    return _mark({"medications": medications})
+
+
+def toxicology_fallback(agent: str, exposure_route: Optional[str] = None, symptoms: Optional[str] = None) -> Dict[str, Any]:
+    """Same arguments and shape as analyze_toxicology"""
+    return _mark(analyze_toxicology(" ".join(filter(None, [agent, symptoms]))).model_dump())
+
+
+def drug_interaction_fallback(medications: List[str], patient_info: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Same arguments and shape as analyze_drug_interaction
+    Built from the drug_matrix pre-screen: every interacting pair is listed,
+    the worst one defines the global severity. Without a known interaction the
+    severity stays "BAIXA ou DESCONHECIDA" (as in analyze_drug_interaction), and
+    drugs the matrix does not know are named in the summary
+    """
+    medications = [med for med in medications if med and med.strip()]
+    prescreen = screen(medications)
+    findings = [(" + ".join(found["drugs"]), found) for found in prescreen["interactions"]]
+    organ_impact = {med: get_drug_organ_impact(med) for med in medications}
+    unresolved = [drug["input"] for drug in prescreen["drugs"] if drug["resolved"] is None]
+
+    if findings:
+        severity = prescreen["severity"]
+        summary = " ".join(f"{pair_name}: {found['summary']}" for pair_name, found in findings)
+        details = "\n\n".join(f"**{pair_name}** ({found['severity']}): {found['details']}" for pair_name, found in findings)
+        recommendations = "\n".join(f"**{pair_name}:** {found['recommendations']}" for pair_name, found in findings)
+    else:
+        severity = "BAIXA ou DESCONHECIDA"
+        summary = "Não há interação grave conhecida entre esses medicamentos na literatura comum."
+        details = "Isso não exclui interações raras ou farmacocinéticas sutis. Sempre consultar bula e bases especializadas (Micromedex, UpToDate)."
+        recommendations = "Monitoramento clínico de rotina. Relatar ao médico qualquer efeito adverso novo após início da combinação."
+    if unresolved:
+        summary += f" Medicamentos não reconhecidos, interações não avaliadas: {', '.join(unresolved)}."
+
+    return _mark({
+        "severity": severity,
+        "summary": summary,
+        "details": details,
+        "recommendations": recommendations,
+        "renal_impact": "\n".join(f"**{med}:** {impact['renal']}" for med, impact in organ_impact.items()),
+        "hepatic_impact": "\n".join(f"**{med}:** {impact['hepatic']}" for med, impact in organ_impact.items()),
+        "monitoring": prescreen["monitoring"] or None
+    })
+
+
+# Task type -> fallback with the same signature as the task function
+RULE_FALLBACKS = {
+    "diagnosis": diagnosis_fallback,
+    "medication_guide": medication_guide_fallback,
+    "toxicology": toxicology_fallback,
+    "drug_interaction": drug_interaction_fallback,
+}
@@ -4,23 +4,37 @@ Sistema médico profissional com IA
 Versão: 2.0 - Limpa e Confiável
 """
 import os
+import json
 import asyncio
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 from uuid import uuid4
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
 from motor.motor_asyncio import AsyncIOMotorClient
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from bson import ObjectId
 from pathlib import Path
 import shutil
 from dotenv import load_dotenv
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from llm_client import llm_client
+from session_cache import session_cache
+from activity_tracker import activity_buffer
+from password_hasher import password_hasher, PasswordHasherBusy
+from auth_sessions import find_login_user, is_expired, expire_account, rotate_session
+from user_listing import (
+    build_filters as build_user_filters,
+    list_page as list_users_page,
+    LIST_PROJECTION as USER_LIST_PROJECTION,
+    ensure_list_indexes as ensure_user_list_indexes,
+    NOT_DELETED as USER_NOT_DELETED
+)
+from cost_tracker import usage_buffer, usage_scope, get_monthly_stats, get_all_time_stats, get_usage_series
 
 # Load environment
 load_dotenv()
@@ -58,13 +72,19 @@ consultations_collection = db.consultations
 costs_collection = db.usage_stats
 feedbacks_collection = db.feedbacks
 chat_history_collection = db.chat_history
+ai_tasks_collection = db.ai_tasks
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
+PASSWORD_BUSY_DETAIL = "Servidor ocupado, tente novamente em instantes"
+
+async def get_password_hash(password: str) -> str:
+    """Hash a password (bcrypt runs in the password hasher pool)"""
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail=PASSWORD_BUSY_DETAIL, headers={"Retry-After": "1"})
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 # FastAPI app
@@ -77,6 +97,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Static files
@@ -112,21 +133,65 @@ from ai_medical_consensus import (
     analyze_drug_interaction,
     analyze_medication_guide,
     analyze_toxicology,
-    analyze_dose_calculator
+    analyze_dose_calculator,
+    GEMINI_MODEL
 )
 
+# AI response cache (AI_CACHE_MONGO=1 adds a tier shared between workers)
+from response_cache import response_cache
+from drug_canonical import canonical_drug_set
+from drug_matrix import screen as screen_prescription
+if os.environ.get("AI_CACHE_MONGO", "0") == "1":
+    response_cache.enable_mongo_tier(db.ai_response_cache)
+
 # Import task manager
+# TASK_STORE=mongo shares tasks between uvicorn workers and survives restarts
+# TASK_EXECUTION_MODE=async runs AI tasks on the server loop (TASK_MAX_CONCURRENCY,
+# TASK_TYPE_LIMITS="dose_calculator=20,drug_interaction=50") instead of 4 threads
+# AI_FALLBACK_MODE=hedged answers from the rule engine when the LLM misses
+# AI_LATENCY_BUDGET_SECONDS, fails or its circuit breaker is open. Off by default:
+# the frontend does not show degraded/provisional results yet, so a rule-engine
+# answer would look exactly like the AI consensus
 from task_manager import TaskManager, TaskStatus
-task_manager = TaskManager()
+from task_store import InMemoryTaskStore, MongoTaskStore
+from rule_fallbacks import RULE_FALLBACKS
+TASK_STORE = os.environ.get("TASK_STORE", "memory").lower()
+TASK_EXECUTION_MODE = os.environ.get("TASK_EXECUTION_MODE", "thread").lower()
+AI_FALLBACK_MODE = os.environ.get("AI_FALLBACK_MODE", "off").lower()
+
+
+def parse_type_limits(value: str) -> dict:
+    """Parse "type=limit,type=limit" into a dict"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            task_type, limit = item.split("=", 1)
+            limits[task_type.strip()] = int(limit)
+    return limits
+
+
+task_manager = TaskManager(
+    store=MongoTaskStore(ai_tasks_collection) if TASK_STORE == "mongo" else InMemoryTaskStore(),
+    execution_mode=TASK_EXECUTION_MODE,
+    max_concurrency=int(os.environ.get("TASK_MAX_CONCURRENCY", "200")),
+    type_limits=parse_type_limits(os.environ.get("TASK_TYPE_LIMITS", "")),
+    fallbacks=RULE_FALLBACKS if AI_FALLBACK_MODE == "hedged" else None,
+    latency_budget=float(os.environ.get("AI_LATENCY_BUDGET_SECONDS", "45")),
+    circuit_breaker=llm_client.breaker(GEMINI_MODEL)
+)
 
 # Timezone utilities
-from timezone_utils import now_sao_paulo
+from timezone_utils import now_sao_paulo, parse_utc
 
 
 # ===== AUTHENTICATION =====
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    """Check a password (bcrypt runs in the password hasher pool)"""
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail=PASSWORD_BUSY_DETAIL, headers={"Retry-After": "1"})
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -134,7 +199,17 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
 
+# Stored in active_session_token on logout: no token matches it
+LOGGED_OUT_SESSION = "logged_out"
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Recently validated session (short TTL, dropped when the user changes)
+    cached_user = session_cache.get(token)
+    if cached_user is not None:
+        if not cached_user.deleted:
+            activity_buffer.touch(cached_user.id, cached_user.email)
+        return cached_user
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         user_id = payload.get("sub")
@@ -153,7 +228,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
                 detail="Sessão expirada. Sua conta foi conectada em outro dispositivo."
             )
         
-        return UserInDB(
+        current_user = UserInDB(
             id=str(user["_id"]),
             email=user["email"],
             name=user["name"],
@@ -165,6 +240,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             deleted=user.get("deleted", False),
             active_session_token=user.get("active_session_token")
         )
+        session_cache.put(
+            token, current_user, current_user.id, current_user.email,
+            token_expires_at=payload.get("exp")
+        )
+        if not current_user.deleted:
+            activity_buffer.touch(current_user.id, current_user.email)
+        return current_user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -200,8 +282,11 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     # Clean input
     username = form_data.username.strip().lower()
     
-    # Find user
-    user = await users_collection.find_one({"email": username})
+    now = datetime.now(timezone.utc)
+    expired_detail = "Sua conta expirou. Para renovar, clique em 'Adquirir Acesso'."
+    
+    # Find user (login fields only)
+    user = await find_login_user(users_collection, username)
     
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
@@ -214,32 +299,25 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     
     # Check expiration
-    if user.get("expiration_date") and user["expiration_date"] < datetime.utcnow():
-        await users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"deleted": True, "deleted_at": datetime.utcnow()}}
-        )
-        raise HTTPException(
-            status_code=403,
-            detail="Sua conta expirou. Para renovar, clique em 'Adquirir Acesso'."
-        )
+    if is_expired(user, now):
+        await expire_account(users_collection, user["_id"], now)
+        activity_buffer.forget(user["_id"])
+        raise HTTPException(status_code=403, detail=expired_detail)
     
     # Verify password
-    if not verify_password(form_data.password, user["password_hash"]):
+    if not await verify_password(form_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Senha incorreta")
     
     # Create new token
     access_token = create_access_token({"sub": str(user["_id"])})
     
-    # Update user with new session token and last activity
-    # This will invalidate any previous session
-    await users_collection.update_one(
-        {"_id": user["_id"]},
-        {"$set": {
-            "last_activity": datetime.now(timezone.utc),
-            "active_session_token": access_token  # Salva o token da sessão ativa
-        }}
-    )
+    # Save the new session token and last activity in one guarded write
+    # This will invalidate any previous session; it matches nothing if the
+    # account was deleted or expired since it was read
+    user = await rotate_session(users_collection, user["_id"], access_token, now)
+    if not user:
+        raise HTTPException(status_code=403, detail=expired_detail)
+    session_cache.invalidate_user(user["_id"])
     
     return {
         "access_token": access_token,
@@ -252,6 +330,20 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     }
 
 
+@app.post("/api/auth/logout")
+async def logout(
+    token: str = Depends(oauth2_scheme),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """End the current session (the token stops being accepted)"""
+    await users_collection.update_one(
+        {"_id": ObjectId(current_user.id), "active_session_token": {"$in": [token, None]}},
+        {"$set": {"active_session_token": LOGGED_OUT_SESSION}}
+    )
+    session_cache.invalidate_user(current_user.id)
+    return {"message": "Logout realizado com sucesso"}
+
+
 @app.get("/api/users/me")
 async def get_user_profile(current_user: UserInDB = Depends(get_current_active_user)):
     """Get current user profile"""
@@ -285,6 +377,7 @@ async def update_user_profile(
                 {"_id": ObjectId(current_user.id)},
                 {"$set": update_data}
             )
+            session_cache.invalidate_user(current_user.id)
         
         return {
             "name": data.get("name", current_user.name),
@@ -329,6 +422,7 @@ async def upload_avatar(
             {"_id": ObjectId(current_user.id)},
             {"$set": {"avatar_url": avatar_url}}
         )
+        session_cache.invalidate_user(current_user.id)
         
         return {"avatar_url": avatar_url}
     except HTTPException:
@@ -340,6 +434,11 @@ async def upload_avatar(
 
 # ===== AI ENDPOINTS =====
 
+def task_coalesce_key(task_type: str, **kwargs) -> str:
+    """Key shared by identical AI requests so in-flight duplicates reuse one task"""
+    return response_cache.make_key(task_type, "inflight", **kwargs)
+
+
 @app.post("/api/ai/consensus/diagnosis")
 async def create_diagnosis_task(
     patient_data: dict,
@@ -347,17 +446,20 @@ async def create_diagnosis_task(
 ):
     """Create diagnosis analysis task"""
     try:
-        task_id = task_manager.create_task("diagnosis")
+        params = {
+            "queixa": patient_data.get("queixa", ""),
+            "idade": patient_data.get("idade", "N/I"),
+            "sexo": patient_data.get("sexo", "N/I")
+        }
+        task_id = task_manager.create_task(
+            "diagnosis",
+            coalesce_key=task_coalesce_key("diagnosis", **params),
+            user_id=current_user.id
+        )
         
         # Start background task
         asyncio.create_task(
-            task_manager.execute_task(
-                task_id,
-                analyze_diagnosis,
-                queixa=patient_data.get("queixa", ""),
-                idade=patient_data.get("idade", "N/I"),
-                sexo=patient_data.get("sexo", "N/I")
-            )
+            task_manager.execute_task(task_id, analyze_diagnosis, **params)
         )
         
         return {"task_id": task_id, "message": "Análise iniciada"}
@@ -373,19 +475,22 @@ async def create_medication_guide_task(
 ):
     """Create medication guide task"""
     try:
-        task_id = task_manager.create_task("medication_guide")
-        
         # Accept both 'symptoms' and 'condition' for flexibility
         condition = data.get("symptoms") or data.get("condition", "")
         
+        params = {
+            "condition": condition,
+            "patient_age": data.get("age", "N/I"),
+            "contraindications": data.get("contraindications")
+        }
+        task_id = task_manager.create_task(
+            "medication_guide",
+            coalesce_key=task_coalesce_key("medication_guide", **params),
+            user_id=current_user.id
+        )
+        
         asyncio.create_task(
-            task_manager.execute_task(
-                task_id,
-                analyze_medication_guide,
-                condition=condition,
-                patient_age=data.get("age", "N/I"),
-                contraindications=data.get("contraindications")
-            )
+            task_manager.execute_task(task_id, analyze_medication_guide, **params)
         )
         
         return {"task_id": task_id, "message": "Análise iniciada"}
@@ -401,16 +506,19 @@ async def create_toxicology_task(
 ):
     """Create toxicology analysis task"""
     try:
-        task_id = task_manager.create_task("toxicology")
+        params = {
+            "agent": data.get("substance", ""),
+            "exposure_route": data.get("route"),
+            "symptoms": data.get("symptoms")
+        }
+        task_id = task_manager.create_task(
+            "toxicology",
+            coalesce_key=task_coalesce_key("toxicology", **params),
+            user_id=current_user.id
+        )
         
         asyncio.create_task(
-            task_manager.execute_task(
-                task_id,
-                analyze_toxicology,
-                agent=data.get("substance", ""),
-                exposure_route=data.get("route"),
-                symptoms=data.get("symptoms")
-            )
+            task_manager.execute_task(task_id, analyze_toxicology, **params)
         )
         
         return {"task_id": task_id, "message": "Análise iniciada"}
@@ -434,7 +542,13 @@ async def create_dose_calculator_task(
         
         patient_data = data.get("patient", {})
         
-        task_id = task_manager.create_task("dose_calculator")
+        task_id = task_manager.create_task(
+            "dose_calculator",
+            coalesce_key=task_coalesce_key(
+                "dose_calculator", patient_data=patient_data, medications=medications
+            ),
+            user_id=current_user.id
+        )
         
         asyncio.create_task(
             task_manager.execute_task(
@@ -465,7 +579,15 @@ async def create_drug_interaction_task(
         if len(medications) > 10:
             raise HTTPException(status_code=400, detail="Máximo 10 medicamentos permitidos")
         
-        task_id = task_manager.create_task("drug_interaction")
+        task_id = task_manager.create_task(
+            "drug_interaction",
+            coalesce_key=task_coalesce_key(
+                "drug_interaction",
+                medications=canonical_drug_set(medications),
+                patient_info=data.get("patient_info")
+            ),
+            user_id=current_user.id
+        )
         
         asyncio.create_task(
             task_manager.execute_task(
@@ -476,7 +598,12 @@ async def create_drug_interaction_task(
             )
         )
         
-        return {"task_id": task_id, "message": f"Análise iniciada para {len(medications)} medicamentos"}
+        # Deterministic pre-screen (table lookup) returned right away, before the LLM answer
+        return {
+            "task_id": task_id,
+            "message": f"Análise iniciada para {len(medications)} medicamentos",
+            "pre_screen": screen_prescription(medications)
+        }
     except Exception as e:
         print(f"Error creating drug interaction task: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -488,48 +615,77 @@ async def get_task_status(
     current_user: UserInDB = Depends(get_current_active_user)
 ):
     """Get task status"""
-    task = task_manager.get_task(task_id)
+    task = await task_manager.get_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 
+@app.get("/api/ai/tasks/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Server-Sent Events stream of task progress
+    Authenticates once, pushes every status/progress change and the final
+    result as soon as the task completes or fails, then closes
+    """
+    task = await task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    async def event_stream():
+        async for update in task_manager.watch_task(task_id):
+            if update is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(jsonable_encoder(update), ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ===== ADMIN =====
 
 @app.get("/api/admin/users")
-async def get_admin_users(current_user: UserInDB = Depends(get_current_active_user)):
-    """Get all users (admin only)"""
+async def get_admin_users(
+    response: Response,
+    role: Optional[str] = None,
+    status: Optional[str] = None,
+    expires_after: Optional[str] = None,
+    expires_before: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Get users, newest first (admin only)
+    Filters: role (ADMIN/USER), status (active/expired), expires_after/expires_before (ISO, UTC)
+    Keyset pagination: pass the X-Next-Cursor header of a page as cursor to get the next one
+    """
     if current_user.role != "ADMIN":
         raise HTTPException(status_code=403, detail="Admin only")
     
-    users = []
-    # Project only necessary fields to reduce payload size
-    projection = {
-        "_id": 1, "email": 1, "name": 1, "username": 1, "role": 1, "deleted": 1,
-        "created_at": 1, "expiration_date": 1, "deleted_at": 1, "reactivated_at": 1,
-        "last_activity": 1, "status": 1
-        # Exclude avatar_url to reduce payload
-    }
-    cursor = users_collection.find({"deleted": {"$ne": True}}, projection).sort("created_at", -1).limit(1000)
-    async for doc in cursor:
+    try:
+        query = build_user_filters(role, status, parse_utc(expires_after), parse_utc(expires_before))
+        query["deleted"] = USER_NOT_DELETED
+        users, next_cursor = await list_users_page(
+            users_collection, query, "created_at", cursor, limit, USER_LIST_PROJECTION
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    for doc in users:
         doc["_id"] = str(doc["_id"])
         # Add id field from username or email
         doc["id"] = doc.get("username", doc.get("email", ""))
         doc["status"] = "Ativo" if not doc.get("deleted") else "Inativo"
-        
-        # Convert datetime fields to UTC aware
-        if "created_at" in doc:
-            doc["created_at"] = ensure_utc_timezone(doc["created_at"])
-        if "expiration_date" in doc:
-            doc["expiration_date"] = ensure_utc_timezone(doc["expiration_date"])
-        if "deleted_at" in doc:
-            doc["deleted_at"] = ensure_utc_timezone(doc["deleted_at"])
-        if "reactivated_at" in doc:
-            doc["reactivated_at"] = ensure_utc_timezone(doc["reactivated_at"])
-        if "last_activity" in doc:
-            doc["last_activity"] = ensure_utc_timezone(doc["last_activity"])
-            
-        users.append(doc)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return users
 
 
@@ -561,7 +717,7 @@ async def create_user(
             "username": user_data.get("name", user_data.get("email")),
             "name": user_data.get("name", user_data.get("email")),
             "email": user_data.get("email"),
-            "password_hash": get_password_hash(user_data.get("password")),
+            "password_hash": await get_password_hash(user_data.get("password")),
             "role": user_data.get("role", "USER"),
             "expiration_date": expiration_date,
             "created_at": datetime.now(timezone.utc),
@@ -615,6 +771,7 @@ async def update_user_expiration(
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
         
+        session_cache.invalidate_user(user_id)
         return {"message": "Validade atualizada com sucesso"}
     except HTTPException:
         raise
@@ -662,6 +819,9 @@ async def toggle_user_status(
                 }}
             )
         
+        session_cache.invalidate_user(user["_id"])
+        if new_deleted_status:
+            activity_buffer.forget(user["_id"])
         new_status = "Inativo" if new_deleted_status else "Ativo"
         
         return {"status": new_status, "message": f"Status atualizado para {new_status}"}
@@ -704,6 +864,8 @@ async def delete_user(
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
         
+        session_cache.invalidate_user(user_id)
+        activity_buffer.forget(user_id)
         return {"message": "Usuário excluído com sucesso"}
     except HTTPException:
         raise
@@ -738,6 +900,8 @@ async def permanently_delete_user(
             print(f"[PERMANENT DELETE] User not found: {user_id}")
             raise HTTPException(status_code=404, detail="User not found")
         
+        session_cache.invalidate_user(user_id)
+        activity_buffer.forget(user_id)
         print(f"[PERMANENT DELETE] Successfully deleted {result.deleted_count} user(s)")
         return {"message": "User permanently deleted", "deleted_count": result.deleted_count}
     except HTTPException:
@@ -774,6 +938,7 @@ async def reactivate_user(
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
         
+        session_cache.invalidate_user(user_id)
         return {"message": f"Usuário reativado com {days_valid} dias de validade"}
     except HTTPException:
         raise
@@ -782,6 +947,85 @@ async def reactivate_user(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/admin/ai-cache/stats")
+async def get_ai_cache_stats(current_user: UserInDB = Depends(get_current_active_user)):
+    """AI response cache hit/miss counters (admin only)"""
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return response_cache.stats()
+
+
+@app.get("/api/admin/auth/metrics")
+async def get_auth_metrics(current_user: UserInDB = Depends(get_current_active_user)):
+    """Password hashing pool latency/queue metrics and session cache counters (admin only)"""
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return {
+        "password_hasher": password_hasher.stats(),
+        "session_cache": session_cache.stats(),
+        "activity": activity_buffer.stats()
+    }
+
+
+@app.get("/api/admin/llm/stats")
+async def get_llm_stats(current_user: UserInDB = Depends(get_current_active_user)):
+    """Per-model LLM limits and call counters (admin only)"""
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return llm_client.stats()
+
+
+@app.get("/api/admin/usage-stats/monthly")
+async def get_usage_stats_monthly(
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """LLM token usage and cost of a month, current month by default (admin only)"""
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if month is not None and not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Mês inválido")
+    return await get_monthly_stats(year, month)
+
+
+@app.get("/api/admin/usage-stats/all-time")
+async def get_usage_stats_all_time(current_user: UserInDB = Depends(get_current_active_user)):
+    """LLM token usage and cost since the beginning (admin only)"""
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return await get_all_time_stats()
+
+
+@app.get("/api/admin/usage-stats/series")
+async def get_usage_stats_series(
+    bucket: str = "day",
+    group_by: str = "consultation_type",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    user_id: Optional[str] = None,
+    consultation_type: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 20,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Cost/token time series by hour, day or month, grouped by consultation_type,
+    user_id or model and ranked by cost (admin only)
+    start/end are ISO dates or datetimes (UTC)
+    """
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    try:
+        return await get_usage_series(
+            bucket, group_by, parse_utc(start), parse_utc(end),
+            user_id=user_id, consultation_type=consultation_type,
+            page=page, page_size=page_size
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/api/admin/consultations")
 async def get_admin_consultations(current_user: UserInDB = Depends(get_current_active_user)):
     """Get all consultations (admin only)"""
@@ -800,21 +1044,63 @@ async def get_admin_consultations(current_user: UserInDB = Depends(get_current_a
     return consultations
 
 
+# "Online" = any authenticated request in the last 5 minutes
+ONLINE_WINDOW_SECONDS = 300
+
+
+async def count_online_users() -> int:
+    """Online users from the presence index, or MongoDB until it covers the window"""
+    if activity_buffer.covers(ONLINE_WINDOW_SECONDS):
+        return activity_buffer.online_count(ONLINE_WINDOW_SECONDS)
+    since = datetime.now(timezone.utc) - timedelta(seconds=ONLINE_WINDOW_SECONDS)
+    return await users_collection.count_documents({
+        "deleted": {"$ne": True},
+        "last_activity": {"$gte": since}
+    })
+
+
+async def list_online_users() -> List[dict]:
+    """Online user documents, most recently active first"""
+    online_users = []
+    if activity_buffer.covers(ONLINE_WINDOW_SECONDS):
+        # Ids and timestamps from memory, profiles by _id
+        active = activity_buffer.active_since(ONLINE_WINDOW_SECONDS)
+        cursor = users_collection.find(
+            {
+                "_id": {"$in": [ObjectId(user_id) for user_id in active]},
+                "deleted": {"$ne": True}
+            },
+            {"password_hash": 0}
+        )
+        async for user in cursor:
+            user["last_activity"] = active[str(user.pop("_id"))].isoformat()
+            online_users.append(user)
+        online_users.sort(key=lambda user: user["last_activity"], reverse=True)
+        return online_users
+    
+    since = datetime.now(timezone.utc) - timedelta(seconds=ONLINE_WINDOW_SECONDS)
+    cursor = users_collection.find(
+        {
+            "last_activity": {"$gte": since},
+            "deleted": {"$ne": True}
+        },
+        {"_id": 0, "password_hash": 0}
+    ).sort("last_activity", -1)
+    
+    async for user in cursor:
+        if user.get("last_activity"):
+            user["last_activity"] = ensure_utc_timezone(user["last_activity"]).isoformat()
+        online_users.append(user)
+    return online_users
+
+
 @app.get("/api/admin/stats/online")
 async def get_online_stats(current_user: UserInDB = Depends(get_current_active_user)):
     """Get online users stats (admin only) - users active in the last 5 minutes"""
     if current_user.role != "ADMIN":
         raise HTTPException(status_code=403, detail="Admin only")
     
-    # Count users who had activity in the last 5 minutes based on last_activity field
-    now = datetime.now(timezone.utc)
-    five_minutes_ago = now - timedelta(minutes=5)
-    
-    online_count = await users_collection.count_documents({
-        "deleted": {"$ne": True},
-        "last_activity": {"$gte": five_minutes_ago}
-    })
-    
+    online_count = await count_online_users()
     return {"online_count": online_count, "online": online_count}
 
 
@@ -831,12 +1117,7 @@ async def get_online_count(
 ):
     """Get count of users online in the last 5 minutes"""
     try:
-        five_minutes_ago = datetime.now(timezone.utc) - timedelta(minutes=5)
-        online_count = await users_collection.count_documents({
-            "last_activity": {"$gte": five_minutes_ago},
-            "deleted": {"$ne": True}
-        })
-        return {"online_count": online_count}
+        return {"online_count": await count_online_users()}
     except Exception as e:
         print(f"Error getting online count: {e}")
         return {"online_count": 0}
@@ -848,48 +1129,43 @@ async def get_online_users(
 ):
     """Get list of users online in the last 5 minutes"""
     try:
-        five_minutes_ago = datetime.now(timezone.utc) - timedelta(minutes=5)
-        online_users = []
-        cursor = users_collection.find(
-            {
-                "last_activity": {"$gte": five_minutes_ago},
-                "deleted": {"$ne": True}
-            },
-            {"_id": 0, "password_hash": 0}
-        ).sort("last_activity", -1)
-        
-        async for user in cursor:
-            if user.get("last_activity"):
-                user["last_activity"] = ensure_utc_timezone(user["last_activity"]).isoformat()
-            online_users.append(user)
-        
-        return online_users
+        return await list_online_users()
     except Exception as e:
         print(f"Error getting online users: {e}")
         return []
 
 
 @app.get("/api/admin/deleted-users")
-async def get_deleted_users(current_user: UserInDB = Depends(get_current_active_user)):
-    """Get deleted users (admin only)"""
+async def get_deleted_users(
+    response: Response,
+    role: Optional[str] = None,
+    expires_after: Optional[str] = None,
+    expires_before: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Get deleted users, most recently deleted first (admin only)
+    Same filters and X-Next-Cursor pagination as /api/admin/users (except status)
+    """
     if current_user.role != "ADMIN":
         raise HTTPException(status_code=403, detail="Admin only")
     
-    users = []
-    cursor = users_collection.find({"deleted": True}).sort("deleted_at", -1).limit(100)
-    async for doc in cursor:
+    try:
+        query = build_user_filters(role, None, parse_utc(expires_after), parse_utc(expires_before))
+        query["deleted"] = True
+        users, next_cursor = await list_users_page(
+            users_collection, query, "deleted_at", cursor, limit, USER_LIST_PROJECTION
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    for doc in users:
         doc["_id"] = str(doc["_id"])
         doc["id"] = doc.get("username", doc.get("email", ""))
-        
-        # Convert datetime fields to UTC aware
-        if "created_at" in doc:
-            doc["created_at"] = ensure_utc_timezone(doc["created_at"])
-        if "deleted_at" in doc:
-            doc["deleted_at"] = ensure_utc_timezone(doc["deleted_at"])
-        if "expiration_date" in doc:
-            doc["expiration_date"] = ensure_utc_timezone(doc["expiration_date"])
-            
-        users.append(doc)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return users
 
 
@@ -1041,6 +1317,10 @@ async def update_document(
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        if collection_name == "users":
+            session_cache.invalidate_user(doc_id)
+            if data.get("deleted"):
+                activity_buffer.forget(doc_id)
         return {"message": "Document updated"}
     except Exception as e:
         print(f"Error updating document in {collection_name}: {e}")
@@ -1066,6 +1346,9 @@ async def delete_document(
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        if collection_name == "users":
+            session_cache.invalidate_user(doc_id)
+            activity_buffer.forget(doc_id)
         return {"message": "Document deleted"}
     except Exception as e:
         print(f"Error deleting document from {collection_name}: {e}")
@@ -1135,26 +1418,7 @@ async def get_epidemiological_alerts():
 
 # ===== MEDICAL CHAT =====
 
-@app.post("/api/medical-chat")
-async def medical_chat(
-    data: dict,
-    current_user: UserInDB = Depends(get_current_active_user)
-):
-    """Free medical consultation with AI for specialists"""
-    try:
-        user_message = data.get("message", "")
-        history = data.get("history", [])
-        
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Mensagem não pode estar vazia")
-        
-        # Build conversation context
-        conversation = []
-        for msg in history[-5:]:  # Last 5 messages for context
-            conversation.append(f"{msg['role'].upper()}: {msg['content']}")
-        
-        # Create specialized medical prompt
-        system_prompt = """Você é um assistente médico especializado para médicos. 
+MEDICAL_CHAT_SYSTEM_PROMPT = """Você é um assistente médico especializado para médicos. 
 
 IMPORTANTE:
 - Use linguagem técnica e científica apropriada para médicos especialistas
@@ -1166,7 +1430,14 @@ IMPORTANTE:
 
 Seu objetivo é auxiliar médicos em suas decisões clínicas com informações técnicas precisas."""
 
-        full_prompt = f"""{system_prompt}
+
+def build_medical_chat_prompt(user_message: str, history: list) -> str:
+    """Build the chat prompt with the last 5 messages as context"""
+    conversation = []
+    for msg in history[-5:]:  # Last 5 messages for context
+        conversation.append(f"{msg['role'].upper()}: {msg['content']}")
+    
+    return f"""{MEDICAL_CHAT_SYSTEM_PROMPT}
 
 CONTEXTO DA CONVERSA:
 {chr(10).join(conversation) if conversation else "Primeira mensagem"}
@@ -1176,34 +1447,56 @@ PERGUNTA DO MÉDICO:
 
 RESPOSTA TÉCNICA:"""
 
-        # Use Gemini 2.0 Flash with Emergent Universal Key
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"medical_chat_{current_user.id}",
-            system_message=system_prompt
-        ).with_model("gemini", "gemini-2.5-flash")
+
+MEDICAL_CHAT_MODEL = "gemini-2.5-flash"
+
+
+async def save_medical_chat(current_user: UserInDB, user_message: str, response: str) -> str:
+    """Save conversation to chat history, returns the chat id"""
+    chat_entry = {
+        "id": str(uuid4()),
+        "user_id": current_user.id,
+        "user_email": current_user.email,
+        "user_name": current_user.name,
+        "user_message": user_message,
+        "ai_response": response,
+        "created_at": datetime.now(timezone.utc),
+        "model": "Meduf 2.5 Clinic"
+    }
+    await chat_history_collection.insert_one(chat_entry)
+    return chat_entry["id"]
+
+
+@app.post("/api/medical-chat")
+async def medical_chat(
+    data: dict,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Free medical consultation with AI for specialists"""
+    try:
+        user_message = data.get("message", "")
+        history = data.get("history", [])
         
-        user_msg = UserMessage(text=full_prompt)
-        response = await chat.send_message(user_msg)
+        if not user_message:
+            raise HTTPException(status_code=400, detail="Mensagem não pode estar vazia")
         
-        # Save conversation to database
-        chat_entry = {
-            "id": str(uuid4()),
-            "user_id": current_user.id,
-            "user_email": current_user.email,
-            "user_name": current_user.name,
-            "user_message": user_message,
-            "ai_response": response,
-            "created_at": datetime.now(timezone.utc),
-            "model": "Meduf 2.5 Clinic"
-        }
-        await chat_history_collection.insert_one(chat_entry)
+        with usage_scope(current_user.id, "medical_chat"):
+            response = await llm_client.send(
+                build_medical_chat_prompt(user_message, history),
+                MEDICAL_CHAT_SYSTEM_PROMPT,
+                session_id=f"medical_chat_{current_user.id}",
+                model=MEDICAL_CHAT_MODEL
+            )
+        
+        await save_medical_chat(current_user, user_message, response)
         
         return {
             "response": response,
             "model": "Meduf 2.5 Clinic"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print(f"❌ Error in medical chat: {type(e).__name__}: {e}")
@@ -1211,6 +1504,53 @@ RESPOSTA TÉCNICA:"""
         raise HTTPException(status_code=500, detail=f"Erro ao processar consulta: {str(e)}")
 
 
+@app.post("/api/medical-chat/stream")
+async def medical_chat_stream(
+    data: dict,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Server-Sent Events variant of /api/medical-chat
+    Sends {"delta": "..."} chunks as the model produces them (llm_client.stream),
+    then {"done": true, "id": ...} once the assembled answer has been saved to
+    chat history.
+    """
+    user_message = data.get("message", "")
+    history = data.get("history", [])
+    
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Mensagem não pode estar vazia")
+    
+    prompt = build_medical_chat_prompt(user_message, history)
+    
+    async def event_stream():
+        chunks = []
+        try:
+            with usage_scope(current_user.id, "medical_chat"):
+                async for chunk in llm_client.stream(
+                    prompt,
+                    MEDICAL_CHAT_SYSTEM_PROMPT,
+                    session_id=f"medical_chat_{current_user.id}",
+                    model=MEDICAL_CHAT_MODEL
+                ):
+                    chunks.append(chunk)
+                    yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            
+            chat_id = await save_medical_chat(current_user, user_message, "".join(chunks))
+            yield f"data: {json.dumps({'done': True, 'id': chat_id, 'model': 'Meduf 2.5 Clinic'})}\n\n"
+        except Exception as e:
+            import traceback
+            print(f"❌ Error in medical chat stream: {type(e).__name__}: {e}")
+            traceback.print_exc()
+            yield f"data: {json.dumps({'error': f'Erro ao processar consulta: {str(e)}'}, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ===== USER CHAT HISTORY =====
 
 @app.get("/api/my-chat-history")
@@ -1335,7 +1675,8 @@ async def startup_event():
         await users_collection.create_index("email", unique=True)
         await users_collection.create_index("deleted")
         await users_collection.create_index("role")
-        await users_collection.create_index("last_active")
+        await users_collection.create_index("last_activity")
+        await ensure_user_list_indexes(users_collection)
         await consultations_collection.create_index("user_id")
         await consultations_collection.create_index("timestamp")
         await consultations_collection.create_index([("user_id", 1), ("timestamp", -1)])
@@ -1347,6 +1688,18 @@ async def startup_event():
     except Exception as e:
         print(f"⚠️ Aviso ao criar índices: {e}")
     
+    await response_cache.start()
+    await usage_buffer.start(db)
+    await activity_buffer.start(users_collection)
+    
+    # Session cache invalidation across workers (MongoDB change stream, replica set only)
+    if os.environ.get("SESSION_CACHE_WATCH", "1") == "1":
+        session_cache.start_watch(users_collection)
+    
+    # Task store (TTL index + batched writes when TASK_STORE=mongo)
+    await task_manager.start()
+    print(f"✅ Task store: {TASK_STORE} | execução: {TASK_EXECUTION_MODE} | fallback: {AI_FALLBACK_MODE}")
+    
     # Iniciar task de atualização horária de alertas epidemiológicos
     from epidemiological_alerts import start_hourly_update_task, get_cached_alerts
     asyncio.create_task(start_hourly_update_task())
@@ -1357,6 +1710,16 @@ async def startup_event():
     print("=" * 80)
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending writes on shutdown"""
+    await task_manager.shutdown()
+    await usage_buffer.close()
+    await activity_buffer.close()
+    await session_cache.stop_watch()
+    password_hasher.executor.shutdown(wait=False)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,170 @@
+"""
+Session Cache for Authenticated Requests
+Short-TTL in-process cache of validated sessions, so get_current_user does not
+hit MongoDB on every request (task polls, chat, dashboards)
+"""
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+def token_hash(token: str) -> str:
+    """Cache key of a token (the raw JWT is never kept as a key)"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class SessionCache:
+    """
+    token hash -> (expires at, user) with a short TTL
+    - A hit is never served past the token's own expiry (JWT exp, stored
+      with the entry), since cache hits skip JWT verification
+    - Entries are indexed by user id and email, so a change to a user
+      (login elsewhere, logout, delete, status toggle, profile update)
+      drops all of their cached sessions: invalidate_user(id_or_email)
+    - Other workers learn about changes through watch_users (MongoDB change
+      stream, needs a replica set); without it, the TTL bounds staleness.
+      Updates that only touch ignored_fields (activity heartbeats) are skipped
+    - LRU-bounded to max_entries
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 10000,
+                 ignored_fields: Tuple[str, ...] = ("last_activity",)):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.ignored_fields = set(ignored_fields)
+        self._entries: "OrderedDict[str, Tuple[float, Any, Tuple[str, ...], Optional[float]]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, token: str) -> Optional[Any]:
+        """Cached user of a token, or None (missing or expired)"""
+        if not self.enabled:
+            return None
+        key = token_hash(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now or (entry[3] is not None and entry[3] <= time.time()):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, user: Any, *identifiers: str, token_expires_at: Optional[float] = None):
+        """
+        Cache a validated session; identifiers (user id, email) are used for invalidation
+        token_expires_at: the token's exp (epoch seconds), hits stop there
+        """
+        if not self.enabled:
+            return
+        key = token_hash(token)
+        identifiers = tuple(str(identifier) for identifier in identifiers if identifier)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, user, identifiers, token_expires_at)
+            for identifier in identifiers:
+                self._by_user.setdefault(identifier, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        """Drop one entry and its user index references (lock held)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for identifier in entry[2]:
+            keys = self._by_user.get(identifier)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_user[identifier]
+
+    def invalidate_token(self, token: str):
+        """Drop one session"""
+        with self._lock:
+            self._remove(token_hash(token))
+
+    def invalidate_user(self, identifier: Any) -> int:
+        """Drop every cached session of a user (by id or email), returns how many"""
+        with self._lock:
+            keys = list(self._by_user.get(str(identifier), ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += 1
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    async def watch_users(self, collection):
+        """
+        Invalidate sessions of users changed by any worker (MongoDB change stream)
+        Requires a replica set; on standalone servers it logs once and stops
+        """
+        try:
+            async with collection.watch(
+                [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+            ) as stream:
+                print("✅ Session cache: change stream de usuários ativo")
+                async for change in stream:
+                    description = change.get("updateDescription") or {}
+                    changed = set(description.get("updatedFields") or {}) | set(description.get("removedFields") or [])
+                    if change["operationType"] == "update" and changed <= self.ignored_fields:
+                        continue
+                    self.invalidate_user(change["documentKey"]["_id"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Session cache: change stream indisponível ({e}), usando apenas TTL de {self.ttl:.0f}s")
+
+    def start_watch(self, collection):
+        """Start watch_users in the background (call on app startup)"""
+        if self.enabled and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self.watch_users(collection))
+
+    async def stop_watch(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "entries": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "watching": self._watch_task is not None and not self._watch_task.done()
+        }
+
+
+# Global session cache (SESSION_CACHE_TTL_SECONDS=0 disables it)
+session_cache = SessionCache(
+    ttl=float(os.environ.get("SESSION_CACHE_TTL_SECONDS", "30")),
+    max_entries=int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "10000"))
+)
@@ -4,12 +4,15 @@ Handles long-running AI consensus tasks asynchronously
 """
 import uuid
 import asyncio
+import contextlib
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable
 from enum import Enum
 from concurrent.futures import ThreadPoolExecutor
 from timezone_utils import now_sao_paulo
-from cost_tracker import track_usage
+from cost_tracker import usage_scope
+from task_store import InMemoryTaskStore
+from retry_policy import RetryPolicy
 import json
 
 
@@ -20,23 +23,103 @@ class TaskStatus(str, Enum):
     FAILED = "failed"
 
 
+TERMINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+
+
+# Per-task-type retry policies (anything not listed uses RetryPolicy())
+DEFAULT_RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    # Raises on malformed JSON / invalid severity - cheap to retry quickly
+    "drug_interaction": RetryPolicy(max_attempts=4, base_delay=2.0, max_delay=20.0),
+    # Long HTML generation and already returns an error page on failure
+    "dose_calculator": RetryPolicy(max_attempts=2, base_delay=5.0, max_delay=30.0),
+}
+
+
+class RetriesExhausted(Exception):
+    """All attempts of a task failed (or the error was not retryable)"""
+    
+    def __init__(self, attempts: int, error: BaseException):
+        super().__init__(f"Failed after {attempts} attempts. Last error: {error}")
+        self.attempts = attempts
+        self.error = error
+
+
+class ExecutionMode(str, Enum):
+    THREAD = "thread"  # New event loop per task in a small thread pool
+    ASYNC = "async"    # Coroutines scheduled directly on the server loop
+
+
 class TaskManager:
     """
     Manages asynchronous background tasks
-    Stores task status and results in memory
+    Stores task status and results in a pluggable task store
+    (in memory by default, see task_store.MongoTaskStore for multi-worker)
+    
+    In ASYNC execution mode tasks run on the server event loop, bounded by a
+    global concurrency semaphore and optional per-task-type limits
+    (e.g. {"dose_calculator": 20}) instead of the 4-thread pool.
+    
+    Failed attempts are retried according to the task type's RetryPolicy.
+    
+    Task types with a fallback (e.g. rule_fallbacks.RULE_FALLBACKS) run
+    hedged: the fallback result is published at once as provisional_result
+    and used as the final result when the LLM misses latency_budget, fails
+    or its circuit_breaker is open (the task is then marked "degraded").
+    
+    LLM usage of a task is billed to the user_id given at creation (see
+    cost_tracker.usage_scope), with the task type as consultation type.
+    
+    Tasks created with the same coalesce_key while one is still in flight are
+    aliases: they get their own task_id but share the first task's execution
+    and mirror all of its status, progress and result updates.
     """
     
-    def __init__(self):
-        self.tasks: Dict[str, Dict[str, Any]] = {}
+    def __init__(
+        self,
+        store=None,
+        execution_mode: ExecutionMode = ExecutionMode.THREAD,
+        max_concurrency: int = 200,
+        type_limits: Optional[Dict[str, int]] = None,
+        retry_policies: Optional[Dict[str, RetryPolicy]] = None,
+        default_retry_policy: Optional[RetryPolicy] = None,
+        fallbacks: Optional[Dict[str, Callable]] = None,
+        latency_budget: float = 45.0,
+        circuit_breaker=None
+    ):
+        self.store = store or InMemoryTaskStore()
         self.cleanup_interval = 3600  # 1 hour
         self.executor = ThreadPoolExecutor(max_workers=4)
+        self.execution_mode = ExecutionMode(execution_mode)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._type_semaphores: Dict[str, asyncio.Semaphore] = {
+            task_type: asyncio.Semaphore(limit)
+            for task_type, limit in (type_limits or {}).items()
+        }
+        self.retry_policies = dict(DEFAULT_RETRY_POLICIES if retry_policies is None else retry_policies)
+        self.default_retry_policy = default_retry_policy or RetryPolicy()
+        self.fallbacks = dict(fallbacks or {})
+        self.latency_budget = latency_budget
+        self.circuit_breaker = circuit_breaker
+        self._running: set = set()
+        self._watchers: Dict[str, asyncio.Event] = {}
+        self._inflight: Dict[str, str] = {}          # coalesce key -> primary task id
+        self._inflight_keys: Dict[str, str] = {}     # primary task id -> coalesce key
+        self._aliases: Dict[str, List[str]] = {}     # primary task id -> alias task ids
+        self._alias_of: Dict[str, str] = {}          # alias task id -> primary task id
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
         
-    def create_task(self, task_type: str) -> str:
-        """Create a new task and return its ID"""
+    def create_task(self, task_type: str, coalesce_key: Optional[str] = None, user_id: Optional[str] = None) -> str:
+        """
+        Create a new task and return its ID
+        If another task with the same coalesce_key is in flight, the new task
+        is attached to it instead of being executed again
+        """
         task_id = str(uuid.uuid4())
-        self.tasks[task_id] = {
+        task = {
             "id": task_id,
             "type": task_type,
+            "user_id": user_id,
             "status": TaskStatus.PENDING,
             "result": None,
             "error": None,
@@ -44,35 +127,196 @@ class TaskManager:
             "completed_at": None,
             "progress": 0
         }
+        
+        primary_id = self._inflight.get(coalesce_key) if coalesce_key else None
+        primary = self.store.get_local(primary_id) if primary_id else None
+        if primary is not None:
+            task["status"] = primary["status"]
+            task["progress"] = primary["progress"]
+            task["coalesced_with"] = primary_id
+            self._aliases.setdefault(primary_id, []).append(task_id)
+            self._alias_of[task_id] = primary_id
+            print(f"🔗 Task {task_id} coalesced with in-flight task {primary_id}")
+        elif coalesce_key:
+            self._inflight[coalesce_key] = task_id
+            self._inflight_keys[task_id] = coalesce_key
+        
+        self.store.save(task)
         return task_id
     
-    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
-        """Get task by ID"""
-        return self.tasks.get(task_id)
+    async def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get task by ID (may be owned by another worker when using a shared store)"""
+        return await self.store.get(task_id)
     
     def update_status(self, task_id: str, status: TaskStatus, progress: int = None):
         """Update task status"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["status"] = status
-            if progress is not None:
-                self.tasks[task_id]["progress"] = progress
-    
-    def complete_task(self, task_id: str, result: Any):
-        """Mark task as completed with result"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["status"] = TaskStatus.COMPLETED
-            self.tasks[task_id]["result"] = result
-            self.tasks[task_id]["completed_at"] = now_sao_paulo()
-            self.tasks[task_id]["progress"] = 100
+        fields = {"status": status}
+        if progress is not None:
+            fields["progress"] = progress
+        self._apply_update(task_id, fields)
+    
+    def complete_task(self, task_id: str, result: Any, degraded_reason: Optional[str] = None):
+        """
+        Mark task as completed with result
+        degraded_reason is set when the result comes from a fallback
+        ("timeout", "llm_error", "circuit_open")
+        """
+        fields = {
+            "status": TaskStatus.COMPLETED,
+            "result": result,
+            "completed_at": now_sao_paulo(),
+            "progress": 100
+        }
+        if degraded_reason:
+            fields["degraded"] = True
+            fields["degraded_reason"] = degraded_reason
+        self._apply_update(task_id, fields, final=True)
     
     def fail_task(self, task_id: str, error: str):
         """Mark task as failed with error message"""
-        if task_id in self.tasks:
-            self.tasks[task_id]["status"] = TaskStatus.FAILED
-            self.tasks[task_id]["error"] = error
-            self.tasks[task_id]["completed_at"] = now_sao_paulo()
+        self._apply_update(task_id, {
+            "status": TaskStatus.FAILED,
+            "error": error,
+            "completed_at": now_sao_paulo()
+        }, final=True)
+    
+    def _apply_update(self, task_id: str, fields: Dict[str, Any], final: bool = False):
+        """Update a task and every alias attached to it, then wake watchers"""
+        if final:
+            coalesce_key = self._inflight_keys.pop(task_id, None)
+            if coalesce_key and self._inflight.get(coalesce_key) == task_id:
+                del self._inflight[coalesce_key]
+            aliases = self._aliases.pop(task_id, [])
+            for alias_id in aliases:
+                self._alias_of.pop(alias_id, None)
+        else:
+            aliases = self._aliases.get(task_id, [])
+        
+        for target_id in [task_id] + aliases:
+            self.store.update(target_id, fields, urgent=final)
+            self._notify(target_id)
+    
+    def _notify(self, task_id: str):
+        """Wake everyone waiting on this task (safe to call from worker threads)"""
+        event = self._watchers.pop(task_id, None)
+        if event is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            event.set()
+        else:
+            self._loop.call_soon_threadsafe(event.set)
+    
+    async def watch_task(self, task_id: str, heartbeat: float = 15.0, timeout: float = 900.0):
+        """
+        Async generator for push-based task updates
+        Yields the task whenever its status/progress changes and stops after a
+        terminal status. Yields None as a heartbeat when nothing changed.
+        Local tasks wake on update; tasks owned by another worker are re-read
+        from the store every few seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        last_seen = None
+        
+        while loop.time() < deadline:
+            # Register before reading so an update between the read and the wait is not lost
+            event = self._watchers.setdefault(task_id, asyncio.Event())
+            task = await self.store.get(task_id)
+            if task is None:
+                return
+            
+            state = (task.get("status"), task.get("progress"))
+            if state != last_seen:
+                last_seen = state
+                yield task
+                if task.get("status") in TERMINAL_STATUSES:
+                    return
+            else:
+                yield None
+            
+            wait = heartbeat if self.store.get_local(task_id) is not None else min(heartbeat, 2.0)
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+    
+    def get_retry_policy(self, task_type: Optional[str]) -> RetryPolicy:
+        """Retry policy for a task type (falls back to the default policy)"""
+        return self.retry_policies.get(task_type, self.default_retry_policy)
+    
+    def _run_in_new_loop(self, func: Callable, args: tuple, kwargs: dict, scope: tuple) -> Any:
+        """Run one attempt of a task coroutine in a fresh event loop (pool thread)"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # Pool threads do not inherit the caller's context - set the usage scope here
+            with usage_scope(*scope):
+                return loop.run_until_complete(func(*args, **kwargs))
+        finally:
+            # Close loop only after all async operations are done
+            try:
+                loop.close()
+            except:
+                pass  # Ignore errors when closing loop
+    
+    async def _run_attempt(self, task_id: str, task_type: Optional[str], func: Callable, args: tuple, kwargs: dict) -> Any:
+        """
+        Run a single attempt, holding an execution slot only while it runs
+        THREAD mode: one pool thread; ASYNC mode: the global + per-type semaphores
+        """
+        task = self.store.get_local(task_id) or {}
+        scope = (task.get("user_id"), task_type or "unknown")
+        
+        if self.execution_mode == ExecutionMode.THREAD:
+            loop = asyncio.get_running_loop()
+            # run_in_executor doesn't accept **kwargs, so we wrap it
+            return await loop.run_in_executor(
+                self.executor,
+                lambda: self._run_in_new_loop(func, args, kwargs, scope)
+            )
+        
+        type_semaphore = self._type_semaphores.get(task_type) or contextlib.nullcontext()
+        async with self._semaphore, type_semaphore:
+            with usage_scope(*scope):
+                return await func(*args, **kwargs)
     
-    def execute_task_sync(
+    async def _attempt_with_retry(self, task_id: str, task_type: Optional[str], func: Callable, args: tuple, kwargs: dict) -> Any:
+        """
+        Run attempts according to the task type's RetryPolicy
+        Returns the result or raises RetriesExhausted. Backoff waits are
+        asynchronous and do not hold a thread or semaphore slot.
+        """
+        policy = self.get_retry_policy(task_type)
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            try:
+                # A hedged task may already have been answered by its fallback
+                task = self.store.get_local(task_id)
+                if task is not None and task.get("status") not in TERMINAL_STATUSES:
+                    self.update_status(task_id, TaskStatus.PROCESSING, progress=max(10, task.get("progress") or 0))
+                print(f"🔄 Task {task_id} started (attempt {attempt}/{policy.max_attempts})")
+                print(f"[Task {task_id}] Executing function {func.__name__}...")
+                
+                return await self._run_attempt(task_id, task_type, func, args, kwargs)
+                
+            except Exception as e:
+                print(f"⚠️ Task {task_id} attempt {attempt} failed: {e}")
+                
+                if not policy.should_retry(attempt, e):
+                    # Retries exhausted or error not retryable
+                    raise RetriesExhausted(attempt, e) from e
+                
+                delay = policy.delay(attempt)
+                print(f"🔄 Retrying task {task_id} in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+    
+    async def run_with_retry(
         self, 
         task_id: str, 
         func: Callable, 
@@ -80,64 +324,97 @@ class TaskManager:
         **kwargs
     ):
         """
-        Execute a task function synchronously (for thread pool)
-        WITH RETRY - NEVER GIVES UP!
+        Execute a task WITH RETRY according to its task type's RetryPolicy
+        Task types with a registered fallback run in hedged mode instead
         """
-        max_retries = 3
-        retry_count = 0
+        task = self.store.get_local(task_id)
+        task_type = task["type"] if task else None
         
-        while retry_count < max_retries:
-            try:
-                self.update_status(task_id, TaskStatus.PROCESSING, progress=10)
-                print(f"🔄 Task {task_id} started (attempt {retry_count + 1}/{max_retries})")
-                
-                # Execute the function in sync context
-                import asyncio
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
+        fallback = self.fallbacks.get(task_type)
+        if fallback is not None:
+            await self._run_hedged(task_id, task_type, func, fallback, args, kwargs)
+            return
+        
+        try:
+            result = await self._attempt_with_retry(task_id, task_type, func, args, kwargs)
+        except RetriesExhausted as e:
+            print(f"❌ Task {task_id} failed after {e.attempts} attempts")
+            self.fail_task(task_id, str(e))
+            import traceback
+            print(f"Full traceback:\n{''.join(traceback.format_exception(e.error))}")
+            return
+        
+        self.complete_task(task_id, result)
+        print(f"✅ Task {task_id} completed successfully")
+    
+    async def _run_hedged(
+        self,
+        task_id: str,
+        task_type: Optional[str],
+        func: Callable,
+        fallback: Callable,
+        args: tuple,
+        kwargs: dict
+    ):
+        """
+        Hedged execution: the fallback (rule engine) answers immediately as a
+        provisional result, the LLM answer replaces it if it arrives within
+        latency_budget seconds. The provisional result becomes final when the
+        budget runs out, the LLM fails or the circuit breaker is open.
+        Once the fallback has answered, the LLM attempt is cancelled so it
+        does not keep retrying for a discarded result (in THREAD mode an
+        attempt already running in the pool finishes, but no retry starts).
+        """
+        try:
+            provisional = fallback(*args, **kwargs)
+        except Exception as e:
+            print(f"⚠️ Fallback for task {task_id} failed: {e}")
+            provisional = None
+        
+        if provisional is not None:
+            self._apply_update(task_id, {
+                "status": TaskStatus.PROCESSING,
+                "provisional_result": provisional,
+                "progress": 50
+            })
+        
+        if provisional is not None and self.circuit_breaker is not None and self.circuit_breaker.is_open():
+            print(f"⚡ Task {task_id} answered by fallback (LLM circuit open)")
+            self.complete_task(task_id, provisional, degraded_reason="circuit_open")
+            return
+        
+        llm = asyncio.ensure_future(self._attempt_with_retry(task_id, task_type, func, args, kwargs))
+        self._running.add(llm)
+        llm.add_done_callback(self._running.discard)
+        # Retrieve the outcome of an abandoned LLM call so it is not logged as unhandled
+        llm.add_done_callback(lambda future: future.cancelled() or future.exception())
+        
+        try:
+            result = await asyncio.wait_for(asyncio.shield(llm), timeout=self.latency_budget)
+        except asyncio.TimeoutError:
+            if provisional is None:
+                # Nothing to fall back to - wait for the LLM like a normal task
                 try:
-                    print(f"[Task {task_id}] Executing function {func.__name__}...")
-                    result = loop.run_until_complete(func(*args, **kwargs))
-                    print(f"[Task {task_id}] Function completed successfully!")
-                    
-                    # Track usage for cost calculation - skip for now to avoid event loop issues
-                    # TODO: Implement proper async tracking in background thread
-                    task = self.tasks.get(task_id)
-                    if task and result:
-                        try:
-                            # Log for manual tracking if needed
-                            print(f"[Task {task_id}] Usage tracking skipped (avoid event loop issues)")
-                        except Exception as track_error:
-                            print(f"⚠️ Error in tracking: {track_error}")
-                    
-                    # Mark as completed
-                    self.complete_task(task_id, result)
-                    print(f"✅ Task {task_id} completed successfully on attempt {retry_count + 1}")
-                    return  # Success! Exit function
-                        
-                finally:
-                    # Close loop only after all async operations are done
-                    try:
-                        loop.close()
-                    except:
-                        pass  # Ignore errors when closing loop
-                
-            except Exception as e:
-                retry_count += 1
-                error_msg = str(e)
-                print(f"⚠️ Task {task_id} attempt {retry_count} failed: {error_msg}")
-                
-                if retry_count < max_retries:
-                    print(f"🔄 Retrying task {task_id} in 5 seconds...")
-                    import time
-                    time.sleep(5)
-                else:
-                    # All retries exhausted
-                    print(f"❌ Task {task_id} failed after {max_retries} attempts")
-                    self.fail_task(task_id, f"Failed after {max_retries} attempts. Last error: {error_msg}")
-                    import traceback
-                    print(f"Full traceback:\n{traceback.format_exc()}")
+                    result = await llm
+                except RetriesExhausted as e:
+                    self.fail_task(task_id, str(e))
+                    return
+            else:
+                print(f"⏱️ Task {task_id} answered by fallback (LLM over {self.latency_budget:.0f}s budget)")
+                self.complete_task(task_id, provisional, degraded_reason="timeout")
+                llm.cancel()
+                return
+        except RetriesExhausted as e:
+            if provisional is None:
+                print(f"❌ Task {task_id} failed after {e.attempts} attempts")
+                self.fail_task(task_id, str(e))
+            else:
+                print(f"⚠️ Task {task_id} answered by fallback after LLM failure: {e.error}")
+                self.complete_task(task_id, provisional, degraded_reason="llm_error")
+            return
+        
+        self.complete_task(task_id, result)
+        print(f"✅ Task {task_id} completed successfully")
 
     async def execute_task(
         self, 
@@ -147,38 +424,55 @@ class TaskManager:
         **kwargs
     ):
         """
-        Execute a task function in background using thread pool
-        Handles errors and updates status automatically
+        Execute a task function in background (thread pool or event loop,
+        depending on execution_mode)
+        Handles errors, retries and updates status automatically
         """
-        # Submit to thread pool for true background execution
-        loop = asyncio.get_event_loop()
-        # run_in_executor doesn't accept **kwargs, so we wrap it
-        loop.run_in_executor(
-            self.executor,
-            lambda: self.execute_task_sync(task_id, func, *args, **kwargs)
+        if task_id in self._alias_of:
+            # Coalesced task - the primary's execution updates it
+            return
+        
+        # Keep a reference so the task is not garbage collected mid-flight
+        background = asyncio.create_task(
+            self.run_with_retry(task_id, func, *args, **kwargs)
         )
+        self._running.add(background)
+        background.add_done_callback(self._running.discard)
     
+
     async def cleanup_old_tasks(self):
         """Remove tasks older than cleanup_interval (background job)"""
         while True:
             try:
-                now = now_sao_paulo()
-                expired_tasks = [
-                    task_id for task_id, task in self.tasks.items()
-                    if (now - task["created_at"]).total_seconds() > self.cleanup_interval
-                ]
+                removed = self.store.prune(self.cleanup_interval)
                 
-                for task_id in expired_tasks:
-                    del self.tasks[task_id]
+                # Drop wake-up events of tasks that no longer live in this process
+                for task_id in list(self._watchers):
+                    if self.store.get_local(task_id) is None:
+                        self._watchers.pop(task_id, None)
                 
-                if expired_tasks:
-                    print(f"🧹 Cleaned up {len(expired_tasks)} old tasks")
+                if removed:
+                    print(f"🧹 Cleaned up {removed} old tasks")
                     
             except Exception as e:
                 print(f"Error in cleanup: {e}")
             
             # Run cleanup every 10 minutes
             await asyncio.sleep(600)
+    
+    async def start(self):
+        """Start the task store and the cleanup job (call on app startup)"""
+        self._loop = asyncio.get_running_loop()
+        await self.store.start()
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self.cleanup_old_tasks())
+    
+    async def shutdown(self):
+        """Stop the cleanup job and flush the task store (call on app shutdown)"""
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+        await self.store.close()
 
 
 # Global task manager instance
@@ -0,0 +1,245 @@
+"""
+Task Store Backends for TaskManager
+In-memory dict (default, single worker) or MongoDB collection (multi-worker, survives restarts)
+"""
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Dict, Any, Optional
+from pymongo import UpdateOne
+from timezone_utils import now_sao_paulo
+
+# TaskStatus values (task_manager imports this module)
+UNFINISHED_STATUSES = ("pending", "processing")
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class InMemoryTaskStore:
+    """
+    Default task store
+    Keeps every task in a process-local dict - tasks are lost on restart
+    and only visible to the worker that created them
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+
+    def save(self, task: Dict[str, Any]):
+        """Store a new task"""
+        self.tasks[task["id"]] = task
+
+    def update(self, task_id: str, fields: Dict[str, Any], urgent: bool = False) -> bool:
+        """Apply field updates to a task, returns False if the task is unknown"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return False
+        task.update(fields)
+        return True
+
+    def get_local(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a task owned by this process (no I/O)"""
+        return self.tasks.get(task_id)
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get task by ID"""
+        return self.tasks.get(task_id)
+
+    def prune(self, max_age_seconds: int) -> int:
+        """Remove tasks older than max_age_seconds, returns how many were removed"""
+        now = now_sao_paulo()
+        expired_tasks = [
+            task_id for task_id, task in self.tasks.items()
+            if (now - task["created_at"]).total_seconds() > max_age_seconds
+        ]
+        for task_id in expired_tasks:
+            del self.tasks[task_id]
+        return len(expired_tasks)
+
+    async def start(self):
+        """Nothing to initialize for the in-memory store"""
+        pass
+
+    async def close(self):
+        """Nothing to flush for the in-memory store"""
+        pass
+
+
+class MongoTaskStore(InMemoryTaskStore):
+    """
+    MongoDB-backed task store
+    - Tasks created by this worker stay in the local dict for fast reads
+    - Writes are coalesced per task and flushed with a single bulk_write
+      every flush_interval seconds (completion/failure flush immediately)
+    - Tasks owned by other workers are read from the collection
+    - A TTL index on created_at replaces the periodic cleanup job
+    - Unfinished tasks carry a heartbeat_at refreshed by their worker; tasks
+      whose worker died (restart, crash) stop getting it and are marked
+      failed after stale_after seconds, on startup and then periodically
+      (a restart does not fail the live tasks of other workers)
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 3600, flush_interval: float = 1.0,
+                 stale_after: float = 60.0):
+        super().__init__()
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self._last_heartbeat = 0.0
+        self._last_sweep = 0.0
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def _queue_write(self, task_id: str, fields: Dict[str, Any], urgent: bool):
+        """Coalesce fields into the pending write for this task (thread-safe)"""
+        with self._lock:
+            self._pending.setdefault(task_id, {}).update(fields)
+        if urgent:
+            self._request_flush()
+
+    def _request_flush(self):
+        """Wake the flush loop - safe to call from worker threads"""
+        if self._loop is None or self._wakeup is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def save(self, task: Dict[str, Any]):
+        """Store a new task locally and queue its insertion"""
+        super().save(task)
+        self._queue_write(task["id"], {**task, "heartbeat_at": datetime.now(timezone.utc)}, urgent=False)
+
+    def update(self, task_id: str, fields: Dict[str, Any], urgent: bool = False) -> bool:
+        """Apply field updates locally and queue them for the next flush"""
+        if not super().update(task_id, fields):
+            return False
+        self._queue_write(task_id, fields, urgent)
+        return True
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get task by ID - local first, then the shared collection"""
+        task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+        return await self.collection.find_one({"_id": task_id}, {"_id": 0})
+
+    def _queue_heartbeats(self):
+        """Refresh heartbeat_at of unfinished local tasks (a few times per stale_after)"""
+        loop_time = asyncio.get_running_loop().time()
+        if loop_time - self._last_heartbeat < self.stale_after / 4:
+            return
+        self._last_heartbeat = loop_time
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for task_id, task in list(self.tasks.items()):
+                if task.get("status") not in FINISHED_STATUSES:
+                    self._pending.setdefault(task_id, {})["heartbeat_at"] = now
+
+    async def fail_orphaned(self) -> int:
+        """Mark failed the unfinished tasks whose worker stopped sending heartbeats"""
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=self.stale_after)
+        try:
+            result = await self.collection.update_many(
+                {
+                    "status": {"$in": list(UNFINISHED_STATUSES)},
+                    "$or": [
+                        {"heartbeat_at": {"$lt": cutoff}},
+                        {"heartbeat_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+                    ]
+                },
+                {"$set": {
+                    "status": "failed",
+                    "error": "Tarefa interrompida por reinício do servidor. Tente novamente.",
+                    "completed_at": now
+                }}
+            )
+        except Exception as e:
+            print(f"⚠️ Erro ao encerrar tasks órfãs: {e}")
+            return 0
+        if result.modified_count:
+            print(f"🧹 {result.modified_count} tasks órfãs marcadas como falhas")
+        return result.modified_count
+
+    async def flush(self):
+        """Write all pending task updates in one bulk_write"""
+        self._queue_heartbeats()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        operations = [
+            UpdateOne({"_id": task_id}, {"$set": _to_document(fields)}, upsert=True)
+            for task_id, fields in pending.items()
+        ]
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            print(f"⚠️ Error flushing {len(operations)} task updates: {e}")
+            # Put the writes back so they are retried on the next flush
+            with self._lock:
+                for task_id, fields in pending.items():
+                    newer = self._pending.get(task_id, {})
+                    self._pending[task_id] = {**fields, **newer}
+
+    async def _flush_loop(self):
+        """Flush pending writes periodically or as soon as a flush is requested"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            loop_time = asyncio.get_running_loop().time()
+            if loop_time - self._last_sweep >= self.stale_after:
+                self._last_sweep = loop_time
+                await self.fail_orphaned()
+
+    async def start(self):
+        """Create the TTL index and start the flush loop"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            await self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        except Exception as e:
+            print(f"⚠️ Aviso ao criar índice TTL de tasks: {e}")
+        # Tasks left unfinished by a previous run of this (or another) worker
+        await self.fail_orphaned()
+        self._last_sweep = self._loop.time()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the flush loop and write everything still pending"""
+        if self._flush_task:
+            # wait_for may swallow a cancel that lands while a wakeup completes:
+            # the flag ends the loop right after that iteration instead
+            self._closing = True
+            self._wakeup.set()
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+def _to_document(fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert enum values (e.g. TaskStatus) to plain values for BSON"""
+    return {
+        key: value.value if isinstance(value, Enum) else value
+        for key, value in fields.items()
+    }
@@ -0,0 +1,52 @@
+"""
+Text Normalization
+Lowercase + accent stripping used by the rule engine, drug lookups and cache
+keys. Accented Latin letters are replaced through a precomputed translation
+table; only text with other non-ASCII characters takes the unicodedata path.
+"""
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, List
+
+# Strings up to this length (drug names, keywords, short fields) are memoized;
+# free text such as complaints is normalized directly
+MEMO_MAX_LENGTH = 64
+
+
+def _strip_marks(text: str) -> str:
+    """Reference path: decompose (NFD) and drop combining marks"""
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in text if unicodedata.category(char) != 'Mn')
+
+
+# Latin-1 Supplement, Latin Extended-A/B: every char whose NFD form loses its marks
+ACCENT_TABLE = str.maketrans({
+    chr(code): _strip_marks(chr(code))
+    for code in range(0x00C0, 0x0250)
+    if _strip_marks(chr(code)) != chr(code)
+})
+
+
+def _normalize(text: str) -> str:
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = text.translate(ACCENT_TABLE)
+    if text.isascii():
+        return text
+    return _strip_marks(text)
+
+
+_normalize_memo = lru_cache(maxsize=8192)(_normalize)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for keyword matching"""
+    if len(text) <= MEMO_MAX_LENGTH:
+        return _normalize_memo(text)
+    return _normalize(text)
+
+
+def normalize_many(texts: Iterable[str]) -> List[str]:
+    """Normalize a batch of strings (e.g. all medications of a prescription)"""
+    return [normalize_text(text) for text in texts]
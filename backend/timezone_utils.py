@@ -23,3 +23,12 @@ def sao_paulo_to_utc(sp_dt):
     if sp_dt.tzinfo is None:
         sp_dt = SAO_PAULO_TZ.localize(sp_dt)
     return sp_dt.astimezone(pytz.utc)
+
+def parse_utc(value):
+    """Parse an ISO date/datetime string to an aware UTC datetime (naive = UTC)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
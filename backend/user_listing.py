@@ -0,0 +1,134 @@
+"""
+Admin User Listings
+Keyset pagination for the admin user lists: each page continues after the
+(sort field, _id) of the previous page's last document, so page N costs the
+same index seek as page 1 instead of skipping N * limit documents.
+Filters (role, status, expiration window) run in MongoDB on compound indexes.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidId
+
+MAX_PAGE_SIZE = 1000
+
+# Datetimes come back UTC-aware, no per-document conversion needed
+AWARE_CODEC = CodecOptions(tz_aware=True, tzinfo=timezone.utc)
+
+LIST_PROJECTION = {
+    "_id": 1, "email": 1, "name": 1, "username": 1, "role": 1, "deleted": 1,
+    "created_at": 1, "expiration_date": 1, "deleted_at": 1, "reactivated_at": 1,
+    "last_activity": 1, "status": 1
+    # Exclude avatar_url to reduce payload
+}
+
+# Backs every sort/filter combination of the listings
+LIST_INDEXES = [
+    [("deleted", 1), ("created_at", -1), ("_id", -1)],
+    [("deleted", 1), ("role", 1), ("created_at", -1), ("_id", -1)],
+    [("deleted", 1), ("expiration_date", 1)],
+    [("deleted", 1), ("deleted_at", -1), ("_id", -1)]
+]
+
+STATUSES = ("active", "expired")
+
+# Not deleted, as point intervals: {"$ne": True} would give two range
+# intervals on the leading index field, and MongoDB could no longer read the
+# (created_at, _id) order from the index (blocking in-memory SORT)
+NOT_DELETED = {"$in": [False, None]}
+
+
+def encode_cursor(value: Optional[datetime], document_id: ObjectId) -> str:
+    """'<epoch ms>.<id>' ('-' for a missing sort value); MongoDB dates have ms precision"""
+    if value is None:
+        return f"-.{document_id}"
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return f"{round(value.timestamp() * 1000)}.{document_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], ObjectId]:
+    try:
+        millis, document_id = cursor.split(".", 1)
+        value = None if millis == "-" else datetime.fromtimestamp(int(millis) / 1000, timezone.utc)
+        return value, ObjectId(document_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Cursor inválido")
+
+
+def after_cursor(field: str, cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Documents after the cursor in (field desc, _id desc) order.
+    Missing/null values sort last in descending order, so they follow every date
+    """
+    if not cursor:
+        return {}
+    value, document_id = decode_cursor(cursor)
+    if value is None:
+        return {field: None, "_id": {"$lt": document_id}}
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, "_id": {"$lt": document_id}},
+        {field: None}
+    ]}
+
+
+def build_filters(role: Optional[str] = None, status: Optional[str] = None,
+                  expires_after: Optional[datetime] = None,
+                  expires_before: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    role: exact role (ADMIN, USER)
+    status: active (not expired) or expired (expiration passed, account not yet marked deleted)
+    expires_after/expires_before: expiration_date window
+    """
+    query: Dict[str, Any] = {}
+    if role:
+        query["role"] = role.upper()
+
+    expiration: Dict[str, Any] = {}
+    if expires_after:
+        expiration["$gte"] = expires_after
+    if expires_before:
+        expiration["$lt"] = expires_before
+    if status:
+        if status not in STATUSES:
+            raise ValueError(f"status deve ser um de: {', '.join(STATUSES)}")
+        now = datetime.now(timezone.utc)
+        if status == "expired":
+            expiration["$lt"] = min(expiration.get("$lt", now), now)
+        elif expiration:
+            expiration["$gte"] = max(expiration.get("$gte", now), now)
+        else:
+            query["$or"] = [{"expiration_date": None}, {"expiration_date": {"$gte": now}}]
+    if expiration:
+        query["expiration_date"] = expiration
+    return query
+
+
+async def list_page(collection, query: Dict[str, Any], field: str,
+                    cursor: Optional[str], limit: int,
+                    projection: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page sorted by (field desc, _id desc)
+    Returns (documents, cursor of the next page or None)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    keyset = after_cursor(field, cursor)
+    if keyset:
+        query = {"$and": [query, keyset]}
+    documents = await collection.with_options(codec_options=AWARE_CODEC).find(
+        query, projection
+    ).sort([(field, -1), ("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last.get(field), last["_id"])
+    return documents, next_cursor
+
+
+async def ensure_list_indexes(collection):
+    for keys in LIST_INDEXES:
+        await collection.create_index(keys)
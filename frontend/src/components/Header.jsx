@@ -10,6 +10,7 @@ import { toast } from "sonner";
 import { differenceInDays, intervalToDuration } from 'date-fns';
 import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import { useTheme } from "@/contexts/ThemeContext";
+import api from '@/lib/api';
 
 export const Header = memo(() => {
   const navigate = useNavigate();
@@ -123,6 +124,11 @@ export const Header = memo(() => {
   };
 
   const handleLogout = () => {
+    // End the session on the server too (best effort - local logout always happens)
+    const token = localStorage.getItem('token');
+    if (token) {
+      api.post('/auth/logout', null, { headers: { Authorization: `Bearer ${token}` } }).catch(() => {});
+    }
     localStorage.clear();
     toast.success("Logout realizado com sucesso");
     navigate('/login');
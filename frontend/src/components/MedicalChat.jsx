@@ -6,11 +6,13 @@ import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import { Send, Sparkles, User, BrainCircuit, Loader2, Copy, Check } from 'lucide-react';
 import { toast } from "sonner";
 import api from '@/lib/api';
+import { fetchEventStream, readEventStream } from '@/lib/sse';
 
 const MedicalChat = () => {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
+  const [isStreaming, setIsStreaming] = useState(false);
   const [copiedIndex, setCopiedIndex] = useState(null);
   const messagesEndRef = useRef(null);
   const textareaRef = useRef(null);
@@ -36,7 +38,7 @@ const MedicalChat = () => {
 
   const handleSubmit = async (e) => {
     e.preventDefault();
-    if (!input.trim() || isLoading) return;
+    if (!input.trim() || isLoading || isStreaming) return;
 
     const userMessage = input.trim();
     setInput('');
@@ -45,26 +47,59 @@ const MedicalChat = () => {
     setMessages(prev => [...prev, { role: 'user', content: userMessage }]);
     setIsLoading(true);
 
+    let streamStarted = false;
     try {
-      const response = await api.post('/medical-chat', {
-        message: userMessage,
-        history: messages
+      const response = await fetchEventStream('/medical-chat/stream', {
+        method: 'POST',
+        body: JSON.stringify({ message: userMessage, history: messages })
       });
 
-      // Add AI response
-      setMessages(prev => [...prev, { 
-        role: 'assistant', 
-        content: response.data.response 
-      }]);
+      // Show the answer as it is generated
+      setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+      streamStarted = true;
+      setIsStreaming(true);
+      setIsLoading(false);
+
+      await readEventStream(response, (event) => {
+        if (event.error) {
+          throw new Error(event.error);
+        }
+        if (event.delta) {
+          setMessages(prev => {
+            const last = prev[prev.length - 1];
+            return [...prev.slice(0, -1), { ...last, content: last.content + event.delta }];
+          });
+        }
+        return Boolean(event.done);
+      });
     } catch (error) {
+      if (!streamStarted) {
+        // Streaming unavailable - fall back to the regular endpoint
+        try {
+          const response = await api.post('/medical-chat', {
+            message: userMessage,
+            history: messages
+          });
+
+          setMessages(prev => [...prev, { 
+            role: 'assistant', 
+            content: response.data.response 
+          }]);
+          return;
+        } catch (fallbackError) {
+          error = fallbackError;
+        }
+      }
+
       console.error('Error sending message:', error);
       toast.error('Erro ao processar mensagem. Tente novamente.');
       
-      // Remove user message on error
-      setMessages(prev => prev.slice(0, -1));
+      // Remove user message (and partial answer) on error
+      setMessages(prev => prev.slice(0, streamStarted ? -2 : -1));
       setInput(userMessage); // Restore input
     } finally {
       setIsLoading(false);
+      setIsStreaming(false);
     }
   };
 
@@ -207,12 +242,12 @@ const MedicalChat = () => {
             onKeyDown={handleKeyDown}
             placeholder="Digite sua pergunta aqui... (Enter para enviar, Shift+Enter para nova linha)"
             className="pr-12 min-h-[100px] resize-none focus:ring-2 focus:ring-violet-500"
-            disabled={isLoading}
+            disabled={isLoading || isStreaming}
           />
           <Button
             type="submit"
             size="icon"
-            disabled={!input.trim() || isLoading}
+            disabled={!input.trim() || isLoading || isStreaming}
             className="absolute right-2 bottom-2 bg-gradient-to-r from-violet-600 to-purple-600 hover:from-violet-700 hover:to-purple-700"
           >
             {isLoading ? (
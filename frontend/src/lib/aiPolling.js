@@ -1,9 +1,10 @@
 /**
  * AI Polling Utility
- * Handles polling for background AI tasks
+ * Handles streaming (Server-Sent Events) and polling for background AI tasks
  */
 
 import api from './api';
+import { fetchEventStream, readEventStream } from './sse';
 
 /**
  * Poll a background task until completion
@@ -68,7 +69,41 @@ export async function pollTask(taskId, onProgress = null, pollInterval = 3000, m
 }
 
 /**
- * Start a background AI consensus task and poll for result
+ * Follow a background task through its Server-Sent Events stream
+ * Uses fetch (not EventSource) so the Authorization header can be sent
+ * @param {string} taskId - Task ID returned from initial API call
+ * @param {function} onProgress - Callback for progress updates (optional)
+ * @returns {Promise<object>} - Final result when task completes
+ */
+export async function streamTask(taskId, onProgress = null) {
+  const response = await fetchEventStream(`/ai/tasks/${taskId}/events`);
+  let result;
+
+  const finished = await readEventStream(response, (task) => {
+    if (onProgress) {
+      onProgress(task);
+    }
+    if (task.status === 'completed') {
+      result = task.result;
+      return true;
+    }
+    if (task.status === 'failed') {
+      const error = new Error(task.error || 'Erro ao processar análise');
+      error.taskFailed = true;
+      throw error;
+    }
+    return false;
+  });
+
+  if (!finished) {
+    throw new Error('Stream closed before task finished');
+  }
+  return result;
+}
+
+/**
+ * Start a background AI consensus task and wait for the result
+ * Streams updates when possible, falling back to polling
  * @param {string} endpoint - API endpoint (e.g., '/api/ai/consensus/diagnosis')
  * @param {object} data - Request payload
  * @param {function} onProgress - Progress callback (optional)
@@ -83,8 +118,16 @@ export async function startAITask(endpoint, data, onProgress = null) {
       throw new Error('No task_id returned from server');
     }
     
-    const result = await pollTask(task_id, onProgress);
-    return result;
+    try {
+      return await streamTask(task_id, onProgress);
+    } catch (streamError) {
+      // Task failures are final; anything else (proxy, network, timeout) falls back to polling
+      if (streamError.taskFailed) {
+        throw streamError;
+      }
+      console.warn('[aiPolling] Stream unavailable, polling instead:', streamError.message);
+      return await pollTask(task_id, onProgress);
+    }
     
   } catch (error) {
     console.error('[aiPolling] Error:', error.message);
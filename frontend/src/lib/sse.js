@@ -0,0 +1,72 @@
+/**
+ * Server-Sent Events helpers
+ * Reads a text/event-stream body from fetch (works with POST and auth headers)
+ */
+
+import api from './api';
+
+/**
+ * fetch() an event-stream endpoint with the stored auth token
+ * @param {string} path - API path relative to the API base (e.g. '/medical-chat/stream')
+ * @param {object} options - fetch options (method, body, ...)
+ * @returns {Promise<Response>}
+ */
+export async function fetchEventStream(path, options = {}) {
+  const token = localStorage.getItem('token');
+  const response = await fetch(`${api.defaults.baseURL}${path}`, {
+    ...options,
+    headers: {
+      ...(options.body ? { 'Content-Type': 'application/json' } : {}),
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      ...(options.headers || {}),
+    },
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error(`Stream unavailable (${response.status})`);
+  }
+  return response;
+}
+
+/**
+ * Call onData with the parsed JSON of every `data:` event until the stream ends
+ * or onData returns true (stop reading)
+ * @param {Response} response - Response returned by fetchEventStream
+ * @param {function} onData - Callback receiving each parsed event payload
+ * @returns {Promise<boolean>} - true if stopped by onData, false if the stream ended
+ */
+export async function readEventStream(response, onData) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) return false;
+
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+
+    for (const event of events) {
+      const data = event
+        .split('\n')
+        .filter(line => line.startsWith('data: '))
+        .map(line => line.slice(6))
+        .join('\n');
+      if (!data) continue; // keep-alive comment
+
+      let stop;
+      try {
+        stop = onData(JSON.parse(data));
+      } catch (error) {
+        reader.cancel();
+        throw error;
+      }
+      if (stop) {
+        reader.cancel();
+        return true;
+      }
+    }
+  }
+}
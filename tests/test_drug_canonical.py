@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Drug name canonicalization: salt forms must reduce to the active ingredient
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from drug_canonical import canonical_drug_name  # noqa: E402
+
+CASES = [
+    ("Cloridrato de Sertralina 50mg", "sertralina 50mg"),
+    ("cloridrato de metformina 850 mg", "metformina 850mg"),
+    ("Maleato de Enalapril 10 mg", "enalapril 10mg"),
+    ("Besilato de Anlodipino 5mg", "anlodipino 5mg"),
+    ("Mesilato de Doxazosina 2 mg", "doxazosina 2mg"),
+    ("Losartana Potássica 50 mg", "losartana 50mg"),
+    ("Enalapril maleato", "enalapril"),
+    ("Diclofenaco Sódico", "diclofenaco"),
+    # "de" that is not after a salt word is part of the name
+    ("Óleo de Rícino", "oleo de ricino"),
+]
+
+
+def test_salt_forms():
+    for name, expected in CASES:
+        assert canonical_drug_name(name) == expected, name
+
+
+if __name__ == "__main__":
+    failures = 0
+    for name, expected in CASES:
+        found = canonical_drug_name(name)
+        ok = found == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {name!r} -> {found!r}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+LLM response parser: JSON extraction, truncation repair and schema validation
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from ai_engine import DiagnosisResult  # noqa: E402
+from llm_response_parser import LlmResponseError, extract_json, extract_json_checked  # noqa: E402
+
+DIAGNOSIS = (
+    '{"diagnoses": [{"name": "Enxaqueca", "probability": 0.7}], '
+    '"conduct": {"advice": "Repouso"}, '
+    '"medications": [{"name": "Dipirona", "dosage": "1g"}]}'
+)
+
+
+def test_fenced_json():
+    assert extract_json_checked(f"```json\n{DIAGNOSIS}\n```") == (extract_json(DIAGNOSIS), False)
+
+
+def test_prose_around_the_object():
+    data, repaired = extract_json_checked(f"Segue a análise:\n{DIAGNOSIS}\nEspero ter ajudado.")
+    assert data["conduct"] == {"advice": "Repouso"}
+    assert not repaired
+
+
+def test_truncated_answer_is_repaired_and_flagged():
+    data, repaired = extract_json_checked('{"diagnoses": [{"name": "Enxaqueca"}, {"name": "Cefal')
+    assert repaired
+    assert data["diagnoses"][0] == {"name": "Enxaqueca"}
+
+
+def test_truncated_answer_validates_against_the_schema():
+    truncated = DIAGNOSIS[:-2] + ', {"name": "Ibupro'
+    data, repaired = extract_json_checked(truncated, DiagnosisResult)
+    assert repaired
+    assert data["medications"][0] == {"name": "Dipirona", "dosage": "1g"}
+    # Cut before a required field: nothing to repair into a valid answer
+    with pytest.raises(LlmResponseError):
+        extract_json_checked(DIAGNOSIS[:DIAGNOSIS.index('"medications"')], DiagnosisResult)
+
+
+def test_mismatched_closer_is_skipped_not_repaired():
+    assert extract_json_checked('Veja [nota} abaixo: {"a": 1}') == ({"a": 1}, False)
+    with pytest.raises(LlmResponseError):
+        extract_json_checked('{"a": [1, 2}')
+
+
+def test_schema_skips_values_that_do_not_match():
+    data = extract_json(f'[1, 2] e depois {DIAGNOSIS}', DiagnosisResult)
+    assert data["diagnoses"][0]["name"] == "Enxaqueca"
+
+
+def test_numeric_values_validate_as_diagnosis():
+    data = extract_json(DIAGNOSIS, DiagnosisResult)
+    assert data["diagnoses"][0]["probability"] == 0.7
+
+
+def test_empty_or_prose_only_answer_raises():
+    for text in ("", "Não foi possível analisar."):
+        with pytest.raises(LlmResponseError):
+            extract_json(text)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
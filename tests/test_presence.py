@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Presence: deleted accounts leave the online count right away
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from activity_tracker import ActivityBuffer  # noqa: E402
+
+
+def test_forget_by_id_and_email():
+    buffer = ActivityBuffer(window=300, bucket_seconds=10)
+    buffer.touch("1", "ana@example.com")
+    buffer.touch("2", "bia@example.com")
+    buffer.touch("3")
+    assert buffer.online_count(300) == 3
+
+    assert buffer.forget("ana@example.com")
+    assert buffer.forget("2")
+    assert not buffer.forget("unknown")
+    assert buffer.online_count(300) == 1
+    assert list(buffer.active_since(300)) == ["3"]
+
+
+def test_forgotten_user_counts_again_after_new_activity():
+    buffer = ActivityBuffer(window=300, bucket_seconds=10)
+    buffer.touch("1", "ana@example.com")
+    buffer.forget("1")
+    buffer.touch("1", "ana@example.com")
+    assert buffer.online_count(300) == 1
+    assert len(buffer.presence) == 1
+
+
+if __name__ == "__main__":
+    test_forget_by_id_and_email()
+    test_forgotten_user_counts_again_after_new_activity()
+    print("✅ presence tests passed")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Rule engine keyword matching: short terms must not prefix unrelated words
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from ai_engine import analyze_simple_diagnosis, get_medication_guide  # noqa: E402
+
+RESPIRATORY = "Infecção Respiratória Alta / Pneumonia"
+
+
+def diagnosis_names(text):
+    return [item["name"] for item in analyze_simple_diagnosis(text).diagnoses]
+
+
+def test_ardor_ao_urinar_keeps_analgesics():
+    assert get_medication_guide("ardor ao urinar")[0].name == "Dipirona"
+
+
+def test_words_starting_with_ar_are_not_respiratory():
+    for text in ("arritmia", "ardor ao urinar"):
+        assert RESPIRATORY not in diagnosis_names(text), text
+    assert get_medication_guide("arritmia")[0].name != "Ambroxol"
+
+
+def test_falta_de_ar_is_respiratory():
+    assert diagnosis_names("falta de ar")[0] == RESPIRATORY
+    assert get_medication_guide("falta de ar")[0].name == "Ambroxol"
+
+
+if __name__ == "__main__":
+    test_ardor_ao_urinar_keeps_analgesics()
+    test_words_starting_with_ar_are_not_respiratory()
+    test_falta_de_ar_is_respiratory()
+    print("✅ keyword matching tests passed")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Rule engine regression: red-flag diagnoses must outrank generic pain, and
+generic keywords alone must not add differentials
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from ai_engine import analyze_simple_diagnosis  # noqa: E402
+
+SCA = "Síndrome Coronariana Aguda (SCA) - A descartar"
+ABDOME_AGUDO = "Abdome Agudo (etiologia a esclarecer)"
+MUSCULOSKELETAL = "Dor Musculoesquelética / Lombalgia Mecânica"
+
+CASES = [
+    ("dor no peito irradiando para braço esquerdo", SCA),
+    ("dor precordial irradiando para o braço", SCA),
+    ("dor no peito e na perna", SCA),
+    ("dor na barriga e nas costas", ABDOME_AGUDO),
+    ("dor nas costas", MUSCULOSKELETAL),
+]
+
+# Complaints whose other matches are only "dor"/"febre": no differential
+SINGLE_DIAGNOSIS = [
+    ("dor de garganta", "Infecção Respiratória Alta / Pneumonia"),
+    ("dor de cabeça", "Enxaqueca (Migrânea)"),
+    ("dor abdominal com febre", ABDOME_AGUDO),
+]
+
+
+def top_diagnosis(text):
+    return analyze_simple_diagnosis(text).diagnoses[0]["name"]
+
+
+def test_red_flags_rank_first():
+    for text, expected in CASES:
+        assert top_diagnosis(text) == expected, text
+
+
+def test_generic_keywords_add_no_differentials():
+    for text, expected in SINGLE_DIAGNOSIS:
+        names = [item["name"] for item in analyze_simple_diagnosis(text).diagnoses]
+        assert names == [expected], text
+
+
+def test_specific_matches_still_add_differentials():
+    names = [item["name"] for item in analyze_simple_diagnosis("febre tosse e dor no peito").diagnoses]
+    assert names == [SCA, "Infecção Respiratória Alta / Pneumonia"]
+
+
+if __name__ == "__main__":
+    failures = 0
+    for text, expected in CASES:
+        found = top_diagnosis(text)
+        ok = found == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {text!r} -> {found}")
+    for text, expected in SINGLE_DIAGNOSIS:
+        found = [item["name"] for item in analyze_simple_diagnosis(text).diagnoses]
+        ok = found == [expected]
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {text!r} -> {found}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Drug interaction fallback: no finding must never read as a safe combination
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from rule_fallbacks import drug_interaction_fallback  # noqa: E402
+
+
+def test_unknown_drugs_are_not_reported_as_mild():
+    result = drug_interaction_fallback(["xyz", "abc"])
+    assert result["severity"] == "BAIXA ou DESCONHECIDA"
+    assert "xyz" in result["summary"] and "abc" in result["summary"]
+
+
+def test_known_pair_without_interaction():
+    result = drug_interaction_fallback(["paracetamol", "omeprazol"])
+    assert result["severity"] == "BAIXA ou DESCONHECIDA"
+    assert "não reconhecidos" not in result["summary"]
+
+
+def test_unresolved_drug_is_named_next_to_findings():
+    result = drug_interaction_fallback(["varfarina", "aspirina", "xyz"])
+    assert result["severity"] != "BAIXA ou DESCONHECIDA"
+    assert "xyz" in result["summary"]
+
+
+if __name__ == "__main__":
+    test_unknown_drugs_are_not_reported_as_mild()
+    test_known_pair_without_interaction()
+    test_unresolved_drug_is_named_next_to_findings()
+    print("✅ rule fallback tests passed")
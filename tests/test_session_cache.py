@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Session cache: a cached session never outlives its token
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from session_cache import SessionCache  # noqa: E402
+
+
+def test_hit_before_token_expiry():
+    cache = SessionCache(ttl=30)
+    cache.put("token", "user", "1", token_expires_at=time.time() + 60)
+    assert cache.get("token") == "user"
+
+
+def test_expired_token_is_not_served():
+    cache = SessionCache(ttl=30)
+    cache.put("token", "user", "1", token_expires_at=time.time() + 0.05)
+    time.sleep(0.1)
+    assert cache.get("token") is None
+    assert cache.invalidate_user("1") == 0
+
+
+def test_invalidate_user():
+    cache = SessionCache(ttl=30)
+    cache.put("token", "user", "1", "ana@example.com")
+    assert cache.invalidate_user("ana@example.com") == 1
+    assert cache.get("token") is None
+
+
+if __name__ == "__main__":
+    test_hit_before_token_expiry()
+    test_expired_token_is_not_served()
+    test_invalidate_user()
+    print("✅ session cache tests passed")
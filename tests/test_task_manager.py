@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+TaskManager: coalescing, watch_task and the Mongo task store (batched writes,
+orphaned tasks), in THREAD and ASYNC execution modes
+"""
+import sys
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from retry_policy import RetryPolicy  # noqa: E402
+from task_manager import ExecutionMode, TaskManager, TaskStatus  # noqa: E402
+from task_store import MongoTaskStore  # noqa: E402
+
+MODES = [ExecutionMode.THREAD, ExecutionMode.ASYNC]
+
+
+class FakeUpdateResult:
+    def __init__(self, modified_count: int):
+        self.modified_count = modified_count
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for MongoTaskStore"""
+
+    def __init__(self, documents=None):
+        self.documents = {document["_id"]: dict(document) for document in documents or []}
+        self.bulk_writes = []
+        self.update_many_filters = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(operations)
+        for operation in operations:
+            task_id = operation._filter["_id"]
+            self.documents.setdefault(task_id, {"_id": task_id}).update(operation._doc["$set"])
+
+    async def find_one(self, query, projection=None):
+        document = self.documents.get(query["_id"])
+        if document is None:
+            return None
+        return {key: value for key, value in document.items() if key != "_id"}
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    async def update_many(self, query, update):
+        self.update_many_filters.append(query)
+        cutoff = query["$or"][0]["heartbeat_at"]["$lt"]
+        modified = 0
+        for document in self.documents.values():
+            seen = document.get("heartbeat_at", document.get("created_at"))
+            if document.get("status") in query["status"]["$in"] and seen < cutoff:
+                document.update(update["$set"])
+                modified += 1
+        return FakeUpdateResult(modified)
+
+
+class FakeAnalysis:
+    """Async task function that counts its executions (from any thread)"""
+
+    __name__ = "fake_analysis"
+
+    def __init__(self, delay: float = 0.05, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    async def __call__(self, text: str):
+        with self._lock:
+            self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {"diagnosis": text.upper()}
+
+
+def make_manager(mode, store=None):
+    return TaskManager(
+        store=store,
+        execution_mode=mode,
+        default_retry_policy=RetryPolicy(max_attempts=1)
+    )
+
+
+async def wait_done(manager, task_id):
+    """Follow a task through watch_task until its terminal update"""
+    updates = []
+    async for task in manager.watch_task(task_id, heartbeat=0.5, timeout=5):
+        if task is not None:
+            updates.append(dict(task))
+    return updates
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_coalesced_tasks_share_one_execution(mode):
+    async def run():
+        manager = make_manager(mode)
+        await manager.start()
+        analysis = FakeAnalysis()
+        first = manager.create_task("diagnosis", coalesce_key="dor de cabeca")
+        second = manager.create_task("diagnosis", coalesce_key="dor de cabeca")
+        other = manager.create_task("diagnosis", coalesce_key="febre")
+        for task_id, text in ((first, "dor de cabeca"), (second, "dor de cabeca"), (other, "febre")):
+            await manager.execute_task(task_id, analysis, text)
+
+        results = await asyncio.gather(*(wait_done(manager, task_id) for task_id in (first, second, other)))
+        await manager.shutdown()
+        return manager, analysis, first, second, results
+
+    manager, analysis, first, second, results = asyncio.run(run())
+    assert analysis.calls == 2
+    assert results[1][-1]["coalesced_with"] == first
+    for updates in results:
+        assert updates[-1]["status"] == TaskStatus.COMPLETED
+    assert results[0][-1]["result"] == results[1][-1]["result"] == {"diagnosis": "DOR DE CABECA"}
+    # The key is released once the primary finishes
+    assert not manager._inflight and not manager._aliases and not manager._alias_of
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_alias_mirrors_failure(mode):
+    async def run():
+        manager = make_manager(mode)
+        await manager.start()
+        analysis = FakeAnalysis(error=ValueError("resposta inválida"))
+        first = manager.create_task("diagnosis", coalesce_key="k")
+        second = manager.create_task("diagnosis", coalesce_key="k")
+        await manager.execute_task(first, analysis, "x")
+        await manager.execute_task(second, analysis, "x")
+        updates = await wait_done(manager, second)
+        await manager.shutdown()
+        return analysis, updates
+
+    analysis, updates = asyncio.run(run())
+    assert analysis.calls == 1
+    assert updates[-1]["status"] == TaskStatus.FAILED
+    assert "resposta inválida" in updates[-1]["error"]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_watch_task_yields_until_terminal(mode):
+    async def run():
+        manager = make_manager(mode)
+        await manager.start()
+        task_id = manager.create_task("diagnosis")
+        await manager.execute_task(task_id, FakeAnalysis(delay=0.2), "tosse")
+        updates = await wait_done(manager, task_id)
+        await manager.shutdown()
+        return updates
+
+    updates = asyncio.run(run())
+    statuses = [update["status"] for update in updates]
+    assert statuses[-1] == TaskStatus.COMPLETED
+    assert TaskStatus.PROCESSING in statuses
+    assert updates[-1]["progress"] == 100
+
+
+def test_watch_unknown_task_stops():
+    async def run():
+        manager = make_manager(ExecutionMode.ASYNC)
+        return await wait_done(manager, "missing")
+
+    assert asyncio.run(run()) == []
+
+
+def test_mongo_store_coalesces_writes_per_task():
+    async def run():
+        collection = FakeCollection()
+        store = MongoTaskStore(collection, flush_interval=60)
+        store.save({"id": "a", "status": TaskStatus.PENDING, "progress": 0, "created_at": datetime.now(timezone.utc)})
+        store.update("a", {"status": TaskStatus.PROCESSING, "progress": 10})
+        store.update("a", {"progress": 50})
+        store.save({"id": "b", "status": TaskStatus.PENDING, "progress": 0, "created_at": datetime.now(timezone.utc)})
+        await store.flush()
+        return collection
+
+    collection = asyncio.run(run())
+    assert len(collection.bulk_writes) == 1
+    assert len(collection.bulk_writes[0]) == 2
+    # Enums are stored as plain values, the latest update wins
+    assert collection.documents["a"]["status"] == "processing"
+    assert collection.documents["a"]["progress"] == 50
+    assert "heartbeat_at" in collection.documents["a"]
+
+
+def test_mongo_store_flushes_completion_immediately():
+    async def run():
+        collection = FakeCollection()
+        store = MongoTaskStore(collection, flush_interval=60)
+        await store.start()
+        store.save({"id": "a", "status": TaskStatus.PENDING, "progress": 0, "created_at": datetime.now(timezone.utc)})
+        store.update("a", {"status": TaskStatus.COMPLETED, "result": {"ok": True}}, urgent=True)
+        await asyncio.sleep(0.1)
+        writes = len(collection.bulk_writes)
+        await store.close()
+        return collection, writes
+
+    collection, writes = asyncio.run(run())
+    assert writes == 1
+    assert collection.documents["a"]["result"] == {"ok": True}
+
+
+def test_mongo_store_closes_right_after_an_urgent_write():
+    async def run():
+        store = MongoTaskStore(FakeCollection(), flush_interval=5)
+        await store.start()
+        store.save({"id": "a", "status": TaskStatus.PENDING, "progress": 0, "created_at": datetime.now(timezone.utc)})
+        await asyncio.sleep(0.05)
+        store.update("a", {"status": TaskStatus.FAILED, "error": "x"}, urgent=True)
+        await asyncio.sleep(0)
+        started = asyncio.get_running_loop().time()
+        await store.close()
+        return store.collection, asyncio.get_running_loop().time() - started
+
+    collection, elapsed = asyncio.run(run())
+    # Must not wait for the next flush_interval
+    assert elapsed < 1
+    assert collection.documents["a"]["status"] == "failed"
+
+
+def test_mongo_store_reads_tasks_of_other_workers():
+    async def run():
+        collection = FakeCollection([{"_id": "remote", "id": "remote", "status": "completed"}])
+        store = MongoTaskStore(collection)
+        return await store.get("remote"), store.get_local("remote")
+
+    task, local = asyncio.run(run())
+    assert task == {"id": "remote", "status": "completed"}
+    assert local is None
+
+
+def test_mongo_store_fails_orphaned_tasks_on_start():
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(minutes=10)
+
+    async def run():
+        collection = FakeCollection([
+            {"_id": "orphan", "status": "processing", "created_at": old, "heartbeat_at": old},
+            {"_id": "legacy", "status": "pending", "created_at": old},
+            {"_id": "live", "status": "processing", "created_at": old, "heartbeat_at": now},
+            {"_id": "done", "status": "completed", "created_at": old, "heartbeat_at": old},
+        ])
+        store = MongoTaskStore(collection, stale_after=60)
+        await store.start()
+        await store.close()
+        return collection
+
+    documents = asyncio.run(run()).documents
+    assert documents["orphan"]["status"] == "failed"
+    assert documents["orphan"]["error"]
+    assert documents["legacy"]["status"] == "failed"
+    assert documents["live"]["status"] == "processing"
+    assert "error" not in documents["done"]
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_task_manager_with_mongo_store(mode):
+    async def run():
+        collection = FakeCollection()
+        manager = make_manager(mode, MongoTaskStore(collection, flush_interval=60))
+        await manager.start()
+        first = manager.create_task("diagnosis", coalesce_key="k")
+        second = manager.create_task("diagnosis", coalesce_key="k")
+        analysis = FakeAnalysis()
+        await manager.execute_task(first, analysis, "febre")
+        await manager.execute_task(second, analysis, "febre")
+        await wait_done(manager, second)
+        await manager.shutdown()
+        return collection, analysis, first, second
+
+    collection, analysis, first, second = asyncio.run(run())
+    assert analysis.calls == 1
+    for task_id in (first, second):
+        assert collection.documents[task_id]["status"] == "completed"
+        assert collection.documents[task_id]["result"] == {"diagnosis": "FEBRE"}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))